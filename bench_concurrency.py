@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from config import DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_MMAP_SIZE, DB_CACHE_SIZE, DB_BUSY_TIMEOUT
+from database import Database
+
+
+# Пропускная способность SQLite при одновременных чтениях и записях: настройки по умолчанию
+# (журнал отката) против профиля из config.py (WAL, synchronous, mmap, cache, busy_timeout).
+#
+#   python bench_concurrency.py --users 20000 --readers 8 --writers 3 --seconds 3
+#
+# Читатели ищут пользователя по username, писатели обновляют одну строку; все идут через
+# Database с тем же пулом соединений, что и бот. Базы создаются заново в --data-dir.
+
+TUNED_PRAGMAS = {
+    "busy_timeout": DB_BUSY_TIMEOUT,
+    "journal_mode": DB_JOURNAL_MODE,
+    "synchronous": DB_SYNCHRONOUS,
+    "mmap_size": DB_MMAP_SIZE,
+    "cache_size": DB_CACHE_SIZE,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Одновременные чтения и записи SQLite до и после настройки")
+    parser.add_argument("--users", type=int, default=20000, help="строк в таблице users")
+    parser.add_argument("--readers", type=int, default=8, help="одновременных задач чтения")
+    parser.add_argument("--writers", type=int, default=3, help="одновременных задач записи")
+    parser.add_argument("--pool", type=int, default=4, help="соединений-читателей в пуле")
+    parser.add_argument("--seconds", type=float, default=3.0, help="длительность каждого замера")
+    parser.add_argument("--data-dir", default="bench_data", help="каталог для временных баз")
+    return parser.parse_args()
+
+
+def remove_db(path: str):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+async def run(args, label: str, pragmas: dict) -> tuple[float, float]:
+    path = os.path.join(args.data_dir, f"concurrency_{label}.sqlite")
+    remove_db(path)
+    database = Database(path, args.pool, pragmas)
+    await database.start()
+    async with database.write() as conn:
+        await conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT UNIQUE, user_id INTEGER, warnings INTEGER NOT NULL DEFAULT 0)")
+        await conn.executemany("INSERT INTO users (username, user_id) VALUES (?, ?)", [(f"user{i}", i) for i in range(args.users)])
+
+    deadline = time.perf_counter() + args.seconds
+    reads = writes = 0
+
+    async def reader():
+        nonlocal reads
+        while time.perf_counter() < deadline:
+            await database.fetchone("SELECT user_id FROM users WHERE username = ?", (f"user{random.randrange(args.users)}",))
+            reads += 1
+
+    async def writer():
+        nonlocal writes
+        while time.perf_counter() < deadline:
+            await database.execute("UPDATE users SET warnings = warnings + 1 WHERE username = ?", (f"user{random.randrange(args.users)}",))
+            writes += 1
+
+    await asyncio.gather(*(reader() for _ in range(args.readers)), *(writer() for _ in range(args.writers)))
+    await database.close()
+    remove_db(path)
+    return reads / args.seconds, writes / args.seconds
+
+
+async def main():
+    args = parse_args()
+    os.makedirs(args.data_dir, exist_ok=True)
+    print(f"{args.users} пользователей, {args.pool} читателя в пуле, {args.readers} задач чтения, {args.writers} задач записи, {args.seconds} сек")
+    for label, pragmas in (("default", {}), ("tuned", TUNED_PRAGMAS)):
+        reads, writes = await run(args, label, pragmas)
+        print(f"{label:>8}: {reads:8.0f} чтений/с  {writes:8.0f} записей/с")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+
+import config
+
+
+# Микробенчмарки горячих функций functions.py на сгенерированных базах разного размера.
+#
+#   python benchmarks.py --sizes 1000,100000,1000000 --output bench.json
+#   python benchmarks.py --sizes 1000 --compare bench.json   # сравнить с прошлым прогоном
+#
+# Для каждого размера N база содержит N пользователей, N кейсов и N/10 записей blacklist.
+# Базы лежат в --data-dir и переиспользуются между прогонами (--rebuild пересоздаёт).
+# Telegram не вызывается: сообщения уходят через настоящий MessageSender в заглушку бота.
+# Результаты (среднее, минимум, p50, p90 на вызов) пишутся в JSON вместе с коммитом,
+# с --compare выводится разница с прошлым файлом и код возврата 1 при регрессии.
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Микробенчмарки функций бота")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="размеры баз через запятую")
+    parser.add_argument("--data-dir", default="bench_data", help="каталог для сгенерированных баз")
+    parser.add_argument("--rebuild", action="store_true", help="пересоздать базы, даже если они есть")
+    parser.add_argument("--min-time", type=float, default=1.0, help="минимальное время замера одной функции, сек")
+    parser.add_argument("--max-iterations", type=int, default=1000, help="не больше стольких замеров на функцию")
+    parser.add_argument("--output", default="bench_results.json", help="файл для результатов")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="замедление, считающееся регрессией (0.2 = +20%%)")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+class FakeBot:
+    """Заглушка Bot: принимает сообщения и ничего не отправляет."""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.sent += 1
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def db_path(data_dir: str, size: int) -> str:
+    return os.path.join(data_dir, f"bench_{size}.sqlite")
+
+
+def remove_db(path: str):
+    for name in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def fill_db(path: str, size: int, rng: random.Random):
+    """Заполняет базу с уже созданной схемой: size пользователей и кейсов, size/10 записей blacklist."""
+    now = int(time.time())
+    types = ["бан", "мут", "предупреждение"]
+    conn = sqlite3.connect(path)
+    try:
+        conn.executemany(
+            "INSERT INTO users (username, user_id, muted_until, muted_reason) VALUES (?, ?, ?, ?)",
+            ((f"user{i}", 10_000_000 + i, now + 3600 if i % 50 == 0 else 0, "флуд" if i % 50 == 0 else "") for i in range(size))
+        )
+        # Кейсы распределены по пользователям случайно, номера — по дням в прошлом
+        conn.executemany(
+            "INSERT INTO badcases (case_id, username, user_id, type, moderator) VALUES (?, ?, ?, ?, ?)",
+            (
+                (f"TKS-2025{1 + i // 10000 % 12:02d}{1 + i // 1000 % 28:02d}-{i:07d}", f"user{user}", 10_000_000 + user, rng.choice(types), "moderator")
+                for i, user in ((i, rng.randrange(size)) for i in range(size))
+            )
+        )
+        conn.executemany(
+            "INSERT INTO blacklist (username, user_id, until, reason) VALUES (?, ?, ?, ?)",
+            ((f"user{i}", 10_000_000 + i, 0 if i % 3 else now + 86400, "спам") for i in range(0, size, 10))
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def measure(call, min_time: float, max_iterations: int, number: int = 1) -> dict:
+    """
+    Вызывает call() (обычную функцию или корутину), пока не пройдёт min_time секунд
+    или max_iterations замеров. Один замер — number вызовов подряд (для быстрых функций).
+    Время в результатах — на один вызов.
+    """
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_iterations and (not samples or time.perf_counter() - started < min_time):
+        begin = time.perf_counter()
+        for _ in range(number):
+            result = call()
+            if asyncio.iscoroutine(result):
+                await result
+        samples.append((time.perf_counter() - begin) / number)
+    return {
+        "calls": len(samples) * number,
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 6),
+        "min_ms": round(min(samples) * 1000, 6),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 6),
+        "p90_ms": round(percentile(samples, 0.90) * 1000, 6),
+    }
+
+
+async def run(args) -> dict:
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    os.makedirs(args.data_dir, exist_ok=True)
+    rng = random.Random(args.seed)
+
+    # База бенчмарка подставляется до импорта functions (DB_NAME читается при импорте)
+    config.DB_NAME = db_path(args.data_dir, sizes[0])
+    config.TOKEN = "1000000:benchmark-fake-token"
+    config.WORKERS = 1
+
+    import database
+    import functions
+    from logs import setup_logging, stop_logging
+    from sender import MessageSender
+
+    bot = FakeBot()
+    # Настоящая очередь отправки без ограничений скорости — меряем постановку в очередь, а не лимиты Telegram
+    functions.sender = MessageSender(bot, global_rate=1e9, private_rate=1e9, group_rate=1e9)
+
+    words_path = os.path.join(args.data_dir, "forbidden_words_5000.txt")
+    with open(words_path, "w", encoding="utf-8") as file:
+        file.write("\n".join(f"слово{i}" for i in range(5000)))
+
+    def add_case(index: int):
+        return functions.add_badcase(f"user{index}", 10_000_000 + index, "moderator", "мут", 3600, "бенчмарк")
+
+    results = {}
+    devnull = open(os.devnull, "w", encoding="utf-8")
+    # Журнал настроен как в работе бота, но пишет в /dev/null: его стоимость входит в замер
+    with contextlib.redirect_stdout(devnull):
+        setup_logging()
+
+    async def bench(name: str, call, number: int = 1, size: int | None = None):
+        with contextlib.redirect_stdout(devnull):
+            stats = await measure(call, args.min_time, args.max_iterations, number)
+        key = f"{name}[{size}]" if size is not None else name
+        results[key] = {"name": name, "size": size, **stats}
+        print(f"{key:<50} {stats['mean_ms']:>12.4f} мс  (p50 {stats['p50_ms']:.4f}, p90 {stats['p90_ms']:.4f}, вызовов {stats['calls']})")
+
+    try:
+        # Функции без базы данных
+        clean = "Всем привет, встречаемся завтра в семь вечера у входа"
+        long_text = " ".join(rng.choice(["обычный", "текст", "сообщения", "в", "группе"]) for _ in range(700))[:4096]
+        with open(functions.forbidden_words.file_path, encoding="utf-8") as file:
+            bad_word = next((line.strip() for line in file if line.strip()), "запрещено")
+        default_words = functions.forbidden_words.file_path
+        for label, path in (("repo", default_words), ("5000", words_path)):
+            functions.forbidden_words.file_path = path
+            functions.forbidden_words.mtime = None
+            hit = f"ну ты и {bad_word if label == 'repo' else 'слово4999'} конечно"
+            await bench(f"check_forbidden_words/{label}/short", lambda: functions.check_forbidden_words(clean), 100)
+            await bench(f"check_forbidden_words/{label}/4096", lambda: functions.check_forbidden_words(long_text), 10)
+            await bench(f"check_forbidden_words/{label}/hit", lambda: functions.check_forbidden_words(hit), 100)
+        functions.forbidden_words.file_path = default_words
+        functions.forbidden_words.mtime = None
+        await bench("parse_time", lambda: functions.parse_time("15m"), 1000)
+        await bench("parse_time/invalid", lambda: functions.parse_time("abc"), 1000)
+        await bench("format_time", lambda: functions.format_time(7200), 1000)
+
+        # Функции с базой данных, по размерам
+        for size in sizes:
+            path = db_path(args.data_dir, size)
+            await functions.close_db()
+            if args.rebuild or not os.path.exists(path):
+                remove_db(path)
+                print(f"Генерируем базу на {size} записей: {path}")
+                started = time.perf_counter()
+                database.db.path = path
+                with contextlib.redirect_stdout(devnull):
+                    await functions.init_db()
+                    await functions.close_db()
+                fill_db(path, size, rng)
+                print(f"База готова за {time.perf_counter() - started:.1f} сек")
+            database.db.path = path
+            functions.DB_NAME = path
+            with contextlib.redirect_stdout(devnull):
+                await functions.init_db()
+
+            users = await functions.load_users()
+            blacklist = await functions.load_blacklist()
+            last_case = (await functions.db.fetchone("SELECT MAX(id) FROM badcases"))[0] or 0
+            # Случайные существующие пользователи для точечных запросов
+            probe = [rng.randrange(size) for _ in range(1000)]
+            picks = itertools.cycle(probe)
+
+            await bench("load_users", functions.load_users, size=size)
+            await bench("save_users", lambda: functions.save_users(users), size=size)
+            await bench("load_blacklist", functions.load_blacklist, size=size)
+            await bench("save_blacklist", lambda: functions.save_blacklist(blacklist), size=size)
+            await bench("add_badcase", lambda: add_case(next(picks)), size=size)
+            await bench("sort_users_cases/username", lambda: functions.sort_users_cases_by_username_or_id(username=f"user{next(picks)}"), size=size)
+            await bench("sort_users_cases/user_id", lambda: functions.sort_users_cases_by_username_or_id(user_id=10_000_000 + next(picks)), size=size)
+            # Кейсы бенчмарка удаляем, чтобы база оставалась одинаковой между прогонами
+            async with functions.db.write() as conn:
+                await conn.execute("DELETE FROM badcases WHERE id > ?", (last_case,))
+                await conn.execute("DELETE FROM case_sequence")
+            await functions.close_db()
+    finally:
+        await functions.sender.close(timeout=1)
+        await functions.close_db()
+        stop_logging()
+        devnull.close()
+
+    return {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "sizes": sizes,
+        "min_time": args.min_time,
+        "results": results,
+    }
+
+
+def compare(report: dict, previous: dict, threshold: float) -> bool:
+    """Печатает изменение среднего времени относительно прошлого прогона. True, если есть регрессии."""
+    regressions = False
+    print(f"\nСравнение с {previous.get('commit') or 'прошлым прогоном'} ({previous.get('created_at', '?')}):")
+    for key, current in report["results"].items():
+        old = previous.get("results", {}).get(key)
+        if not old or not old["mean_ms"]:
+            continue
+        ratio = current["mean_ms"] / old["mean_ms"]
+        mark = ""
+        if ratio > 1 + threshold:
+            mark = "  РЕГРЕССИЯ"
+            regressions = True
+        elif ratio < 1 - threshold:
+            mark = "  ускорение"
+        print(f"{key:<50} {old['mean_ms']:>12.4f} -> {current['mean_ms']:>12.4f} мс  x{ratio:.2f}{mark}")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run(args))
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            previous = json.load(file)
+        if compare(report, previous, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
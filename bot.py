@@ -1,21 +1,71 @@
 import asyncio
-import re
-import aiosqlite
+import logging
+import signal
 import time  # Добавлен импорт для работы с временем
-from aiogram import Bot, Dispatcher, F
+from aiogram import Dispatcher, F
 from aiogram.filters import Command, CommandStart, CommandObject
-from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember, ChatMemberUpdated, ChatPermissions
+from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, ChatMemberUpdated
 from aiogram.fsm.context import FSMContext
-from functions import load_users, save_users, load_blacklist, parse_time, get_user_id_by_username_in_group, init_db, check_expired_bans, check_expired_mutes, check_expired_warnings
-from functions import load_warnings_count, set_warning_expiry, check_forbidden_words, ban_user_by_id_or_username, unban_user_by_id_or_username, mute_user_by_id_or_username, unmute_user_by_id_or_username, warn_user_by_id_or_username, unwarn_user_by_id_or_username
-from functions import sort_users_cases_by_username_or_id, create_cases_keyboard
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from functions import create_bot, register_user, parse_time, init_db, close_db, run_expiry_scheduler, sender, chat_cache, load_identities
+from functions import load_warnings_count, check_forbidden_words, ban_user_by_id_or_username, unban_user_by_id_or_username, mute_user_by_id_or_username, unmute_user_by_id_or_username, warn_user_by_id_or_username, unwarn_user_by_id_or_username
+from functions import sort_users_cases_by_username_or_id, create_cases_keyboard, parse_identifiers, bulk_moderate, call_with_retries, get_blacklist_page
+from word_filter import normalize_text
 from keyboards import cmd_start_kb, cmds_kb, cmd_start_kb_for_user
 from FSM import Ban, Unban, Mute, Unmute, Warn, Unwarn
+from storage import SQLiteStorage
+from workers import run_expiry_leader, run_dispatcher, serve_updates, ignore_stop_signals
+from metrics import Gauge, setup_metrics, start_metrics_server
+from logs import setup_logging
+from flood import FloodDetector
+from duplicates import DuplicateDetector
+
+from config import ADMIN_ID, GROUP_ID, LOGGING_GROUP_ID
+from config import BOT_MODE, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET, WORKERS, FSM_GC_INTERVAL, METRICS_HOST, METRICS_PORT
+from config import FLOOD_RULES, FLOOD_MUTE_DURATION, FLOOD_IDLE_TTL, FLOOD_MAX_USERS
+from config import DUPLICATE_ACCOUNTS, DUPLICATE_WINDOW, DUPLICATE_MIN_LENGTH, DUPLICATE_ACTION, DUPLICATE_DURATION, DUPLICATE_MAX_TEXTS
+from config import BULK_MAX_TARGETS, BULK_PROGRESS_INTERVAL
+
+logger = logging.getLogger("bot")
+
+bot = create_bot()
+# Состояния диалогов хранятся в БД: переживают перезапуск и общие для всех процессов
+fsm_storage = SQLiteStorage()
+dp = Dispatcher(storage=fsm_storage)
+# Время обновлений и каждого обработчика для /metrics
+setup_metrics(dp)
+Gauge("bot_sender_queued_messages", "Сообщения в очередях отправки", lambda: sender.stats()["queued"])
+# Порт /metrics этого процесса (у рабочих процессов свой, см. worker_main)
+metrics_port = METRICS_PORT
+# Частота сообщений участников группы. При нескольких процессах все сообщения пользователя
+# попадают в один процесс (workers.route), поэтому детектора в каждом процессе достаточно
+flood_detector = FloodDetector(FLOOD_RULES, cooldown=max(FLOOD_MUTE_DURATION, 60), idle_ttl=FLOOD_IDLE_TTL, max_users=FLOOD_MAX_USERS)
+# Одинаковые тексты от разных аккаунтов. Аккаунты одной волны спама распределяются между рабочими
+# процессами, поэтому при WORKERS > 1 детектор работает в процессе-диспетчере, который видит все
+# сообщения группы (find_duplicate_wave), а рабочему процессу передаёт только список нарушителей
+duplicate_detector = DuplicateDetector(DUPLICATE_ACCOUNTS, DUPLICATE_WINDOW, DUPLICATE_MIN_LENGTH, max_texts=DUPLICATE_MAX_TEXTS) if DUPLICATE_ACCOUNTS > 0 else None
+
+# Обработчик миграции группы в супергруппу: тип чата изменился, сбрасываем кэш
+@dp.message(F.chat.id == GROUP_ID, F.migrate_to_chat_id)
+async def group_migrated(message: Message):
+    chat_cache.invalidate(message.chat.id)
+    chat_cache.invalidate(message.migrate_to_chat_id)
+    logger.warning("Группа %s перенесена в %s. Обновите GROUP_ID в config.py.", message.chat.id, message.migrate_to_chat_id)
+
+async def punish_forbidden_words(message: Message, text: str, normalized: str):
+    """Бан автора сообщения, если в тексте или подписи к медиа есть запрещённое слово."""
+    try:
+        if check_forbidden_words(text=text, normalized=normalized):
+            await ban_user_by_id_or_username(identifier=str(message.from_user.id), moderator="TheRulerAndTheJudgeBot", until_date=0, reason="Было произнесенно запретное слово")
+    except Exception as e:
+        logger.error("Ошибка: %s", e)
 
-from config import TOKEN, ADMIN_ID, GROUP_ID, DB_NAME, LOGGING_GROUP_ID
-
-bot = Bot(token=TOKEN)
-dp = Dispatcher()
+# Сообщение не от участника-человека: анонимный админ (все пишут от GroupAnonymousBot, 1087968824),
+# пост связанного канала (777000, is_automatic_forward), сообщение от имени канала или другой бот.
+# Такие отправители общие для многих людей или постов, поэтому в подсчёт флуда и повторов они не идут
+def is_service_sender(message: Message) -> bool:
+    return message.sender_chat is not None or bool(message.is_automatic_forward) or message.from_user is None or message.from_user.is_bot
 
 # Обработчик для добавления пользователей, которые пишут сообщения в группе, если их нет в базе данных
 @dp.message(F.chat.id == GROUP_ID)
@@ -23,21 +73,64 @@ async def check_user_messages(message: Message):
     user = message.from_user
     username = user.username
     user_id = user.id
+    # У медиа текст лежит в подписи; нормализуем один раз для всех проверок
+    text = message.text or message.caption or ""
+    normalized = normalize_text(text) if text else ""
 
     if username:
-        users = await load_users()
-        if username not in users:
-            users[username] = {"id": user_id, "muted_until": 0, "muted_reason": ""}
-        await save_users(users)
-        print(f"Пользователь добавлен по сообщению: @{username} -> {user_id}")
-
-    text = message.text
-    username = f"@{message.from_user.username}"
-    try:
-        if check_forbidden_words(text=text):
-            await ban_user_by_id_or_username(identifier=username, moderator="TheRulerAndTheJudgeBot", until_date=0, reason="Было произнесенно запретное слово")
-    except Exception as e:
-        print(f"Ошибка: {e}")
+        if await register_user(username, user_id):
+            logger.debug("Пользователь добавлен по сообщению: @%s -> %s", username, user_id)
+
+    # Флуд: слишком много сообщений за короткое время — автоматический мут
+    if user_id not in ADMIN_ID and not is_service_sender(message):
+        rule = flood_detector.hit(user_id)
+        if rule:
+            logger.warning("Флуд от %s: %s сообщений за %g сек", user_id, *rule)
+            try:
+                await mute_user_by_id_or_username(identifier=str(user_id), moderator="TheRulerAndTheJudgeBot", until_date=FLOOD_MUTE_DURATION, reason=f"Флуд: {rule[0]} сообщений за {rule[1]:g} сек")
+            except Exception as e:
+                logger.error("Ошибка автоматического мута за флуд: %s", e)
+            return
+
+        # Один и тот же текст от нескольких аккаунтов — волна спама, наказываются все авторы
+        # (при WORKERS > 1 проверяет диспетчер)
+        if duplicate_detector is not None and WORKERS == 1:
+            offenders = [uid for uid in duplicate_detector.hit(user_id, normalized) if uid not in ADMIN_ID]
+            if offenders:
+                await punish_duplicate_wave(offenders)
+                return
+
+    await punish_forbidden_words(message, text, normalized)
+
+async def punish_duplicate_wave(offenders: list[int]):
+    logger.warning("Повторяющийся текст от %s аккаунтов: %s", len(offenders), offenders)
+    action = "mute" if DUPLICATE_ACTION == "mute" else "ban"
+    result = await bulk_moderate(action, [str(uid) for uid in offenders], "TheRulerAndTheJudgeBot", DUPLICATE_DURATION, "Рассылка одинаковых сообщений")
+    logger.info("Автоматическое наказание за повтор сообщений: %s", result)
+
+def find_duplicate_wave(update: dict) -> dict | None:
+    """
+    Проверка в процессе-диспетчере (WORKERS > 1) по JSON обновления, с теми же исключениями,
+    что в check_user_messages. Возвращает задание {"duplicate_wave": [user_id, ...]} или None.
+    """
+    message = update.get("message")
+    if not message or message.get("chat", {}).get("id") != GROUP_ID:
+        return None
+    user = message.get("from")
+    if message.get("sender_chat") or message.get("is_automatic_forward") or not user or user.get("is_bot") or user["id"] in ADMIN_ID:
+        return None
+    text = message.get("text") or message.get("caption")
+    if not text:
+        return None
+    offenders = [uid for uid in duplicate_detector.hit(user["id"], normalize_text(text)) if uid not in ADMIN_ID]
+    return {"duplicate_wave": offenders} if offenders else None
+
+# Исправленное сообщение проверяется на запрещённые слова так же, как новое
+@dp.edited_message(F.chat.id == GROUP_ID)
+async def check_edited_messages(message: Message):
+    text = message.text or message.caption
+    if text:
+        await punish_forbidden_words(message, text, normalize_text(text))
 
 # Новый обработчик для проверки группы
 #@dp.message(Command("groupinfo"), F.chat.id == GROUP_ID)
@@ -51,7 +144,7 @@ async def check_user_messages(message: Message):
 @dp.message(CommandStart(), F.chat.type == "private")
 async def cmd_start(message: Message):
     if message.from_user.id in ADMIN_ID:
-        await message.answer("Команды:\n/warn\n/unwarn\n/mute\n/unmute\n/ban\n/unban\n/blacklist", reply_markup=cmds_kb)
+        await message.answer("Команды:\n/warn\n/unwarn\n/mute\n/unmute\n/ban\n/unban\n/massban\n/massunban\n/massmute\n/massunmute\n/blacklist", reply_markup=cmds_kb)
     else:
         await message.answer("Главное меню:", reply_markup=cmd_start_kb_for_user)
 
@@ -214,10 +307,6 @@ async def cmd_warn(message: Message, command: CommandObject):
             elif warn_until_or_reason[0].isdigit() and reason == None:
                 until_date = parse_time(warn_until_or_reason)
                 result = await warn_user_by_id_or_username(identifier, moderator, until_date, "")
-                if identifier.startswith("@"):
-                    await set_warning_expiry(username=identifier[1:], expiry_time=until_date)
-                else:
-                    await set_warning_expiry(user_id=identifier, expiry_time=until_date)
                 await message.answer(result)
             elif not warn_until_or_reason[0].isdigit() and reason == None:
                 result = await warn_user_by_id_or_username(identifier, moderator, 0, warn_until_or_reason)
@@ -225,10 +314,6 @@ async def cmd_warn(message: Message, command: CommandObject):
             else:
                 until_date = parse_time(warn_until_or_reason)
                 result = await warn_user_by_id_or_username(identifier, moderator, until_date, reason)
-                if identifier.startswith("@"):
-                    await set_warning_expiry(username=identifier[1:], expiry_time=until_date)
-                else:
-                    await set_warning_expiry(user_id=identifier, expiry_time=until_date)
                 await message.answer(result)     
         else:
             await message.answer("Вы не указали корректный username или ID")
@@ -250,26 +335,92 @@ async def cmd_unwarn(message: Message, command: CommandObject):
         else:
             await message.answer("Вы не указали корректный username или ID")
 
+# Массовые команды: "/massban [ID и @username] [длительность] [причина]", дальше — ID и @username
+# через пробел или с новой строки. Список можно прислать .txt-файлом с командой в подписи.
+# /massunban и /massunmute принимают только список. Ход выполнения — в одном редактируемом сообщении.
+async def run_bulk_command(message: Message, command: CommandObject, action: str):
+    if message.from_user.id not in ADMIN_ID:
+        return
+    text = command.args or ""
+    if message.document:
+        if (message.document.file_size or 0) > 1024 * 1024:
+            await message.answer("Файл слишком большой: список должен быть не больше 1 МБ.")
+            return
+        try:
+            file = await call_with_retries(lambda: bot.download(message.document))
+        except Exception as e:
+            logger.error("Не удалось скачать список для массового действия: %s", e)
+            await message.answer(f"Не удалось скачать файл: {e}")
+            return
+        text += "\n" + file.read().decode("utf-8", errors="replace")
+
+    until_date, reason = 0, ""
+    if action in ("ban", "mute"):
+        # В первой строке после идентификаторов могут идти длительность и причина
+        first_line, _, rest = text.partition("\n")
+        tokens = first_line.split()
+        position = 0
+        while position < len(tokens) and (tokens[position].startswith("@") or tokens[position].isdigit()):
+            position += 1
+        ids_part = " ".join(tokens[:position])
+        if position < len(tokens) and tokens[position][0].isdigit():
+            until_date = parse_time(tokens[position])
+            position += 1
+        reason = " ".join(tokens[position:])
+        text = ids_part + "\n" + rest
+
+    identifiers, invalid = parse_identifiers(text)
+    if not identifiers:
+        await message.answer(f"Укажите аргументы: /mass{action} <username/ID> ... <длительность> <причина> или приложите .txt-файл со списком")
+        return
+    if len(identifiers) > BULK_MAX_TARGETS:
+        await message.answer(f"Слишком много пользователей: {len(identifiers)}. Не больше {BULK_MAX_TARGETS} за одну команду.")
+        return
+
+    status = await message.answer(f"Обработка: {len(identifiers)} пользователей...")
+    last_edit = time.monotonic()
+
+    async def progress(done: int, total: int):
+        nonlocal last_edit
+        # Telegram ограничивает частоту правок, поэтому не чаще раза в BULK_PROGRESS_INTERVAL секунд
+        now = time.monotonic()
+        if done == total or now - last_edit < BULK_PROGRESS_INTERVAL:
+            return
+        last_edit = now
+        try:
+            await status.edit_text(f"Обработка: {done}/{total}")
+        except Exception as e:
+            logger.debug("Не удалось обновить ход массового действия: %s", e)
+
+    result = await bulk_moderate(action, identifiers, message.from_user.username, until_date, reason, progress)
+    if invalid:
+        result += f"\nНе распознаны ({len(invalid)}): {' '.join(invalid[:20])}"
+    await status.edit_text(result[:4096])
+
+@dp.message(Command("massban"), F.chat.type == "private")
+async def cmd_massban(message: Message, command: CommandObject):
+    await run_bulk_command(message, command, "ban")
+
+@dp.message(Command("massunban"), F.chat.type == "private")
+async def cmd_massunban(message: Message, command: CommandObject):
+    await run_bulk_command(message, command, "unban")
+
+@dp.message(Command("massmute"), F.chat.type == "private")
+async def cmd_massmute(message: Message, command: CommandObject):
+    await run_bulk_command(message, command, "mute")
+
+@dp.message(Command("massunmute"), F.chat.type == "private")
+async def cmd_massunmute(message: Message, command: CommandObject):
+    await run_bulk_command(message, command, "unmute")
+
 @dp.message(Command("blacklist"))
 async def cmd_blacklist(message: Message):
-    blacklist = await load_blacklist()
-    if not blacklist:
-        await message.answer("Черный список пуст.")
-    else:
-        text = "Черный список:\n"
-        for uname, data in blacklist.items():
-            until = data.get("until", 0)
-            reason = data.get("reason", "Не указана")
-            if until > 0:
-                until_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(until))
-                text += f"@{uname} (ID: {data['id']}) - до {until_str}, причина: {reason}\n"
-            else:
-                text += f"@{uname} (ID: {data['id']}) - постоянный, причина: {reason}\n"
-        await message.answer(text)
+    text, kb = await get_blacklist_page(1)
+    await message.answer(text, reply_markup=kb)
 
 @dp.callback_query(F.data == "to_cmds")
 async def to_commands(callback: CallbackQuery):
-    await callback.message.edit_text("Команды:\n/warn\n/unwarn\n/mute\n/unmute\n/ban\n/unban\n/blacklist", reply_markup=cmds_kb)
+    await callback.message.edit_text("Команды:\n/warn\n/unwarn\n/mute\n/unmute\n/ban\n/unban\n/massban\n/massunban\n/massmute\n/massunmute\n/blacklist", reply_markup=cmds_kb)
 
 @dp.callback_query(F.data == "to_btns")
 async def to_commands(callback: CallbackQuery):
@@ -469,36 +620,9 @@ async def process_warn_reason(message: Message, state: FSMContext):
     moderator = message.from_user.username
     until_seconds = data.get("until_seconds", 0)
     
-    user_id = None
-    if identifier.startswith('@'):
-        username = identifier[1:]
-        user_id = await get_user_id_by_username_in_group(username)
-        if user_id is None:
-            # Пользователь не найден, используем user_id из callback (предполагая, что это цель)
-            user_id = message.from_user.id  # Замените на правильный user_id, если известен иначе
-            # Вставляем в БД
-            try:
-                async with aiosqlite.connect(DB_NAME) as conn:
-                    await conn.execute("""
-                        INSERT INTO users (username, user_id, warnings, warning_1_data, warning_2_data, warning_3_data) 
-                        VALUES (?, ?, 0, 0, 0, 0)
-                    """, (username, user_id))
-                    await conn.commit()
-                print(f"Пользователь @{username} с user_id {user_id} добавлен.")
-            except Exception as e:
-                print(f"Ошибка добавления пользователя @{username}: {e}")
-                await message.answer("Ошибка: не удалось добавить пользователя.")
-                await state.clear()
-                return
-    elif identifier.isdigit():
-        user_id = int(identifier)
-    
     result = await warn_user_by_id_or_username(identifier, moderator, until_seconds, reason)
     await message.answer(result)
     
-    # Теперь user_id известен, вызываем set_warning_expiry
-    await set_warning_expiry(user_id=user_id, expiry_time=until_seconds)
-    
     await state.clear()
 
 @dp.callback_query(F.data == "skip_warn_reason", Warn.waiting_for_reason)
@@ -508,36 +632,9 @@ async def skip_warn_reason(callback: CallbackQuery, state: FSMContext):
     moderator = callback.from_user.username
     until_seconds = data.get("until_seconds", 0)
     
-    user_id = None
-    if identifier.startswith('@'):
-        username = identifier[1:]
-        user_id = await get_user_id_by_username_in_group(username)
-        if user_id is None:
-            # Пользователь не найден, используем user_id из callback (предполагая, что это цель)
-            user_id = callback.from_user.id  # Замените на правильный user_id, если известен иначе
-            # Вставляем в БД
-            try:
-                async with aiosqlite.connect(DB_NAME) as conn:
-                    await conn.execute("""
-                        INSERT INTO users (username, user_id, warnings, warning_1_data, warning_2_data, warning_3_data) 
-                        VALUES (?, ?, 0, 0, 0, 0)
-                    """, (username, user_id))
-                    await conn.commit()
-                print(f"Пользователь @{username} с user_id {user_id} добавлен.")
-            except Exception as e:
-                print(f"Ошибка добавления пользователя @{username}: {e}")
-                await callback.message.edit_text("Ошибка: не удалось добавить пользователя.")
-                await state.clear()
-                return
-    elif identifier.isdigit():
-        user_id = int(identifier)
-    
     result = await warn_user_by_id_or_username(identifier, moderator, until_seconds, "")
     await callback.message.edit_text(result)
     
-    # Теперь user_id известен, вызываем set_warning_expiry
-    await set_warning_expiry(user_id=user_id, expiry_time=until_seconds)
-    
     await state.clear()
 
 
@@ -552,7 +649,7 @@ async def process_unmute(message: Message, state: FSMContext):
     moderator = message.from_user.username
     username = identifier[1:]
     warning_count = await load_warnings_count(username=username)
-    print(warning_count, username)
+    logger.debug("Предупреждений у @%s: %s", username, warning_count)
 
     if warning_count == 0:
         await message.answer("У этого пользователя нет предупреждений")
@@ -566,20 +663,17 @@ async def process_unmute(message: Message, state: FSMContext):
 # Обработчик для показа черного списка
 @dp.callback_query(F.data == "black_list")
 async def show_blacklist(callback: CallbackQuery):
-    blacklist = await load_blacklist()
-    if not blacklist:
-        await callback.message.answer("Черный список пуст.")
-    else:
-        text = "Черный список:\n"
-        for uname, data in blacklist.items():
-            until = data.get("until", 0)
-            reason = data.get("reason", "Не указана")
-            if until > 0:
-                until_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(until))
-                text += f"@{uname} (ID: {data['id']}) - до {until_str}, причина: {reason}\n"
-            else:
-                text += f"@{uname} (ID: {data['id']}) - постоянный, причина: {reason}\n"
-        await callback.message.answer(text)
+    text, kb = await get_blacklist_page(1)
+    await callback.message.answer(text, reply_markup=kb)
+
+# Листание черного списка: страница меняется в том же сообщении
+@dp.callback_query(F.data.startswith("blacklist:"))
+async def turn_blacklist_page(callback: CallbackQuery):
+    page = callback.data.split(":", 1)[1]
+    text, kb = await get_blacklist_page(int(page) if page.isdigit() else 1)
+    if text != callback.message.text:
+        await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer()
 
 @dp.callback_query(F.data == "cases")
 async def check_user_cases(callback: CallbackQuery):
@@ -614,21 +708,121 @@ async def track_new_member(update: ChatMemberUpdated):
         user_id = user.id
 
         if username:
-            users = await load_users()
-            users[username] = {"id": user_id, "muted_until": 0, "muted_reason": ""}
-            await save_users(users)
-            print(f"Новый пользователь сохранен: @{username} -> {user_id}")
+            await register_user(username, user_id)
+            logger.debug("Новый пользователь сохранен: @%s -> %s", username, user_id)
         else:
-            print(f"Пользователь {user_id} без username — не сохранен.")
+            logger.debug("Пользователь %s без username — не сохранен.", user_id)
 
 
-async def main():
+# Обработчик изменения статуса бота в группе: обновляем кэш метаданных группы
+@dp.my_chat_member(F.chat.id == GROUP_ID)
+async def bot_status_changed(update: ChatMemberUpdated):
+    chat_cache.invalidate(update.chat.id)
+    try:
+        await chat_cache.refresh(update.chat.id)
+    except Exception as e:
+        logger.warning("Не удалось обновить данные группы: %s", e)
+
+# Общий запуск и остановка для обоих режимов (вызываются диспетчером)
+async def on_startup():
     await init_db()
-    # Запускаем фоновые задачи для проверки истекших банов и мутов
-    asyncio.create_task(check_expired_bans())
-    asyncio.create_task(check_expired_mutes())
-    asyncio.create_task(check_expired_warnings())
-    await dp.start_polling(bot)
+    await load_identities()
+    # Заполняем кэш метаданных группы заранее, чтобы первая команда не ждала get_chat
+    try:
+        await chat_cache.refresh(GROUP_ID)
+    except Exception as e:
+        logger.warning("Не удалось получить данные группы: %s", e)
+    # Запускаем планировщик истечения банов, мутов и предупреждений
+    # (при нескольких процессах — только в том, который держит аренду лидера)
+    if WORKERS > 1:
+        background_tasks.add(asyncio.create_task(run_expiry_leader(run_expiry_scheduler)))
+    else:
+        background_tasks.add(asyncio.create_task(run_expiry_scheduler()))
+    # Удаление брошенных диалогов модераторов
+    background_tasks.add(asyncio.create_task(fsm_storage.run_gc(FSM_GC_INTERVAL)))
+    if metrics_port:
+        try:
+            metrics_runners.append(await start_metrics_server(METRICS_HOST, metrics_port))
+        except OSError as e:
+            logger.warning("Не удалось запустить сервер метрик на порту %s: %s", metrics_port, e)
+
+async def on_shutdown():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    for runner in metrics_runners:
+        await runner.cleanup()
+    metrics_runners.clear()
+    await sender.close()
+    await close_db()
+
+background_tasks: set[asyncio.Task] = set()
+metrics_runners: list[web.AppRunner] = []
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+async def run_webhook():
+    """
+    Принимает обновления через aiohttp-сервер вместо long polling.
+    Telegram (или обратный прокси) шлёт POST на WEBHOOK_PATH; запросы без верного
+    секретного заголовка отклоняются. Обработка идёт в фоне, ответ Telegram — сразу.
+    """
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET or None).register(app, path=WEBHOOK_PATH)
+    # Связывает запуск/остановку приложения с dp.startup/dp.shutdown
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info("Webhook-сервер запущен на http://%s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info("Webhook зарегистрирован: %s%s", WEBHOOK_URL.rstrip('/'), WEBHOOK_PATH)
+
+    # Работаем до SIGINT/SIGTERM, затем корректно останавливаем сервер
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Останавливаем webhook-сервер...")
+        await runner.cleanup()
+
+# Точка входа рабочего процесса (WORKERS > 1)
+def worker_main(index: int, updates):
+    global metrics_port
+    ignore_stop_signals()
+    setup_logging()
+    if METRICS_PORT:
+        metrics_port = METRICS_PORT + index
+    asyncio.run(serve_updates(dp, bot, updates, index, {"duplicate_wave": punish_duplicate_wave}))
+
+async def main():
+    if WORKERS > 1:
+        # Миграции выполняются один раз здесь, а не параллельно в каждом рабочем процессе
+        await init_db()
+        await close_db()
+        await run_dispatcher(bot, dp, worker_main, find_duplicate_wave if duplicate_detector is not None else None)
+    elif BOT_MODE == "webhook":
+        await run_webhook()
+    else:
+        # Webhook и getUpdates несовместимы: снимаем webhook, если он остался от прошлого запуска
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    setup_logging()
+    asyncio.run(main())
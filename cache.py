@@ -0,0 +1,121 @@
+import time
+from collections import OrderedDict
+
+from aiogram import Bot
+from aiogram.types import Chat
+
+
+class ChatCache:
+    """
+    Кэш метаданных чатов (bot.get_chat) с временем жизни ttl секунд.
+    Заполняется при старте и сбрасывается по обновлениям my_chat_member и миграции группы.
+    """
+
+    def __init__(self, bot: Bot, ttl: int = 3600):
+        self.bot = bot
+        self.ttl = ttl
+        self._chats: dict[int, tuple[float, Chat]] = {}
+
+    async def get(self, chat_id: int) -> Chat:
+        cached = self._chats.get(chat_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        return await self.refresh(chat_id)
+
+    async def refresh(self, chat_id: int) -> Chat:
+        chat = await self.bot.get_chat(chat_id)
+        self._chats[chat_id] = (time.monotonic() + self.ttl, chat)
+        return chat
+
+    def invalidate(self, chat_id: int):
+        self._chats.pop(chat_id, None)
+
+
+class IdentityCache:
+    """
+    Двусторонний индекс username <-> user_id с вытеснением давно не использованных записей (LRU).
+    Один username соответствует одному user_id и наоборот: при смене username старая пара удаляется.
+    """
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._by_username: OrderedDict[str, int] = OrderedDict()
+        self._by_id: dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_username)
+
+    def put(self, username: str, user_id: int):
+        old_username = self._by_id.get(user_id)
+        if old_username is not None and old_username != username:
+            del self._by_username[old_username]
+        old_id = self._by_username.get(username)
+        if old_id is not None and old_id != user_id:
+            del self._by_id[old_id]
+        self._by_username[username] = user_id
+        self._by_username.move_to_end(username)
+        self._by_id[user_id] = username
+        while len(self._by_username) > self.max_size:
+            evicted_username, evicted_id = self._by_username.popitem(last=False)
+            del self._by_id[evicted_id]
+
+    def get_id(self, username: str) -> int | None:
+        user_id = self._by_username.get(username)
+        if user_id is not None:
+            self._by_username.move_to_end(username)
+        return user_id
+
+    def get_username(self, user_id: int) -> str | None:
+        username = self._by_id.get(user_id)
+        if username is not None:
+            self._by_username.move_to_end(username)
+        return username
+
+    def discard(self, username: str):
+        user_id = self._by_username.pop(username, None)
+        if user_id is not None:
+            del self._by_id[user_id]
+
+    def clear(self):
+        self._by_username.clear()
+        self._by_id.clear()
+
+
+class PageCache:
+    """
+    Готовые страницы списка (по номеру) со временем жизни ttl секунд.
+    invalidate() сбрасывает все страницы: любое изменение списка сдвигает границы страниц.
+    Страница, прочитанная до invalidate(), в кэш не попадает: put() сверяет поколение,
+    взятое перед чтением из БД.
+    """
+
+    def __init__(self, ttl: int = 60, max_pages: int = 100):
+        self.ttl = ttl
+        self.max_pages = max_pages
+        self.generation = 0
+        self._pages: OrderedDict[object, tuple[float, object]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def get(self, key):
+        cached = self._pages.get(key)
+        if cached is None:
+            return None
+        if cached[0] <= time.monotonic():
+            del self._pages[key]
+            return None
+        self._pages.move_to_end(key)
+        return cached[1]
+
+    def put(self, key, value, generation: int):
+        if generation != self.generation:
+            return
+        self._pages[key] = (time.monotonic() + self.ttl, value)
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def invalidate(self):
+        self.generation += 1
+        self._pages.clear()
@@ -1,4 +1,50 @@
 TOKEN = "YOUR TOKEN"
 ADMIN_ID = [12345678] #ADMINS IDs
 GROUP_ID = -100000000000 #group id, it shoulds be a supergroup
-DB_NAME = 'bot.sqlite' #data base
\ No newline at end of file
+LOGGING_GROUP_ID = -100000000001 #group id for moderation logs
+DB_NAME = 'bot.sqlite' #data base
+DB_READERS = 4 #number of pooled read connections to the data base
+DB_JOURNAL_MODE = 'WAL' #sqlite journal mode, WAL lets readers work while someone writes
+DB_SYNCHRONOUS = 'NORMAL' #sqlite synchronous level (NORMAL is safe in WAL mode)
+DB_MMAP_SIZE = 268435456 #bytes of the data base file mapped into memory
+DB_CACHE_SIZE = -65536 #page cache per connection, negative value means KiB
+DB_BUSY_TIMEOUT = 5000 #milliseconds to wait for a lock before failing
+SEND_GLOBAL_RATE = 30 #outgoing messages per second for the whole bot
+SEND_PRIVATE_RATE = 1 #outgoing messages per second to one private chat
+SEND_GROUP_RATE = 20 / 60 #outgoing messages per second to one group
+SEND_MAX_ATTEMPTS = 5 #delivery attempts per message before giving up
+CHAT_CACHE_TTL = 3600 #seconds to keep group info (chat type) before asking Telegram again
+IDENTITY_CACHE_SIZE = 100000 #username <-> user_id pairs kept in memory
+WARN_LIMIT = 3 #active warnings that lead to a permanent ban
+BOT_MODE = 'polling' #'polling' or 'webhook'
+WEBHOOK_HOST = '127.0.0.1' #address the webhook server listens on (put a reverse proxy in front of it)
+WEBHOOK_PORT = 8080 #port the webhook server listens on
+WEBHOOK_PATH = '/webhook' #path Telegram posts updates to
+WEBHOOK_URL = '' #public https base url, e.g. https://example.com; if empty the webhook is not registered in Telegram on startup
+WEBHOOK_SECRET = '' #secret token checked in the X-Telegram-Bot-Api-Secret-Token header (A-Z, a-z, 0-9, _ and -)
+WORKERS = 1 #bot processes; with more than 1 a dispatcher process spreads updates between worker processes by user/chat
+LEASE_TTL = 30 #seconds one worker keeps the right to run expiry jobs without renewing it
+FSM_STATE_TTL = 86400 #seconds an unfinished ban/mute/warn dialog is kept before it is dropped
+FSM_GC_INTERVAL = 600 #seconds between cleanups of abandoned dialogs
+FSM_CACHE_SIZE = 10000 #dialog keys whose state is kept in memory
+TELEGRAM_API_URL = '' #base url of a Bot API server, e.g. http://127.0.0.1:8081 for fake_telegram.py; empty means api.telegram.org
+METRICS_HOST = '127.0.0.1' #address of the Prometheus /metrics endpoint
+METRICS_PORT = 9090 #port of the /metrics endpoint, 0 disables it; with WORKERS > 1 worker N listens on METRICS_PORT + N
+LOG_LEVEL = 'INFO' #DEBUG, INFO, WARNING or ERROR
+LOG_JSON = True #one JSON object per log line; False gives plain text lines
+LOG_DEBUG_SAMPLE_RATE = 0.01 #share of DEBUG records (per-message and per-lookup logs) that are written when LOG_LEVEL is DEBUG
+FLOOD_RULES = [(5, 3), (15, 30)] #(messages, seconds) pairs: a user sending that many group messages within that many seconds is muted automatically; empty list disables it
+FLOOD_MUTE_DURATION = 600 #seconds of the automatic mute for flooding, 0 means permanent
+FLOOD_IDLE_TTL = 300 #seconds after which a silent user's message history is dropped
+FLOOD_MAX_USERS = 100000 #users whose recent message times are kept in memory
+DUPLICATE_ACCOUNTS = 3 #distinct accounts posting the same (or nearly the same) text within DUPLICATE_WINDOW are punished together; 0 disables it
+DUPLICATE_WINDOW = 60 #seconds
+DUPLICATE_MIN_LENGTH = 40 #shorter messages (after normalization) are not checked, so greetings and common replies posted by several people never match
+DUPLICATE_ACTION = 'mute' #'mute' or 'ban'
+DUPLICATE_DURATION = 3600 #seconds of the automatic mute/ban for duplicated messages, 0 means permanent
+DUPLICATE_MAX_TEXTS = 20000 #distinct texts kept in memory (about 2.5 KB each); 20000 covers 330 different messages a second over a 60 second window
+BULK_CONCURRENCY = 10 #parallel Bot API calls for /massban, /massmute, /massunban and /massunmute
+BULK_MAX_TARGETS = 5000 #IDs/usernames accepted by one bulk command (in the message or an attached .txt file)
+BULK_PROGRESS_INTERVAL = 2 #seconds between edits of the bulk command progress message
+BLACKLIST_PAGE_SIZE = 20 #entries on one page of /blacklist
+BLACKLIST_CACHE_TTL = 60 #seconds a rendered /blacklist page is kept; bans and unbans in this process drop the pages at once, with WORKERS > 1 changes made by other workers show up after this delay
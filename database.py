@@ -0,0 +1,190 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+from config import DB_NAME, DB_READERS, DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_MMAP_SIZE, DB_CACHE_SIZE, DB_BUSY_TIMEOUT
+from metrics import DB_QUERY_SECONDS, DB_WRITE_WAIT_SECONDS, statement_label
+
+
+class TimedQuery:
+    """
+    Результат TimedConnection.execute: как и у aiosqlite, его можно await-ить или
+    использовать в async with. Во втором случае в замер входит и чтение строк из курсора.
+    """
+
+    __slots__ = ("_query", "_label", "_started", "_cursor")
+
+    def __init__(self, query, label: str):
+        self._query = query
+        self._label = label
+
+    async def _run(self):
+        started = time.perf_counter()
+        try:
+            return await self._query
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, self._label)
+
+    def __await__(self):
+        return self._run().__await__()
+
+    async def __aenter__(self):
+        self._started = time.perf_counter()
+        try:
+            self._cursor = await self._query
+        except BaseException:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - self._started, self._label)
+            raise
+        return self._cursor
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self._cursor.close()
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - self._started, self._label)
+
+
+class TimedConnection:
+    """Соединение aiosqlite, у которого время каждого execute/executemany попадает в метрики по метке запроса."""
+
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn: aiosqlite.Connection):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def execute(self, sql: str, parameters=None) -> TimedQuery:
+        return TimedQuery(self._conn.execute(sql, parameters), statement_label(sql))
+
+    def executemany(self, sql: str, parameters) -> TimedQuery:
+        return TimedQuery(self._conn.executemany(sql, parameters), statement_label(sql))
+
+
+class Database:
+    """
+    Долгоживущие соединения с SQLite, общие для всех функций бота.
+    Читатели берутся из ограниченного пула, запись идёт через одно соединение,
+    доступ к которому сериализуется замком.
+    """
+
+    def __init__(self, path: str, readers: int = 4, pragmas: dict | None = None):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self.pragmas = pragmas or {}
+        self._readers: asyncio.Queue | None = None
+        self._reader_conns: list[aiosqlite.Connection] = []
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock: asyncio.Lock | None = None
+        # Одновременные первые вызовы start() (хуки запуска, лидер истечений) не должны открыть два пула
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._writer is not None
+
+    async def start(self):
+        """Открывает писателя и пул читателей. Повторный вызов ничего не делает."""
+        if self.started:
+            return
+        async with self._start_lock:
+            if self.started:
+                return
+            readers = asyncio.Queue()
+            try:
+                for _ in range(self.readers_count):
+                    conn = await self._connect()
+                    self._reader_conns.append(conn)
+                    readers.put_nowait(conn)
+                writer = await self._connect()
+            except BaseException:
+                for conn in self._reader_conns:
+                    await conn.close()
+                self._reader_conns.clear()
+                raise
+            self._readers = readers
+            self._write_lock = asyncio.Lock()
+            # Писатель присваивается последним: started становится True, когда пул уже готов
+            self._writer = writer
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path)
+        # journal_mode сохраняется в самом файле, остальные настройки действуют на соединение
+        for name, value in self.pragmas.items():
+            async with conn.execute(f"PRAGMA {name} = {value}"):
+                pass
+        return conn
+
+    async def close(self):
+        """
+        Закрывает все соединения (вызывать при остановке бота).
+        Ждёт окончания начатых запросов: каждый читатель закрывается после возврата в пул.
+        """
+        async with self._start_lock:
+            if not self.started:
+                return
+            async with self._write_lock:
+                for _ in range(len(self._reader_conns)):
+                    await self._readers.get()
+                for conn in self._reader_conns:
+                    await conn.close()
+                self._reader_conns.clear()
+                writer, self._writer = self._writer, None
+                await writer.close()
+                self._readers = None
+
+    @asynccontextmanager
+    async def read(self):
+        """Выдаёт свободное соединение-читатель из пула."""
+        await self.start()
+        conn = await self._readers.get()
+        try:
+            yield TimedConnection(conn)
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        """
+        Выдаёт единственное соединение-писатель. Все запросы внутри блока
+        выполняются одной транзакцией: commit на выходе, rollback при ошибке.
+        """
+        await self.start()
+        started = time.perf_counter()
+        async with self._write_lock:
+            DB_WRITE_WAIT_SECONDS.observe(time.perf_counter() - started)
+            try:
+                yield TimedConnection(self._writer)
+                with DB_QUERY_SECONDS.timer("COMMIT"):
+                    await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+    async def fetchone(self, sql: str, params: tuple = ()):
+        async with self.read() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    async def fetchall(self, sql: str, params: tuple = ()):
+        async with self.read() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    async def execute(self, sql: str, params: tuple = ()) -> int:
+        """Выполняет один пишущий запрос и возвращает количество изменённых строк."""
+        async with self.write() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return cursor.rowcount
+
+
+db = Database(DB_NAME, DB_READERS, pragmas={
+    "busy_timeout": DB_BUSY_TIMEOUT,
+    "journal_mode": DB_JOURNAL_MODE,
+    "synchronous": DB_SYNCHRONOUS,
+    "mmap_size": DB_MMAP_SIZE,
+    "cache_size": DB_CACHE_SIZE,
+})
@@ -0,0 +1,160 @@
+import time
+from array import array
+from collections import OrderedDict
+
+# Поиск одинаковых и почти одинаковых сообщений от разных аккаунтов (волны спама).
+#
+# Текст приходит уже нормализованным (word_filter.normalize_text): регистр, похожие буквы,
+# знаки и растянутые буквы спамеру не помогают. Отпечаток — точный хэш текста и MinHash по символьным 4-граммам
+# в варианте "одна перестановка": хэш каждой 4-граммы попадает в одну из BINS корзин,
+# в корзине остаётся минимальный. Это один проход по тексту вместо BINS проходов.
+# Корзины разбиты на полосы (LSH): тексты с совпадающей полосой — кандидаты, кандидат
+# подтверждается долей совпавших корзин. Индекс хранит ключи только за последние window секунд.
+
+SHINGLE = 4
+BINS = 24
+BAND_ROWS = 3  # 8 полос по 3 корзины: при сходстве 0.75 хотя бы одна полоса совпадает в 98% случаев; ложные кандидаты отсеивает проверка сходства
+MAX_SHINGLED = 500  # MinHash строится по началу нормализованного текста — так проверка длинного сообщения остаётся дешёвой
+_EMPTY = -1
+_MASK = (1 << 30) - 1  # хэши в одну "цифру" int CPython: сравнение и остаток заметно быстрее, чем у 64-битных
+
+
+def signature(normalized: str) -> array:
+    """Минимальный хэш 4-грамм в каждой из BINS корзин (_EMPTY — корзина пуста)."""
+    mins = [_MASK + 1] * BINS
+    # Повторяющиеся 4-граммы хэшируются один раз
+    text = normalized[:MAX_SHINGLED]
+    for h in {hash(text[i:i + SHINGLE]) & _MASK for i in range(len(text) - SHINGLE + 1)}:
+        b = h % BINS
+        if h < mins[b]:
+            mins[b] = h
+    return array("l", (_EMPTY if h > _MASK else h for h in mins))
+
+
+def similarity(a: array, b: array) -> float:
+    """Оценка сходства Жаккара по корзинам, непустым хотя бы у одного текста."""
+    used = equal = 0
+    for x, y in zip(a, b):
+        if x == _EMPTY and y == _EMPTY:
+            continue
+        used += 1
+        if x == y:
+            equal += 1
+    return equal / used if used else 0.0
+
+
+class _Cluster:
+    __slots__ = ("signature", "accounts", "last", "tripped")
+
+    def __init__(self, sig: array):
+        self.signature = sig
+        self.accounts: dict[int, float] = {}  # user_id -> время последнего сообщения, по возрастанию
+        self.last = 0.0
+        self.tripped = False
+
+
+class DuplicateDetector:
+    """
+    Группы одинаковых/похожих сообщений за последние window секунд.
+    hit() возвращает аккаунты, которые нужно наказать: всю группу, когда в ней набралось
+    accounts разных авторов, и затем каждого нового автора этого же текста, пока группа жива.
+    """
+
+    def __init__(self, accounts: int = 3, window: float = 60, min_length: int = 40, threshold: float = 0.6, max_texts: int = 20000):
+        self.accounts = accounts
+        self.window = window
+        self.min_length = min_length
+        self.threshold = threshold
+        self.max_texts = max_texts
+        self.max_keys = max_texts * (1 + BINS // BAND_ROWS)
+        # хэш ключа отпечатка -> номер группы; давно не встречавшиеся ключи — в начале.
+        # Ключ действует, пока жива его группа, поэтому время у ключей не хранится
+        self._keys: OrderedDict[int, int] = OrderedDict()
+        # номер группы -> группа; давно не пополнявшиеся группы — в начале
+        self._clusters: OrderedDict[int, _Cluster] = OrderedDict()
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._clusters)
+
+    @staticmethod
+    def _fingerprint(normalized: str, sig: array) -> list[int]:
+        """Первый ключ — хэш всего текста, дальше — хэши полос MinHash."""
+        keys = [hash(normalized)]
+        for band in range(BINS // BAND_ROWS):
+            rows = tuple(sig[band * BAND_ROWS:(band + 1) * BAND_ROWS])
+            # Полоса с пустыми корзинами совпала бы у любых коротких текстов
+            if _EMPTY not in rows:
+                keys.append(hash((band, rows)))
+        return keys
+
+    def _find(self, keys: list[int], sig: array) -> int | None:
+        """Номер группы с тем же текстом или с похожим (полоса совпала и сходство подтвердилось)."""
+        for index, key in enumerate(keys):
+            cluster_id = self._keys.get(key)
+            cluster = self._clusters.get(cluster_id) if cluster_id is not None else None
+            if cluster is None:
+                continue
+            if index == 0 or similarity(cluster.signature, sig) >= self.threshold:
+                return cluster_id
+        return None
+
+    def hit(self, user_id: int, normalized: str, now: float | None = None) -> list[int]:
+        """
+        Учитывает нормализованный текст сообщения и возвращает user_id,
+        которых нужно наказать (обычно пустой список).
+        """
+        if len(normalized) < self.min_length:
+            return []
+        if now is None:
+            now = time.monotonic()
+        self._expire(now)
+
+        sig = signature(normalized)
+        keys = self._fingerprint(normalized, sig)
+        cluster_id = self._find(keys, sig)
+        if cluster_id is None:
+            cluster_id = self._next_id
+            self._next_id += 1
+            cluster = self._clusters[cluster_id] = _Cluster(sig)
+        else:
+            cluster = self._clusters[cluster_id]
+            self._clusters.move_to_end(cluster_id)
+        for key in keys:
+            self._keys[key] = cluster_id
+            self._keys.move_to_end(key)
+        while len(self._keys) > self.max_keys:
+            self._keys.popitem(last=False)
+        while len(self._clusters) > self.max_texts:
+            self._clusters.popitem(last=False)
+
+        new_account = cluster.accounts.pop(user_id, None) is None
+        cluster.accounts[user_id] = now
+        cluster.last = now
+        # Авторы, писавшие этот текст раньше окна, в счёт не идут
+        while cluster.accounts:
+            first_id, first_time = next(iter(cluster.accounts.items()))
+            if now - first_time <= self.window:
+                break
+            del cluster.accounts[first_id]
+
+        if cluster.tripped:
+            return [user_id] if new_account else []
+        if len(cluster.accounts) >= self.accounts:
+            cluster.tripped = True
+            return list(cluster.accounts)
+        return []
+
+    def _expire(self, now: float):
+        clusters = self._clusters
+        while clusters:
+            cluster = next(iter(clusters.values()))
+            if now - cluster.last <= self.window:
+                break
+            clusters.popitem(last=False)
+        # Ключи удалённых групп; ключ живой группы в начале очереди останавливает чистку до её истечения
+        keys = self._keys
+        while keys:
+            if next(iter(keys.values())) in clusters:
+                break
+            keys.popitem(last=False)
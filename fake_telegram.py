@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    """
+    Локальная заглушка Telegram Bot API для нагрузочных тестов (без обращения к Telegram).
+    Поддерживает getUpdates, sendMessage, getChat, banChatMember, restrictChatMember,
+    unbanChatMember и ещё несколько служебных методов; остальные методы просто отвечают true.
+
+    latency/jitter — задержка ответа в секундах (нормальное распределение),
+    error_rate — доля запросов, на которые отвечаем 429 Too Many Requests с retry_after.
+    Обновления для бота добавляются через add_update() или POST /control/updates.
+    """
+
+    # Методы, которые никогда не получают 429 и не ждут latency
+    SERVICE_METHODS = {"getupdates", "getme", "deletewebhook", "setwebhook", "close", "logout"}
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, retry_after: int = 1, bot_id: int = 1000000):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.me = {"id": bot_id, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        self.updates: list[dict] = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.calls: Counter[str] = Counter()
+        self.files: dict[str, bytes] = {}
+        self.errors_429 = 0
+        self.listeners = []
+        self._new_updates: asyncio.Event | None = None
+        self._runner: web.AppRunner | None = None
+
+    # Обновления для бота
+
+    def add_update(self, payload: dict) -> int:
+        """Ставит обновление в очередь getUpdates. payload — всё, кроме update_id. Возвращает update_id."""
+        update_id = self.next_update_id
+        self.next_update_id += 1
+        self.updates.append({"update_id": update_id, **payload})
+        if self._new_updates is not None:
+            self._new_updates.set()
+        return update_id
+
+    def add_file(self, file_id: str, content: bytes):
+        """Файл, который бот сможет скачать через getFile (например, документ из сообщения)."""
+        self.files[file_id] = content
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        # Подтверждённые обновления (id меньше offset) больше не отдаём
+        if offset:
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates and timeout > 0:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    # Ответы на методы
+
+    def _message(self, chat_id: int, text: str | None = None) -> dict:
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        chat = {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"}
+        return {"message_id": message_id, "date": int(time.time()), "chat": chat, "from": self.me, "text": text or ""}
+
+    def _chat(self, chat_id: int) -> dict:
+        return {
+            "id": chat_id,
+            "type": "supergroup" if chat_id < 0 else "private",
+            "title": "Fake group" if chat_id < 0 else None,
+            "accent_color_id": 0,
+            "max_reaction_count": 11,
+            "accepted_gift_types": {
+                "unlimited_gifts": False,
+                "limited_gifts": False,
+                "unique_gifts": False,
+                "premium_subscription": False,
+                "gifts_from_channels": False,
+            },
+        }
+
+    async def _result(self, method: str, params: dict):
+        if method == "getupdates":
+            return await self._get_updates(params)
+        if method == "getme":
+            return self.me
+        if method in ("sendmessage", "editmessagetext"):
+            return self._message(int(params["chat_id"]), params.get("text"))
+        if method == "getchat":
+            return self._chat(int(params["chat_id"]))
+        if method == "getfile":
+            file_id = params["file_id"]
+            return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files.get(file_id, b"")), "file_path": f"documents/{file_id}"}
+        # banChatMember, restrictChatMember, unbanChatMember, answerCallbackQuery, setWebhook и т.д.
+        return True
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] += 1
+        for listener in self.listeners:
+            listener(method, params)
+
+        if method not in self.SERVICE_METHODS:
+            if self.latency or self.jitter:
+                await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+            if self.error_rate and random.random() < self.error_rate:
+                self.errors_429 += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }, status=429)
+        return web.json_response({"ok": True, "result": await self._result(method, params)})
+
+    # Управление для внешних генераторов нагрузки
+
+    async def _download(self, request: web.Request) -> web.Response:
+        content = self.files.get(request.match_info["path"].rsplit("/", 1)[-1])
+        if content is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=content)
+
+    async def _control_updates(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        payloads = payload if isinstance(payload, list) else [payload]
+        return web.json_response({"update_ids": [self.add_update(item) for item in payloads]})
+
+    async def _control_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "errors_429": self.errors_429, "pending_updates": len(self.updates)}
+
+    # Запуск и остановка
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._download)
+        app.router.add_post("/control/updates", self._control_updates)
+        app.router.add_get("/control/stats", self._control_stats)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081):
+        self._new_updates = asyncio.Event()
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0, help="средняя задержка ответа, мс")
+    parser.add_argument("--jitter", type=float, default=0, help="разброс задержки, мс")
+    parser.add_argument("--error-rate", type=float, default=0, help="доля ответов 429 (0..1)")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, сек")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(args.latency / 1000, args.jitter / 1000, args.error_rate, args.retry_after)
+    await fake.start(args.host, args.port)
+    print(f"Заглушка Bot API: http://{args.host}:{args.port} (укажите TELEGRAM_API_URL в config.py)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await fake.stop()
+        print(json.dumps(fake.stats(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,87 @@
+import time
+from collections import OrderedDict
+
+
+class _History:
+    """Кольцевой буфер времён последних сообщений одного пользователя."""
+
+    __slots__ = ("times", "pos", "count", "last", "quiet_until")
+
+    def __init__(self, size: int):
+        self.times = [0.0] * size
+        self.pos = 0  # куда запишется следующее сообщение
+        self.count = 0  # сообщений в буфере (не больше size)
+        self.last = 0.0
+        self.quiet_until = 0.0  # после срабатывания пользователь не проверяется до этого момента
+
+
+class FloodDetector:
+    """
+    Скользящее окно сообщений по каждому пользователю.
+    rules — список пар (сообщений, секунд): правило срабатывает, если n-е с конца сообщение
+    пришло не раньше, чем seconds секунд назад. Буфер хранит max(n) последних времён,
+    поэтому проверка всех правил — несколько обращений по индексу, O(1) на сообщение.
+
+    Пользователи, не писавшие idle_ttl секунд, вытесняются; всего хранится не больше max_users.
+    """
+
+    def __init__(self, rules: list[tuple[int, float]], cooldown: float = 60, idle_ttl: float = 300, max_users: int = 100000):
+        self.rules = sorted((int(count), float(seconds)) for count, seconds in rules if count > 1)
+        self.size = max((count for count, _ in self.rules), default=1)
+        self.cooldown = cooldown
+        self.idle_ttl = max(idle_ttl, max((seconds for _, seconds in self.rules), default=0))
+        self.max_users = max_users
+        # user_id -> история; порядок — от давно писавших к недавним
+        self._users: OrderedDict[int, _History] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def hit(self, user_id: int, now: float | None = None) -> tuple[int, float] | None:
+        """
+        Учитывает сообщение пользователя. Возвращает сработавшее правило (сообщений, секунд)
+        или None. После срабатывания пользователь cooldown секунд не проверяется повторно.
+        """
+        if not self.rules:
+            return None
+        if now is None:
+            now = time.monotonic()
+        history = self._users.get(user_id)
+        if history is None:
+            history = self._users[user_id] = _History(self.size)
+        else:
+            self._users.move_to_end(user_id)
+
+        times, size = history.times, self.size
+        times[history.pos] = now
+        history.pos = (history.pos + 1) % size
+        if history.count < size:
+            history.count += 1
+        history.last = now
+        self._evict(now)
+        if now < history.quiet_until:
+            return None
+
+        for count, seconds in self.rules:
+            if history.count < count:
+                break
+            # Время count-го с конца сообщения (текущее — первое с конца)
+            if now - times[(history.pos - count) % size] <= seconds:
+                history.quiet_until = now + self.cooldown
+                history.count = 0
+                return count, seconds
+        return None
+
+    def forget(self, user_id: int):
+        self._users.pop(user_id, None)
+
+    def _evict(self, now: float):
+        users = self._users
+        # Самые давно писавшие — в начале; текущий пользователь только что перенесён в конец
+        while len(users) > self.max_users:
+            users.popitem(last=False)
+        while users:
+            history = next(iter(users.values()))
+            if now - history.last <= self.idle_ttl:
+                break
+            users.popitem(last=False)
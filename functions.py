@@ -1,106 +1,355 @@
 import aiosqlite
 import json
+import logging
 import re
 import os
 import time 
 import asyncio
 from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
 from aiogram.types import ChatPermissions, InlineKeyboardButton, InlineKeyboardMarkup
 
-from config import DB_NAME, GROUP_ID, TOKEN, LOGGING_GROUP_ID
+from config import DB_NAME, GROUP_ID, TOKEN, LOGGING_GROUP_ID, CHAT_CACHE_TTL, IDENTITY_CACHE_SIZE, WARN_LIMIT, TELEGRAM_API_URL
+from config import SEND_MAX_ATTEMPTS, BULK_CONCURRENCY, BLACKLIST_PAGE_SIZE, BLACKLIST_CACHE_TTL, WORKERS
 from keyboards import apil_message_button
-
-bot = Bot(token=TOKEN)
-
-# Функция для инициализации БД (вызывайте один раз, теперь async)
-async def init_db():
+from database import db
+from word_filter import ForbiddenWords, normalize_text
+from scheduler import scheduler
+from sender import create_sender
+from cache import ChatCache, IdentityCache, PageCache
+from metrics import ApiTimingMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Бот для официального Bot API или для TELEGRAM_API_URL (свой сервер Bot API, fake_telegram.py)
+def create_bot() -> Bot:
+    if TELEGRAM_API_URL:
+        bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+    else:
+        bot = Bot(token=TOKEN)
+    # Время каждого вызова Bot API (send_message, ban_chat_member и т.д.) идёт в метрики
+    bot.session.middleware(ApiTimingMiddleware())
+    return bot
+
+bot = create_bot()
+# Все сообщения в группу, логи и личку идут через очередь с учётом лимитов Telegram
+sender = create_sender(bot)
+# Метаданные группы (тип чата) кэшируются, чтобы не вызывать get_chat на каждое действие
+chat_cache = ChatCache(bot, CHAT_CACHE_TTL)
+# Индекс username <-> user_id в памяти: поиск пользователя без обращения к БД
+identities = IdentityCache(IDENTITY_CACHE_SIZE)
+# При WORKERS > 1 смену username видит только процесс отправителя, а команду модератора
+# обрабатывает процесс модератора: цель действия ищется в БД, кэш лишь обновляется
+_TRUST_IDENTITIES = WORKERS == 1
+# Готовые страницы /blacklist; сбрасываются после каждого изменения черного списка (invalidate — после коммита)
+blacklist_pages = PageCache(BLACKLIST_CACHE_TTL)
+
+# Версия схемы БД (хранится в PRAGMA user_version); увеличивайте при каждой новой миграции
+SCHEMA_VERSION = 10
+
+# Миграции схемы по версиям (_MIGRATIONS): каждая выполняется одной транзакцией вместе с записью новой версии
+
+# Исходные таблицы и проверки схем, созданных до версионирования
+async def _migrate_v1(conn):
+    # Создаём таблицы с новой схемой (если их нет)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            user_id INTEGER NOT NULL,
+            warnings INTEGER NOT NULL,
+            warning_1_data INTEGER NOT NULL,
+            warning_2_data INTEGER NOT NULL,   
+            warning_3_data INTEGER NOT NULL
+        )
+    """)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS blacklist (
+            username TEXT PRIMARY KEY,
+            ban_data TEXT NOT NULL
+        )
+    """)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS badcases (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            case_id TEXT UNIQUE NOT NULL,
+            username TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            moderator TEXT NOT NULL
+        )           
+    """)
+    # Миграция для blacklist (если столбца ban_data нет)
     try:
-        async with aiosqlite.connect(DB_NAME) as conn:
-            # Создаём таблицы с новой схемой (если их нет)
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    warnings INTEGER NOT NULL,
-                    warning_1_data INTEGER NOT NULL,
-                    warning_2_data INTEGER NOT NULL,   
-                    warning_3_data INTEGER NOT NULL
-                )
-            """)
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS blacklist (
-                    username TEXT PRIMARY KEY,
-                    ban_data TEXT NOT NULL
-                )
-            """)
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS badcases (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    case_id TEXT UNIQUE NOT NULL,
-                    username TEXT NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    type TEXT NOT NULL,
-                    moderator TEXT NOT NULL
-                )           
-            """)
-            # Миграция для blacklist (если столбца ban_data нет)
-            try:
-                await conn.execute("SELECT ban_data FROM blacklist LIMIT 1")
-            except aiosqlite.OperationalError:
-                await conn.execute("ALTER TABLE blacklist ADD COLUMN ban_data TEXT NOT NULL DEFAULT '{}'")
-                print("Столбец ban_data добавлен в таблицу blacklist.")
-            # Миграция для users: проверяем и добавляем столбец id, если его нет
-            try:
-                await conn.execute("SELECT id FROM users LIMIT 1")
-            except aiosqlite.OperationalError:
-                print("Выполняем миграцию таблицы users...")
-                # Создаём временную таблицу с новой схемой
-                await conn.execute("""
-                    CREATE TABLE users_temp (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        username TEXT UNIQUE NOT NULL,
-                        user_id INTEGER NOT NULL,
-                        warnings INTEGER NOT NULL,
-                        warning_1_data INTEGER NOT NULL,
-                        warning_2_data INTEGER NOT NULL,   
-                        warning_3_data INTEGER NOT NULL
-                    )
-                """)
-                # Копируем существующие данные (id присвоится автоматически: 1, 2, 3...)
-                await conn.execute("INSERT INTO users_temp (username, user_id) SELECT username, user_id FROM users")
-                # Удаляем старую таблицу
-                await conn.execute("DROP TABLE users")
-                # Переименовываем временную таблицу
-                await conn.execute("ALTER TABLE users_temp RENAME TO users")
-                print("Миграция таблицы users завершена.")
-            # Миграция для badcases: проверяем и добавляем столбец id и type, если их нет
-            try:
-                await conn.execute("SELECT id FROM badcases LIMIT 1")
-            except aiosqlite.OperationalError:
-                print("Выполняем миграцию таблицы badcases...")
-                # Создаём временную таблицу с новой схемой
-                await conn.execute("""
-                    CREATE TABLE badcases_temp (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        case_id TEXT UNIQUE NOT NULL,
-                        username TEXT NOT NULL,
-                        user_id INTEGER NOT NULL,
-                        type TEXT NOT NULL DEFAULT 'unknown',
-                        moderator TEXT NOT NULL
-                    )
-                """)
-                # Копируем существующие данные (id присвоится автоматически, type получит DEFAULT 'unknown')
-                await conn.execute("INSERT INTO badcases_temp (case_id, username, user_id, type, moderator) SELECT case_id, username, user_id, 'unknown', moderator FROM badcases")
-                # Удаляем старую таблицу
-                await conn.execute("DROP TABLE badcases")
-                # Переименовываем временную таблицу
-                await conn.execute("ALTER TABLE badcases_temp RENAME TO badcases")
-                print("Миграция таблицы badcases завершена.")
-            await conn.commit()
-        print("База данных инициализирована.")
-    except Exception as e:
-        print(f"Ошибка инициализации БД: {e}")
+        await conn.execute("SELECT ban_data FROM blacklist LIMIT 1")
+    except aiosqlite.OperationalError:
+        await conn.execute("ALTER TABLE blacklist ADD COLUMN ban_data TEXT NOT NULL DEFAULT '{}'")
+        logger.info("Столбец ban_data добавлен в таблицу blacklist.")
+    # Миграция для users: проверяем и добавляем столбец id, если его нет
+    try:
+        await conn.execute("SELECT id FROM users LIMIT 1")
+    except aiosqlite.OperationalError:
+        logger.info("Выполняем миграцию таблицы users...")
+        # Создаём временную таблицу с новой схемой
+        await conn.execute("""
+            CREATE TABLE users_temp (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                user_id INTEGER NOT NULL,
+                warnings INTEGER NOT NULL,
+                warning_1_data INTEGER NOT NULL,
+                warning_2_data INTEGER NOT NULL,   
+                warning_3_data INTEGER NOT NULL
+            )
+        """)
+        # Копируем существующие данные (id присвоится автоматически: 1, 2, 3...)
+        await conn.execute(
+            "INSERT INTO users_temp (username, user_id, warnings, warning_1_data, warning_2_data, warning_3_data) "
+            "SELECT username, user_id, COALESCE(warnings, 0), COALESCE(warning_1_data, 0), COALESCE(warning_2_data, 0), COALESCE(warning_3_data, 0) FROM users"
+        )
+        # Удаляем старую таблицу
+        await conn.execute("DROP TABLE users")
+        # Переименовываем временную таблицу
+        await conn.execute("ALTER TABLE users_temp RENAME TO users")
+        logger.info("Миграция таблицы users завершена.")
+    # Миграция для badcases: проверяем и добавляем столбец id и type, если их нет
+    try:
+        await conn.execute("SELECT id FROM badcases LIMIT 1")
+    except aiosqlite.OperationalError:
+        logger.info("Выполняем миграцию таблицы badcases...")
+        # Создаём временную таблицу с новой схемой
+        await conn.execute("""
+            CREATE TABLE badcases_temp (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                case_id TEXT UNIQUE NOT NULL,
+                username TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                type TEXT NOT NULL DEFAULT 'unknown',
+                moderator TEXT NOT NULL
+            )
+        """)
+        # Копируем существующие данные (id присвоится автоматически, type получит DEFAULT 'unknown')
+        await conn.execute("INSERT INTO badcases_temp (case_id, username, user_id, type, moderator) SELECT case_id, username, user_id, 'unknown', moderator FROM badcases")
+        # Удаляем старую таблицу
+        await conn.execute("DROP TABLE badcases")
+        # Переименовываем временную таблицу
+        await conn.execute("ALTER TABLE badcases_temp RENAME TO badcases")
+        logger.info("Миграция таблицы badcases завершена.")
+
+# Индексы для поиска кейсов и пользователей по user_id/username
+async def _migrate_v2(conn):
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_user_id ON users (user_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_badcases_username ON badcases (username, case_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_badcases_user_id ON badcases (user_id, case_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_badcases_user_type ON badcases (user_id, type, case_id)")
+    logger.info("Индексы users/badcases созданы.")
+
+# Мут хранится в users, чтобы планировщик мог восстановить сроки после перезапуска
+async def _migrate_v3(conn):
+    await conn.execute("ALTER TABLE users ADD COLUMN muted_until INTEGER NOT NULL DEFAULT 0")
+    await conn.execute("ALTER TABLE users ADD COLUMN muted_reason TEXT NOT NULL DEFAULT ''")
+    logger.info("Столбцы muted_until и muted_reason добавлены в таблицу users.")
+
+# Миграция blacklist: JSON в ban_data -> отдельные типизированные столбцы
+async def _migrate_v4(conn):
+    logger.info("Выполняем миграцию таблицы blacklist...")
+    await conn.execute("""
+        CREATE TABLE blacklist_temp (
+            username TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            until INTEGER NOT NULL DEFAULT 0,
+            reason TEXT NOT NULL DEFAULT ''
+        )
+    """)
+    async with conn.execute("SELECT username, ban_data FROM blacklist") as cursor:
+        rows = await cursor.fetchall()
+    entries = []
+    for username, ban_data_json in rows:
+        ban_data = json.loads(ban_data_json)
+        if "id" not in ban_data:
+            logger.warning("Запись blacklist для @%s без ID пропущена: %s", username, ban_data_json)
+            continue
+        entries.append((username, ban_data["id"], ban_data.get("until", 0), ban_data.get("reason", "Не указана")))
+    await conn.executemany("INSERT INTO blacklist_temp (username, user_id, until, reason) VALUES (?, ?, ?, ?)", entries)
+    await conn.execute("DROP TABLE blacklist")
+    await conn.execute("ALTER TABLE blacklist_temp RENAME TO blacklist")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_blacklist_until ON blacklist (until)")
+    logger.info("Миграция таблицы blacklist завершена, перенесено записей: %s.", len(entries))
+
+# Счётчик номеров кейсов по дням, продолжаем с уже выданных номеров
+async def _migrate_v5(conn):
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS case_sequence (
+            day TEXT PRIMARY KEY,
+            last_num INTEGER NOT NULL
+        )
+    """)
+    await conn.execute("""
+        INSERT OR REPLACE INTO case_sequence (day, last_num)
+        SELECT substr(case_id, 5, 8), MAX(CAST(substr(case_id, 14) AS INTEGER)) FROM badcases WHERE case_id LIKE 'TKS-%' GROUP BY substr(case_id, 5, 8)
+    """)
+    logger.info("Таблица case_sequence создана.")
+
+# Миграция предупреждений: счётчик и warning_1..3_data в users -> по строке на предупреждение в warnings
+async def _migrate_v6(conn):
+    logger.info("Выполняем миграцию предупреждений...")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS warnings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            case_id TEXT,
+            expires_at INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    async with conn.execute("SELECT user_id, warnings, warning_1_data, warning_2_data, warning_3_data FROM users WHERE warnings > 0 OR warning_1_data > 0 OR warning_2_data > 0 OR warning_3_data > 0") as cursor:
+        rows = await cursor.fetchall()
+    entries = []
+    for user_id, warnings_count, *warning_data in rows:
+        timed = [expires_at for expires_at in warning_data if expires_at > 0]
+        # Предупреждения без срока хранились только в счётчике
+        entries += [(user_id, 0)] * max(0, warnings_count - len(timed))
+        entries += [(user_id, expires_at) for expires_at in timed]
+    await conn.executemany("INSERT INTO warnings (user_id, expires_at) VALUES (?, ?)", entries)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_warnings_user_id ON warnings (user_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_warnings_expires_at ON warnings (expires_at)")
+    # Пересоздаём users без столбцов предупреждений
+    await conn.execute("""
+        CREATE TABLE users_temp (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            user_id INTEGER NOT NULL,
+            muted_until INTEGER NOT NULL DEFAULT 0,
+            muted_reason TEXT NOT NULL DEFAULT ''
+        )
+    """)
+    await conn.execute("INSERT INTO users_temp (id, username, user_id, muted_until, muted_reason) SELECT id, username, user_id, muted_until, muted_reason FROM users")
+    await conn.execute("DROP TABLE users")
+    await conn.execute("ALTER TABLE users_temp RENAME TO users")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_user_id ON users (user_id)")
+    logger.info("Миграция предупреждений завершена, перенесено: %s.", len(entries))
+
+# Общие для всех процессов бота FSM-состояния и аренда лидерства
+async def _migrate_v7(conn):
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at INTEGER NOT NULL
+        )
+    """)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    logger.info("Таблицы fsm_states и leases созданы.")
+
+# Индекс для удаления брошенных FSM-диалогов
+async def _migrate_v8(conn):
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states (updated_at)")
+    logger.info("Индекс fsm_states создан.")
+
+# Частичный индекс по срокам мутов: load_deadlines читает только заглушённых, без обхода всей users
+async def _migrate_v9(conn):
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_muted_until ON users (muted_until) WHERE muted_until > 0")
+    logger.info("Индекс users по muted_until создан.")
+
+# Очередь сроков, выданных в рабочих процессах, для лидера планировщика (WORKERS > 1).
+# У key нет типа: имя пользователя хранится строкой, номер предупреждения — числом
+async def _migrate_v10(conn):
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS pending_deadlines (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            deadline INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            key
+        )
+    """)
+    logger.info("Таблица pending_deadlines создана.")
+
+
+_MIGRATIONS = [(1, _migrate_v1), (2, _migrate_v2), (3, _migrate_v3), (4, _migrate_v4), (5, _migrate_v5), (6, _migrate_v6), (7, _migrate_v7), (8, _migrate_v8), (9, _migrate_v9), (10, _migrate_v10)]
+
+async def _schema_version(conn) -> int:
+    async with conn.execute("PRAGMA user_version") as cursor:
+        return (await cursor.fetchone())[0]
+
+# Функция для инициализации БД (вызывайте один раз при запуске; ошибка миграции останавливает запуск)
+async def init_db():
+    await db.start()
+    async with db.write() as conn:
+        version = await _schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        logger.info("Схема БД актуальна (версия %s).", version)
+    for target, migrate in _MIGRATIONS:
+        if version >= target:
+            continue
+        try:
+            async with db.write() as conn:
+                # Явный BEGIN: иначе sqlite3 выполняет DDL вне транзакции, и сбой посреди миграции
+                # оставляет временные таблицы и наполовину изменённую схему. IMMEDIATE сразу берёт
+                # блокировку записи, поэтому при нескольких процессах миграцию выполняет только один
+                await conn.execute("BEGIN IMMEDIATE")
+                version = await _schema_version(conn)
+                if version < target:
+                    await migrate(conn)
+                    await conn.execute(f"PRAGMA user_version = {target}")
+                    version = target
+        except Exception:
+            logger.exception("Миграция схемы БД до версии %s не выполнена, изменения откатаны.", target)
+            raise
+    logger.info("База данных инициализирована.")
+
+# Функция для закрытия соединений с БД при остановке бота
+async def close_db():
+    await db.close()
+    logger.info("Соединения с базой данных закрыты.")
+
+# Вставка кейса в badcases внутри транзакции вызывающего; возвращает case_id
+async def _insert_badcase(conn, username: str | None, user_id: int, moderator: str | None, case_type: str) -> str:
+    # Генерируем case_id: TKS-YYYYMMDD-NNNN
+    current_date = time.strftime("%Y%m%d")
+    # Получаем следующий порядковый номер для текущей даты (в той же транзакции, что и вставка кейса)
+    async with conn.execute(
+        "INSERT INTO case_sequence (day, last_num) VALUES (?, 1) ON CONFLICT(day) DO UPDATE SET last_num = last_num + 1 RETURNING last_num",
+        (current_date,)
+    ) as cursor:
+        next_num = (await cursor.fetchone())[0]
+    case_id = f"TKS-{current_date}-{next_num:04d}"
+
+    # Вставляем кейс в таблицу (username может быть неизвестен, если действие было по ID)
+    await conn.execute(
+        "INSERT INTO badcases (case_id, username, user_id, type, moderator) VALUES (?, ?, ?, ?, ?)",
+        (case_id, username or "", user_id, case_type.lower(), moderator)
+    )
+    # Привязываем кейс к последнему выданному предупреждению
+    if case_type.lower() == "предупреждение":
+        await conn.execute(
+            "UPDATE warnings SET case_id = ? WHERE id = (SELECT id FROM warnings WHERE user_id = ? AND case_id IS NULL ORDER BY id DESC LIMIT 1)",
+            (case_id, user_id)
+        )
+    logger.info("Кейс добавлен: %s для %s (%s)", case_id, f'@{username}' if username else user_id, case_type)
+    return case_id
+
+# Текст кейса для группы логов и чата
+def format_case_message(case_id: str, username: str | None, user_id: int, moderator: str | None, case_type: str, duration: int = 0, reason: str = "") -> str:
+    # Определяем эмодзи для типа кейса
+    emoji_map = {
+        "заглушен": "🔇",
+        "бан": "🔨",
+        "предупреждение": "⚠️"
+    }
+    emoji = emoji_map.get(case_type.lower(), "❓")
+
+    # Форматируем длительность
+    duration_text = format_time(duration) if duration > 0 else "Постоянно"
+    user_text = f"@{username}" if username else str(user_id)
+    return f"{emoji} {case_type.capitalize()} — {case_id}\nПользователь: {user_text}\nДлительность: {duration_text}\nПричина: {reason or 'Не указана'}\nМодератор: {moderator or "Неизвестен"}"
 
 # Новая функция для добавления кейса в таблицу badcases и отправки сообщения в логи
 async def add_badcase(username: str, user_id: int, moderator: str | None, case_type: str, duration: int = 0, reason: str = "") -> str:
@@ -111,53 +360,15 @@ async def add_badcase(username: str, user_id: int, moderator: str | None, case_t
     reason: причина (по умолчанию 'Не указана').
     """
     try:
-        # Генерируем case_id: TKS-YYYYMMDD-NNNN
-        current_date = time.strftime("%Y%m%d")
-        async with aiosqlite.connect(DB_NAME) as conn:
-            # Находим последний порядковый номер для текущей даты
-            cursor = await conn.execute(
-                "SELECT case_id FROM badcases WHERE case_id LIKE ? ORDER BY case_id DESC LIMIT 1",
-                (f"TKS-{current_date}-%",)
-            )
-            result = await cursor.fetchone()
-            if result:
-                last_num = int(result[0].split('-')[-1])
-                next_num = last_num + 1
-            else:
-                next_num = 1
-            case_id = f"TKS-{current_date}-{next_num:04d}"
-            
-            # Вставляем кейс в таблицу
-            await conn.execute(
-                "INSERT INTO badcases (case_id, username, user_id, type, moderator) VALUES (?, ?, ?, ?, ?)",
-                (case_id, username, user_id, case_type.lower(), moderator)
-            )
-            await conn.commit()
-        
-        # Определяем эмодзи для типа кейса
-        emoji_map = {
-            "заглушен": "🔇",
-            "бан": "🔨",
-            "предупреждение": "⚠️"
-        }
-        emoji = emoji_map.get(case_type.lower(), "❓")
-        
-        # Форматируем длительность
-        duration_text = format_time(duration) if duration > 0 else "Постоянно"
-        
-        # Формируем сообщение для логов
-        message = f"{emoji} {case_type.capitalize()} — {case_id}\nПользователь: @{username}\nДлительность: {duration_text}\nПричина: {reason or 'Не указана'}\nМодератор: {moderator or "Неизвестен"}"
-        
-        # Отправляем сообщение в группу логов
-        try:
-            await bot.send_message(chat_id=LOGGING_GROUP_ID, text=message)
-        except Exception as e:
-            print(f"Ошибка отправки сообщения в логи: {e}")
-        
-        print(f"Кейс добавлен: {case_id} для @{username} ({case_type})")
+        async with db.write() as conn:
+            case_id = await _insert_badcase(conn, username, user_id, moderator, case_type)
+
+        # Формируем сообщение для логов и отправляем его в группу логов
+        message = format_case_message(case_id, username, user_id, moderator, case_type, duration, reason)
+        sender.send_message(chat_id=LOGGING_GROUP_ID, text=message)
         return message
     except Exception as e:
-        print(f"Ошибка добавления кейса: {e}")
+        logger.error("Ошибка добавления кейса: %s", e)
 
 # Реализованная функция для сортировки и извлечения кейсов пользователя по username или user_id
 async def sort_users_cases_by_username_or_id(username: str = None, user_id: int = None):
@@ -167,12 +378,23 @@ async def sort_users_cases_by_username_or_id(username: str = None, user_id: int
     Каждый словарь содержит: id, case_id, username, user_id, type, moderator.
     """
     try:
-        async with aiosqlite.connect(DB_NAME) as conn:
-            cursor = await conn.execute(
-                "SELECT id, case_id, username, user_id, type, moderator FROM badcases WHERE (username = ? OR ? IS NULL) AND (user_id = ? OR ? IS NULL) ORDER BY case_id DESC",
-                (username, username, user_id, user_id)
-            )
-            rows = await cursor.fetchall()
+        # Отдельный запрос для каждого варианта, чтобы SQLite мог использовать индекс
+        if username is not None and user_id is not None:
+            condition = "WHERE username = ? AND user_id = ?"
+            param = (username, user_id)
+        elif username is not None:
+            condition = "WHERE username = ?"
+            param = (username,)
+        elif user_id is not None:
+            condition = "WHERE user_id = ?"
+            param = (user_id,)
+        else:
+            condition = ""
+            param = ()
+        rows = await db.fetchall(
+            f"SELECT id, case_id, username, user_id, type, moderator FROM badcases {condition} ORDER BY case_id DESC",
+            param
+        )
         
         # Преобразуем в список словарей для удобства
         cases = [
@@ -187,10 +409,10 @@ async def sort_users_cases_by_username_or_id(username: str = None, user_id: int
             for row in rows
         ]
         
-        print(f"Найдено {len(cases)} кейсов для @{username} или ID {user_id}")
+        logger.debug("Найдено %s кейсов для @%s или ID %s", len(cases), username, user_id)
         return cases
     except Exception as e:
-        print(f"Ошибка извлечения кейсов: {e}")
+        logger.error("Ошибка извлечения кейсов: %s", e)
         return []
 # Новая функция для создания Inline клавиатуры с кнопками case_id
 def create_cases_keyboard(cases: list) -> InlineKeyboardMarkup:
@@ -211,351 +433,586 @@ async def load_users():
     try:
         if not os.path.exists(DB_NAME):
             return {}  # Если файла нет, возвращаем пустой словарь
-        async with aiosqlite.connect(DB_NAME) as conn:
-            cursor = await conn.execute("SELECT id, username, user_id FROM users")
-            rows = await cursor.fetchall()
-            users = {row[1]: {"db_id": row[0], "id": row[2], "muted_until": 0, "muted_reason": ""} for row in rows}  # row[0] - db_id, row[1] - username, row[2] - user_id
+        rows = await db.fetchall("SELECT id, username, user_id, muted_until, muted_reason FROM users")
+        users = {row[1]: {"db_id": row[0], "id": row[2], "muted_until": row[3], "muted_reason": row[4]} for row in rows}  # row[0] - db_id, row[1] - username, row[2] - user_id
         return users
     except Exception as e:
-        print(f"Ошибка загрузки пользователей: {e}")
+        logger.error("Ошибка загрузки пользователей: %s", e)
         return {}
 
 # Функция для сохранения пользователей в SQL таблицу (теперь async)
 async def save_users(users):
     try:
-        async with aiosqlite.connect(DB_NAME) as conn:
-            await conn.execute("DELETE FROM users")  # Очищаем таблицу перед вставкой
-            for username, data in users.items():
-                # Вставляем с автоинкрементом id (если db_id есть, используем его; иначе - NULL для авто)
-                db_id = data.get("db_id", None)
-                await conn.execute("INSERT INTO users (id, username, user_id, warnings, warning_1_data, warning_2_data, warning_3_data) VALUES (?, ?, ?, ?, ?, ?, ?)", (db_id, username, data["id"], 0, 0, 0, 0))
-            await conn.commit()
+        async with db.write() as conn:
+            # Удаляем только тех, кого больше нет в словаре
+            async with conn.execute("SELECT username FROM users") as cursor:
+                stale = [(row[0],) for row in await cursor.fetchall() if row[0] not in users]
+            await conn.executemany("DELETE FROM users WHERE username = ?", stale)
+            # Upsert: id строк сохраняются
+            await conn.executemany(
+                "INSERT INTO users (id, username, user_id, muted_until, muted_reason) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(username) DO UPDATE SET user_id = excluded.user_id, muted_until = excluded.muted_until, muted_reason = excluded.muted_reason",
+                [(data.get("db_id", None), username, data["id"], data.get("muted_until", 0), data.get("muted_reason", "")) for username, data in users.items()]
+            )
+        for username, in stale:
+            identities.discard(username)
+        for username, data in users.items():
+            identities.put(username, data["id"])
     except Exception as e:
-        print(f"Ошибка сохранения пользователей: {e}")
+        logger.error("Ошибка сохранения пользователей: %s", e)
+
+async def register_user(username: str, user_id: int) -> bool:
+    """
+    Регистрирует пользователя, замеченного в группе.
+    Если пользователь сменил username, переименовывает его существующую строку,
+    поэтому данные о муте сохраняются.
+    Уже известная пара (username, user_id) не стоит ни одного запроса к БД.
+    Возвращает True, если строка была добавлена или обновлена, иначе False.
+    """
+    if identities.get_id(username) == user_id:
+        return False
+    try:
+        async with db.write() as conn:
+            async with conn.execute("SELECT user_id FROM users WHERE username = ?", (username,)) as cursor:
+                row = await cursor.fetchone()
+            if row:
+                # username уже есть в базе: обновляем ID, если username перешёл к другому пользователю
+                async with conn.execute("UPDATE users SET user_id = ? WHERE username = ? AND user_id != ?", (user_id, username, user_id)) as cursor:
+                    changed = cursor.rowcount > 0
+            else:
+                # Пользователь сменил username: переименовываем его последнюю строку
+                async with conn.execute(
+                    "UPDATE users SET username = ? WHERE id = (SELECT id FROM users WHERE user_id = ? ORDER BY id DESC LIMIT 1)",
+                    (username, user_id)
+                ) as cursor:
+                    renamed = cursor.rowcount > 0
+                if not renamed:
+                    await conn.execute("INSERT INTO users (username, user_id) VALUES (?, ?)", (username, user_id))
+                changed = True
+        identities.put(username, user_id)
+        return changed
+    except Exception as e:
+        logger.error("Ошибка регистрации пользователя @%s: %s", username, e)
+        return False
+
+# Загрузка индекса username <-> user_id при старте (последние IDENTITY_CACHE_SIZE пользователей)
+async def load_identities():
+    try:
+        rows = await db.fetchall("SELECT username, user_id FROM users ORDER BY id DESC LIMIT ?", (identities.max_size,))
+        # Вставляем от старых к новым, чтобы новые вытеснялись последними
+        for username, user_id in reversed(rows):
+            identities.put(username, user_id)
+        logger.info("Загружено пользователей в кэш: %s", len(identities))
+    except Exception as e:
+        logger.error("Ошибка загрузки кэша пользователей: %s", e)
 
 # Функция для загрузки черного списка из SQL таблицы (теперь async)
 async def load_blacklist():
     try:
         if not os.path.exists(DB_NAME):
             return {}  # Если файла нет, возвращаем пустой словарь
-        async with aiosqlite.connect(DB_NAME) as conn:
-            cursor = await conn.execute("SELECT username, ban_data FROM blacklist")
-            rows = await cursor.fetchall()
-            blacklist = {}
-            for row in rows:
-                username = row[0]
-                ban_data = json.loads(row[1])  # Десериализуем JSON обратно в словарь
-                blacklist[username] = ban_data
-        return blacklist
+        rows = await db.fetchall("SELECT username, user_id, until, reason FROM blacklist")
+        return {row[0]: {"id": row[1], "until": row[2], "reason": row[3]} for row in rows}
     except Exception as e:
-        print(f"Ошибка загрузки blacklist: {e}")
+        logger.error("Ошибка загрузки blacklist: %s", e)
         return {}
 
-# Функция для сохранения черного списка в SQL таблицу (теперь async)
+# Функция для сохранения черного списка в SQL таблицу целиком (теперь async)
 async def save_blacklist(blacklist):
     try:
-        async with aiosqlite.connect(DB_NAME) as conn:
+        async with db.write() as conn:
             await conn.execute("DELETE FROM blacklist")
-            for username, ban_data in blacklist.items():
-                ban_data_json = json.dumps(ban_data)  # Сериализуем словарь в JSON
-                await conn.execute("INSERT INTO blacklist (username, ban_data) VALUES (?, ?)", (username, ban_data_json))
-            await conn.commit()
+            await conn.executemany(
+                "INSERT INTO blacklist (username, user_id, until, reason) VALUES (?, ?, ?, ?)",
+                [(username, data["id"], data.get("until", 0), data.get("reason", "Не указана")) for username, data in blacklist.items()]
+            )
+        blacklist_pages.invalidate()
+    except Exception as e:
+        logger.error("Ошибка сохранения blacklist: %s", e)
+
+# Функция для получения одной записи черного списка
+async def get_blacklist_entry(username: str) -> dict | None:
+    try:
+        row = await db.fetchone("SELECT user_id, until, reason FROM blacklist WHERE username = ?", (username,))
+        if row:
+            return {"id": row[0], "until": row[1], "reason": row[2]}
+        return None
+    except Exception as e:
+        logger.error("Ошибка загрузки записи blacklist для @%s: %s", username, e)
+        return None
+
+# Запись в черный список внутри транзакции вызывающего
+_BLACKLIST_UPSERT_SQL = (
+    "INSERT INTO blacklist (username, user_id, until, reason) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(username) DO UPDATE SET user_id = excluded.user_id, until = excluded.until, reason = excluded.reason"
+)
+
+async def _blacklist_upsert(conn, username: str, user_id: int, until: int = 0, reason: str = ""):
+    await conn.execute(_BLACKLIST_UPSERT_SQL, (username, user_id, until, reason if reason else "Не указана"))
+
+# Удаление из черного списка внутри транзакции вызывающего; возвращает True, если запись была
+async def _blacklist_delete(conn, username: str, until: int | None = None) -> bool:
+    if until is None:
+        sql, params = "DELETE FROM blacklist WHERE username = ?", (username,)
+    else:
+        sql, params = "DELETE FROM blacklist WHERE username = ? AND until = ?", (username, until)
+    async with conn.execute(sql, params) as cursor:
+        return cursor.rowcount > 0
+
+# Функция для добавления/обновления одной записи черного списка
+async def add_to_blacklist(username: str, user_id: int, until: int = 0, reason: str = "") -> bool:
+    try:
+        async with db.write() as conn:
+            await _blacklist_upsert(conn, username, user_id, until, reason)
+        blacklist_pages.invalidate()
+        return True
+    except Exception as e:
+        logger.error("Ошибка добавления @%s в blacklist: %s", username, e)
+        return False
+
+# Функция для удаления одной записи черного списка
+async def remove_from_blacklist(username: str, until: int | None = None) -> bool:
+    """
+    Удаляет пользователя из черного списка.
+    Если указан until, запись удаляется только при совпадении срока (для истечения банов).
+    Возвращает True, если запись была удалена.
+    """
+    try:
+        async with db.write() as conn:
+            removed = await _blacklist_delete(conn, username, until)
+        if removed:
+            blacklist_pages.invalidate()
+        return removed
+    except Exception as e:
+        logger.error("Ошибка удаления @%s из blacklist: %s", username, e)
+        return False
+
+_BLACKLIST_PAGE_COLUMNS = "SELECT username, user_id, until, reason FROM blacklist"
+_BLACKLIST_REASON_LIMIT = 80  # длинные причины обрезаются, чтобы страница укладывалась в лимит сообщения (4096)
+
+def create_blacklist_keyboard(page: int, pages: int) -> InlineKeyboardMarkup:
+    """
+    Клавиатура навигации по черному списку: ◀️, номер страницы (обновить) и ▶️.
+    callback_data — "blacklist:<номер страницы>".
+    """
+    buttons = []
+    if page > 1:
+        buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"blacklist:{page - 1}"))
+    buttons.append(InlineKeyboardButton(text=f"{page}/{pages}", callback_data=f"blacklist:{page}"))
+    if page < pages:
+        buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"blacklist:{page + 1}"))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+# Функция для получения одной страницы черного списка (нумерация с 1)
+async def get_blacklist_page(page: int = 1) -> tuple[str, InlineKeyboardMarkup | None]:
+    """
+    Возвращает текст страницы и клавиатуру навигации (None, если список пуст).
+    Готовые страницы берутся из кэша. При промахе — один запрос по индексу username:
+    от последней записи предыдущей страницы (если она в кэше), иначе через OFFSET.
+    Число записей запрашивается один раз после каждого изменения списка.
+    """
+    try:
+        generation = blacklist_pages.generation
+        total = blacklist_pages.get("total")
+        if total is None:
+            total = (await db.fetchone("SELECT COUNT(*) FROM blacklist"))[0]
+            blacklist_pages.put("total", total, generation)
+        if not total:
+            return "Черный список пуст.", None
+        pages = (total + BLACKLIST_PAGE_SIZE - 1) // BLACKLIST_PAGE_SIZE
+        page = min(max(page, 1), pages)
+
+        cached = blacklist_pages.get(page)
+        if cached is not None:
+            return cached[0], cached[1]
+        previous = blacklist_pages.get(page - 1)
+        if previous is not None:
+            rows = await db.fetchall(f"{_BLACKLIST_PAGE_COLUMNS} WHERE username > ? ORDER BY username LIMIT ?", (previous[2], BLACKLIST_PAGE_SIZE))
+        else:
+            rows = await db.fetchall(f"{_BLACKLIST_PAGE_COLUMNS} ORDER BY username LIMIT ? OFFSET ?", (BLACKLIST_PAGE_SIZE, (page - 1) * BLACKLIST_PAGE_SIZE))
+        if not rows:
+            return "Черный список пуст.", None
+
+        lines = [f"Черный список (всего {total}, страница {page} из {pages}):"]
+        for username, user_id, until, reason in rows:
+            if len(reason) > _BLACKLIST_REASON_LIMIT:
+                reason = reason[:_BLACKLIST_REASON_LIMIT - 1] + "…"
+            if until > 0:
+                until_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(until))
+                lines.append(f"@{username} (ID: {user_id}) - до {until_str}, причина: {reason}")
+            else:
+                lines.append(f"@{username} (ID: {user_id}) - постоянный, причина: {reason}")
+        text = "\n".join(lines)
+        keyboard = create_blacklist_keyboard(page, pages)
+        # Последний username страницы — начало следующей (keyset)
+        blacklist_pages.put(page, (text, keyboard, rows[-1][0]), generation)
+        return text, keyboard
+    except Exception as e:
+        logger.error("Ошибка загрузки страницы %s черного списка: %s", page, e)
+        return "Ошибка загрузки черного списка.", None
+
+# Предупреждения внутри транзакции вызывающего
+
+async def _add_warning(conn, user_id: int, expires_at: int = 0) -> int:
+    async with conn.execute("INSERT INTO warnings (user_id, expires_at) VALUES (?, ?)", (user_id, expires_at)) as cursor:
+        return cursor.lastrowid
+
+async def _count_warnings(conn, user_id: int) -> int:
+    # Активные предупреждения: бессрочные и ещё не истекшие
+    async with conn.execute(
+        "SELECT COUNT(*) FROM warnings WHERE user_id = ? AND (expires_at = 0 OR expires_at > ?)",
+        (user_id, int(time.time()))
+    ) as cursor:
+        return (await cursor.fetchone())[0]
+
+# Возвращает (было ли предупреждение, case_id его кейса или None — у предупреждения, приведшего к бану, кейса нет)
+async def _delete_last_warning(conn, user_id: int) -> tuple[bool, str | None]:
+    async with conn.execute(
+        "DELETE FROM warnings WHERE id = (SELECT id FROM warnings WHERE user_id = ? ORDER BY id DESC LIMIT 1) RETURNING case_id",
+        (user_id,)
+    ) as cursor:
+        row = await cursor.fetchone()
+    return (True, row[0]) if row else (False, None)
+
+async def _delete_case(conn, case_id: str):
+    await conn.execute("DELETE FROM badcases WHERE case_id = ?", (case_id,))
+
+# Удаление последнего кейса указанного типа (при снятии наказания)
+_DELETE_LAST_CASE_SQL = "DELETE FROM badcases WHERE id = (SELECT id FROM badcases WHERE user_id = ? AND type = ? ORDER BY case_id DESC LIMIT 1)"
+
+# Запись/сброс мута пользователя (muted_until = 0 — мута нет)
+_SET_MUTE_SQL = (
+    "INSERT INTO users (username, user_id, muted_until, muted_reason) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(username) DO UPDATE SET muted_until = excluded.muted_until, muted_reason = excluded.muted_reason"
+)
+
+async def _set_mute(conn, username: str, user_id: int, until: int, reason: str):
+    await conn.execute(_SET_MUTE_SQL, (username, user_id, until, reason))
+
+# Состояние до действия модератора: если Telegram API потом откажет, по нему откатываем БД
+
+async def _get_blacklist_row(conn, username: str) -> tuple | None:
+    async with conn.execute("SELECT user_id, until, reason FROM blacklist WHERE username = ?", (username,)) as cursor:
+        return await cursor.fetchone()
+
+async def _restore_blacklist_row(conn, username: str, previous: tuple | None):
+    if previous:
+        await _blacklist_upsert(conn, username, *previous)
+    else:
+        await _blacklist_delete(conn, username)
+
+async def _get_mute(conn, username: str) -> tuple[int, str]:
+    async with conn.execute("SELECT muted_until, muted_reason FROM users WHERE username = ?", (username,)) as cursor:
+        return await cursor.fetchone() or (0, "")
+
+# Удаление последнего кейса с возвратом строки (для восстановления)
+async def _pop_last_case(conn, user_id: int, case_type: str) -> tuple | None:
+    async with conn.execute(_DELETE_LAST_CASE_SQL + " RETURNING case_id, username, user_id, type, moderator", (user_id, case_type)) as cursor:
+        return await cursor.fetchone()
+
+async def _restore_case(conn, row: tuple | None):
+    if row:
+        await conn.execute("INSERT OR IGNORE INTO badcases (case_id, username, user_id, type, moderator) VALUES (?, ?, ?, ?, ?)", row)
+
+# Отмена только что выданного кейса: номер возвращается в последовательность, если после него номеров не выдавали
+async def _revert_badcase(conn, case_id: str):
+    await _delete_case(conn, case_id)
+    await conn.execute(
+        "UPDATE case_sequence SET last_num = last_num - 1 WHERE day = ? AND last_num = ?",
+        (case_id[4:12], int(case_id[13:]))
+    )
+
+async def _compensate(action: str, undo):
+    """
+    Откатывает закоммиченные изменения действия, если вызов Telegram API после commit не удался
+    (цель — администратор, у бота нет прав, сетевая ошибка). undo(conn) выполняется одной транзакцией.
+    """
+    try:
+        async with db.write() as conn:
+            await undo(conn)
+        logger.warning("Telegram не выполнил %s, изменения в БД отменены.", action)
     except Exception as e:
-        print(f"Ошибка сохранения blacklist: {e}")
+        logger.error("Не удалось отменить изменения в БД после ошибки (%s): %s", action, e)
 
 async def load_warnings_count(username: str = None, user_id: int = None) -> int | None:
     """
-    Возвращает количество предупреждений пользователя по username или user_id.
-    Возвращает None, если пользователь не найден.
+    Возвращает количество активных предупреждений пользователя по username или user_id.
+    Возвращает None, если пользователь с таким username не найден.
     """
     if not username and not user_id:
-        print("Ошибка: укажите username или user_id.")
+        logger.error("Ошибка: укажите username или user_id.")
         return None
     
     try:
-        async with aiosqlite.connect(DB_NAME) as conn:
-            # Определяем условие поиска
-            if user_id is not None:
-                condition = "WHERE user_id = ?"
-                param = (user_id,)
-            else:
-                condition = "WHERE username = ?"
-                param = (username,)
-            
-            # Выполняем SELECT для получения warnings
-            cursor = await conn.execute(
-                f"SELECT warnings FROM users {condition}",
-                param
-            )
-            result = await cursor.fetchone()
-            
-            if result:
-                warnings_count = result[0]
-                identifier = user_id if user_id else username
-                print(f"Warnings для {identifier}: {warnings_count}")
-                return warnings_count
-            else:
-                identifier = user_id if user_id else username
-                print(f"Пользователь с {identifier} не найден.")
+        identifier = user_id if user_id else username
+        if user_id is None:
+            user_id = await get_user_id_by_username_in_group(username)
+            if user_id is None:
+                logger.info("Пользователь с %s не найден.", identifier)
                 return None
+        
+        async with db.read() as conn:
+            warnings_count = await _count_warnings(conn, user_id)
+        logger.debug("Warnings для %s: %s", identifier, warnings_count)
+        return warnings_count
     except Exception as e:
-        print(f"Ошибка при загрузке warnings: {e}")
+        logger.error("Ошибка при загрузке warnings: %s", e)
         return None
 
 async def increment_warnings(username: str = None, user_id: int = None):
     """
-    Увеличивает warnings на 1 для пользователя по username или user_id.
-    Возвращает True, если обновление прошло успешно, иначе False.
+    Добавляет пользователю бессрочное предупреждение по username или user_id
+    (срок задаётся потом через set_warning_expiry).
+    Возвращает True, если предупреждение добавлено, иначе False.
     """
     if not username and not user_id:
-        print("Ошибка: укажите username или user_id.")
+        logger.error("Ошибка: укажите username или user_id.")
+        return False
     
     try:
-        async with aiosqlite.connect(DB_NAME) as conn:
-            # Определяем условие поиска
-            if user_id is not None:
-                condition = "WHERE user_id = ?"
-                param = (user_id,)
-            else:
-                condition = "WHERE username = ?"
-                param = (username,)
-            
-            # Обновляем warnings
-            await conn.execute(
-                f"UPDATE users SET warnings = warnings + 1 {condition}",
-                param
-            )
-            await conn.commit()
-            
-            # Проверяем, сколько строк обновлено
-            cursor = await conn.execute("SELECT changes()")
-            changes = await cursor.fetchone()
-            if changes and changes[0] > 0:
-                identifier = user_id if user_id else username
-                print(f"Warnings для {identifier} увеличены на 1.")
-
-            else:
-                identifier = user_id if user_id else username
-                print(f"Пользователь с {identifier} не найден.")
-
+        identifier = user_id if user_id else username
+        if user_id is None:
+            user_id = await get_user_id_by_username_in_group(username)
+            if user_id is None:
+                logger.info("Пользователь с %s не найден.", identifier)
+                return False
+        
+        async with db.write() as conn:
+            await _add_warning(conn, user_id)
+        logger.debug("Warnings для %s увеличены на 1.", identifier)
+        return True
     except Exception as e:
-        print(f"Ошибка при увеличении warnings: {e}")
+        logger.error("Ошибка при увеличении warnings: %s", e)
+        return False
 
 async def decrement_warnings(username: str = None, user_id: int = None):
     """
-    Уменьшает warnings на 1 для пользователя по username или user_id.
+    Снимает последнее выданное предупреждение пользователя по username или user_id.
     Возвращает True, если обновление прошло успешно, иначе False.
     """
     if not username and not user_id:
-        print("Ошибка: укажите username или user_id.")
+        logger.error("Ошибка: укажите username или user_id.")
         return False
     
     try:
-        async with aiosqlite.connect(DB_NAME) as conn:
-            # Определяем условие поиска
-            if user_id is not None:
-                warnings_count_raw = await load_warnings_count(user_id=user_id)
-                condition = "WHERE user_id = ?"
-                param = (user_id,)
-            else:
-                warnings_count_raw = await load_warnings_count(username=username)
-                condition = "WHERE username = ?"
-                param = (username,)
-            
-            # Преобразуем и проверяем warnings_count
-            try:
-                warnings_count = int(warnings_count_raw)  # Преобразуем в int
-                if warnings_count < 0:
-                    raise ValueError("warnings_count не может быть отрицательным")
-            except (ValueError, TypeError):
-                print(f"Ошибка: warnings_count '{warnings_count_raw}' не является допустимым целым числом.")
-                return False
-            
-            # Обновляем warnings
-            await conn.execute(
-                f"UPDATE users SET warnings = warnings - 1 {condition}",
-                param
-            )
-            await conn.execute(
-                f"UPDATE users SET warning_{warnings_count}_data = 0 {condition}", param
-            )
-            await conn.commit()
-            
-            # Проверяем, сколько строк обновлено
-            cursor = await conn.execute("SELECT changes()")
-            changes = await cursor.fetchone()
-            if changes and changes[0] > 0:
-                identifier = user_id if user_id else username
-                print(f"Warnings для {identifier} уменьшены на 1.")
-                return True
-            else:
-                identifier = user_id if user_id else username
-                print(f"Пользователь с {identifier} не найден.")
+        identifier = user_id if user_id else username
+        if user_id is None:
+            user_id = await get_user_id_by_username_in_group(username)
+            if user_id is None:
+                logger.info("Пользователь с %s не найден.", identifier)
                 return False
+        
+        async with db.write() as conn:
+            removed, _ = await _delete_last_warning(conn, user_id)
+        if removed:
+            logger.debug("Warnings для %s уменьшены на 1.", identifier)
+            return True
+        else:
+            logger.info("У пользователя %s нет предупреждений.", identifier)
+            return False
     
     except Exception as e:
-        print(f"Ошибка при уменьшении warnings: {e}")
+        logger.error("Ошибка при уменьшении warnings: %s", e)
         return False
 
 
 
 async def set_warning_expiry(username: str = None, user_id: int = None, expiry_time: int = None):
     """
-    Устанавливает время окончания предупреждения (timestamp) в соответствующий столбец.
+    Устанавливает время окончания (timestamp) последнего выданного предупреждения пользователя.
     expiry_time: длительность в секундах (например, 3600 для 1 часа). Конвертируется в timestamp (текущее время + длительность).
     Если expiry_time == 0 (бесконечное), ничего не устанавливает.
     """
     if not username and not user_id:
-        print("Ошибка: укажите username или user_id.")
+        logger.error("Ошибка: укажите username или user_id.")
         return False
     if expiry_time is None:
-        print("Ошибка: укажите expiry_time.")
+        logger.error("Ошибка: укажите expiry_time.")
         return False
     
     # Если бесконечное предупреждение, не устанавливаем expiry
     if expiry_time == 0:
-        print("Бесконечное предупреждение: expiry не установлен.")
+        logger.debug("Бесконечное предупреждение: expiry не установлен.")
         return True
     
     # Конвертируем длительность в timestamp
     timestamp = int(time.time()) + expiry_time
     
     try:
-        async with aiosqlite.connect(DB_NAME) as conn:
-            # Определяем условие поиска
-            if user_id is not None:
-                condition = "WHERE user_id = ?"
-                param = (user_id,)
-            else:
-                condition = "WHERE username = ?"
-                param = (username,)
-            
-            # Получаем текущее значение warnings
-            cursor = await conn.execute(f"SELECT warnings FROM users {condition}", param)
-            result = await cursor.fetchone()
-            if not result:
-                identifier = user_id if user_id else username
-                print(f"Пользователь с {identifier} не найден.")
-                return False
-            
-            warnings_count = result[0]
-            
-            # Определяем, какой столбец обновлять
-            if warnings_count == 1:
-                column = "warning_1_data"
-            elif warnings_count == 2:
-                column = "warning_2_data"
-            elif warnings_count == 3:
-                column = "warning_3_data"
-            else:
-                identifier = user_id if user_id else username
-                print(f"Невозможно установить expiry для {identifier}: warnings = {warnings_count} (должен быть 1-3).")
+        identifier = user_id if user_id else username
+        if user_id is None:
+            user_id = await get_user_id_by_username_in_group(username)
+            if user_id is None:
+                logger.info("Пользователь с %s не найден.", identifier)
                 return False
-            
-            # Обновляем соответствующий столбец с timestamp
-            await conn.execute(
-                f"UPDATE users SET {column} = ? {condition}",
-                (timestamp, *param)
-            )
-            await conn.commit()
-            
-            # Проверяем, сколько строк обновлено
-            cursor = await conn.execute("SELECT changes()")
-            changes = await cursor.fetchone()
-            if changes and changes[0] > 0:
-                identifier = user_id if user_id else username
-                print(f"Expiry time для {identifier} установлен в {column}: {timestamp} (timestamp)")
-                return True
-            else:
-                identifier = user_id if user_id else username
-                print(f"Не удалось обновить expiry для {identifier}.")
+        
+        async with db.write() as conn:
+            async with conn.execute("SELECT id FROM warnings WHERE user_id = ? ORDER BY id DESC LIMIT 1", (user_id,)) as cursor:
+                result = await cursor.fetchone()
+            if not result:
+                logger.info("У пользователя %s нет предупреждений.", identifier)
                 return False
+            warning_id = result[0]
+            await conn.execute("UPDATE warnings SET expires_at = ? WHERE id = ?", (timestamp, warning_id))
+        
+        scheduler.schedule(timestamp, "warn", warning_id)
+        logger.debug("Expiry time для %s установлен: %s (timestamp)", identifier, timestamp)
+        return True
     except Exception as e:
-        print(f"Ошибка при установке expiry time: {e}")
+        logger.error("Ошибка при установке expiry time: %s", e)
         return False
 
-def check_forbidden_words(text: str) -> bool:
+# Скомпилированный список запрещённых слов (пересобирается при изменении файла)
+forbidden_words = ForbiddenWords("forbidden_words.txt")
+
+def check_forbidden_words(text: str, normalized: str | None = None) -> bool:
     """
     Проверяет, содержит ли сообщение запрещённые слова из файла forbidden_words.txt.
     Возвращает True, если найдено хотя бы одно слово, иначе False.
+    normalized — результат normalize_text(text), если вызывающий его уже посчитал.
     """
-    # Путь к файлу (предполагается, что он в той же директории)
-    file_path = "forbidden_words.txt"
-    
-    # Если файл не существует, возвращаем False
-    if not os.path.exists(file_path):
+    if not text:
         return False
     
     try:
-        # Читаем файл и создаём список слов (в нижнем регистре, без пустых строк)
-        with open(file_path, "r", encoding="utf-8") as file:
-            forbidden_words = [line.strip().lower() for line in file if line.strip()]
+        matcher = forbidden_words.get()
         
         # Если список пуст, возвращаем False
-        if not forbidden_words:
+        if not matcher:
             return False
         
-        # Преобразуем сообщение в нижний регистр и проверяем наличие слов
-        message_lower = text.lower()
-        for word in forbidden_words:
-            if word in message_lower:
-                return True
-        
-        return False
+        # Нормализуем сообщение так же, как слова списка, и ищем все слова за один проход
+        if normalized is None:
+            normalized = normalize_text(text)
+        return matcher.search(normalized)
     
     except Exception as e:
         # В случае ошибки (например, проблемы с чтением файла) возвращаем False
-        print(f"Ошибка при чтении файла forbidden_words.txt: {e}")
+        logger.error("Ошибка при чтении файла forbidden_words.txt: %s", e)
         return False
     
-# Фоновая задача для проверки и удаления истекших банов (обновлена на асинхронные функции)
-async def check_expired_bans():
-    while True:
-        try:
-            await asyncio.sleep(60)  # Проверяем каждые 60 секунд
-            blacklist = await load_blacklist()
-            current_time = int(time.time())
-            to_remove = []
-            for uname, data in blacklist.items():
-                if data.get("until", 0) > 0 and data["until"] < current_time:
-                    to_remove.append(uname)
-                    user_id = data["id"]
-                    # Отправляем сообщение в чат
-                    try:
-                        await bot.send_message(chat_id=GROUP_ID, text=f"Пользователь @{uname} разбанен (бан истек).")
-                    except Exception as e:
-                        print(f"Ошибка отправки в чат для @{uname}: {e}")
-                    # Отправляем личное сообщение пользователю
-                    try:
-                        await bot.send_message(chat_id=user_id, text="Ваш бан истек, вы разбанены.")
-                    except Exception as e:
-                        print(f"Не удалось отправить личное сообщение пользователю {user_id}: {e}")
-            if to_remove:
-                for uname in to_remove:
-                    del blacklist[uname]
-                await save_blacklist(blacklist)
-                print(f"Удалены истекшие баны: {to_remove}")
-        except Exception as e:
-            print(f"Ошибка в check_expired_bans: {e}")
-            await asyncio.sleep(60)  # Ждем перед следующей попыткой
+# Обработчики истечения сроков для планировщика (scheduler.py)
+async def expire_ban(username: str, deadline: int):
+    data = await get_blacklist_entry(username)
+    # Бан уже снят вручную или продлён — запись в куче устарела
+    if not data or not await remove_from_blacklist(username, until=deadline):
+        return
+    logger.info("Удалён истекший бан: @%s", username)
+    user_id = data["id"]
+    # Отправляем сообщение в чат
+    sender.send_message(chat_id=GROUP_ID, text=f"Пользователь @{username} разбанен (бан истек).")
+    # Отправляем личное сообщение пользователю
+    sender.send_message(chat_id=user_id, text="Ваш бан истек, вы разбанены.")
+
+async def expire_mute(username: str, deadline: int):
+    # Проверка срока и снятие мута — одним запросом: новый мут между ними не будет стёрт
+    async with db.write() as conn:
+        async with conn.execute(
+            "UPDATE users SET muted_until = 0, muted_reason = '' WHERE username = ? AND muted_until = ? RETURNING user_id",
+            (username, deadline)
+        ) as cursor:
+            row = await cursor.fetchone()
+    # Мут уже снят вручную или продлён — запись в куче устарела
+    if not row:
+        return
+    logger.info("Удалён истекший мут: @%s", username)
+    user_id = row[0]
+    # Отправляем сообщение в чат
+    sender.send_message(chat_id=GROUP_ID, text=f"Пользователь @{username} больше не заглушен (мут истек).")
+    # Отправляем личное сообщение пользователю
+    sender.send_message(chat_id=user_id, text="Ваш мут истек, вы больше не заглушены.")
+
+async def expire_warning(warning_id: int, deadline: int):
+    async with db.write() as conn:
+        # Предупреждение уже снято вручную или срок изменён — запись в куче устарела
+        async with conn.execute("DELETE FROM warnings WHERE id = ? AND expires_at = ? RETURNING user_id", (warning_id, deadline)) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            return
+        user_id = row[0]
+        async with conn.execute("SELECT COUNT(*) FROM warnings WHERE user_id = ? AND (expires_at = 0 OR expires_at > ?)", (user_id, int(time.time()))) as cursor:
+            new_warnings = (await cursor.fetchone())[0]
+    username = await get_username_by_user_id(user_id)
+    # Отправляем сообщение в чат
+    sender.send_message(chat_id=GROUP_ID, text=f"У пользователя @{username or user_id} истекло предупреждение. Осталось предупреждений: {new_warnings}.")
+    # Отправляем личное сообщение пользователю
+    sender.send_message(chat_id=user_id, text=f"У вас истекло предупреждение. Осталось предупреждений: {new_warnings}.")
+
+async def load_deadlines() -> list[tuple[int, str, str | int]]:
+    """Собирает все будущие и уже прошедшие сроки из БД для заполнения планировщика при старте."""
+    deadlines = []
+    for username, until in await db.fetchall("SELECT username, until FROM blacklist WHERE until > 0"):
+        deadlines.append((until, "ban", username))
+    for username, muted_until in await db.fetchall("SELECT username, muted_until FROM users WHERE muted_until > 0"):
+        deadlines.append((muted_until, "mute", username))
+    for warning_id, expires_at in await db.fetchall("SELECT id, expires_at FROM warnings WHERE expires_at > 0"):
+        deadlines.append((expires_at, "warn", warning_id))
+    return deadlines
+
+# Фоновая задача: один планировщик вместо трёх циклов опроса банов, мутов и предупреждений
+async def run_expiry_scheduler():
+    scheduler.register("ban", expire_ban)
+    scheduler.register("mute", expire_mute)
+    scheduler.register("warn", expire_warning)
+    await scheduler.run(load_deadlines)
 
 async def get_user_id_by_username_in_group(username: str) -> int | None:
+    if _TRUST_IDENTITIES:
+        user_id = identities.get_id(username)
+        if user_id is not None:
+            return user_id
     try:
         if not os.path.exists(DB_NAME):
             return None
-        async with aiosqlite.connect(DB_NAME) as conn:
-            cursor = await conn.execute("SELECT user_id FROM users WHERE username = ?", (username,))
-            result = await cursor.fetchone()
+        result = await db.fetchone("SELECT user_id FROM users WHERE username = ?", (username,))
         if result:
             user_id = result[0]
-            print(f"ID найден в SQL: @{username} -> {user_id}")
+            identities.put(username, user_id)
+            logger.debug("ID найден в SQL: @%s -> %s", username, user_id)
             return user_id
-        print(f"ID не найден в SQL для @{username}")
+        logger.debug("ID не найден в SQL для @%s", username)
+        return None
+    except Exception as e:
+        logger.error("Ошибка получения ID по username: %s", e)
+        return None
+
+async def get_username_by_user_id(user_id: int) -> str | None:
+    if _TRUST_IDENTITIES:
+        username = identities.get_username(user_id)
+        if username is not None:
+            return username
+    try:
+        result = await db.fetchone("SELECT username FROM users WHERE user_id = ? ORDER BY id DESC LIMIT 1", (user_id,))
+        if result:
+            username = result[0]
+            identities.put(username, user_id)
+            return username
         return None
     except Exception as e:
-        print(f"Ошибка получения ID по username: {e}")
+        logger.error("Ошибка получения username по ID: %s", e)
         return None
 
+# Определение цели действия модератора по ID (число) или @username
+async def resolve_target(identifier: str) -> tuple[int | None, str | None, str | None]:
+    """
+    Возвращает (user_id, username, ошибка). username может быть None, если действие по ID
+    и пользователь не найден в базе данных; ошибка — текст для модератора или None.
+    """
+    if identifier.isdigit():  # Если это ID (число)
+        user_id = int(identifier)
+        # Попробуем найти username по ID (если есть в базе данных)
+        return user_id, await get_username_by_user_id(user_id), None
+    if identifier.startswith('@'):  # Если @username
+        username = identifier[1:]  # Убираем '@'
+        user_id = await get_user_id_by_username_in_group(username)  # Из базы данных
+        if not user_id:
+            return None, username, f"Пользователь @{username} не найден в базе данных. Возможно, он не писал сообщения или не добавлен. Попробуйте ввести его ID (число)."
+        return user_id, username, None
+    return None, None, "Неверный формат. Введите ID (число) или @username."
+
+# Действия модераторов устроены одинаково: цель определяется заранее, все изменения в БД
+# делаются одной транзакцией, и только после commit идут вызовы Telegram API и сообщения.
+
 # Обновленная функция для бана по ID или username с временем и причиной
 async def ban_user_by_id_or_username(identifier: str, moderator: str | None, until_date: int = 0, reason: str = "") -> str:
     """
@@ -563,70 +1020,62 @@ async def ban_user_by_id_or_username(identifier: str, moderator: str | None, unt
     Возвращает сообщение об успехе или ошибке.
     """
     try:
-        # Проверяем тип чата
-        chat = await bot.get_chat(GROUP_ID)
+        # Проверяем тип чата (из кэша, без запроса к Telegram)
+        chat = await chat_cache.get(GROUP_ID)
         if chat.type not in ["supergroup", "channel"]:
             return f"Ошибка: Бан доступен только в супергруппах и каналах. Тип чата: {chat.type}."
 
-        username_for_blacklist = None
-        if identifier.isdigit():  # Если это ID (число)
-            user_id = int(identifier)
-            print(f"Баним по ID: {user_id}")
-            # Для черного списка попробуем найти username по ID (если есть в базе данных)
-            users = await load_users()
-            for uname, data in users.items():
-                if data.get("id") == user_id:
-                    username_for_blacklist = uname
-                    break
-        elif identifier.startswith('@'):  # Если @username
-            username = identifier[1:]  # Убираем '@'
-            print(f"Получаем ID по username: {username}")
-            user_id = await get_user_id_by_username_in_group(username)  # Из базы данных
-            username_for_blacklist = username
-            if not user_id:
-                return f"Пользователь @{username} не найден в базе данных. Возможно, он не писал сообщения или не добавлен. Попробуйте ввести его ID (число)."
-        else:
-            return "Неверный формат. Введите ID (число) или @username."
+        user_id, username, error = await resolve_target(identifier)
+        if error:
+            return error
+        logger.info("Баним %s (ID: %s)", identifier, user_id)
 
         # Вычисляем until_date
         ban_until = int(time.time()) + until_date if until_date > 0 else 0
-
-        # Баним пользователя
-        await bot.ban_chat_member(chat_id=GROUP_ID, user_id=user_id, until_date=ban_until if ban_until > 0 else None)
-
-        # Добавляем в черный список
-        if username_for_blacklist:
-            blacklist = await load_blacklist()
-            blacklist[username_for_blacklist] = {
-                "id": user_id,
-                "until": ban_until,
-                "reason": reason if reason else "Не указана"
-            }
-            await save_blacklist(blacklist)
-            print(f"Пользователь @{username_for_blacklist} добавлен в черный список.")
-
         moder_username = f"@{moderator}"
 
-        # Добавляем кейс в badcases и отправляем в логи
-        answer = await add_badcase(username_for_blacklist, user_id, moder_username, "бан", until_date, reason)
+        # Черный список и кейс — одной транзакцией
+        async with db.write() as conn:
+            if username:
+                previous = await _get_blacklist_row(conn, username)
+                await _blacklist_upsert(conn, username, user_id, ban_until, reason)
+            case_id = await _insert_badcase(conn, username, user_id, moder_username, "бан")
+        if username:
+            blacklist_pages.invalidate()
 
+        # Баним пользователя
+        try:
+            await bot.ban_chat_member(chat_id=GROUP_ID, user_id=user_id, until_date=ban_until if ban_until > 0 else None)
+        except Exception:
+            async def undo(conn):
+                if username:
+                    await _restore_blacklist_row(conn, username, previous)
+                await _revert_badcase(conn, case_id)
+            await _compensate("бан", undo)
+            blacklist_pages.invalidate()
+            raise
+        if username:
+            scheduler.schedule(ban_until, "ban", username)
+            logger.info("Пользователь @%s добавлен в черный список.", username)
+
+        answer = format_case_message(case_id, username, user_id, moder_username, "бан", until_date, reason)
         ban_type = "временно" if until_date > 0 else "постоянно"
         time_text = f" на {format_time(until_date)}" if until_date > 0 else ""
         reason_text = f" по причине: {reason}." if reason else ""
         moderator_text = f"\nМодератор: {moder_username}"
 
+        # Отправляем сообщение в группу логов
+        sender.send_message(chat_id=LOGGING_GROUP_ID, text=answer)
+
         # Отправляем сообщение в чат
-        await bot.send_message(chat_id=GROUP_ID, text=f"{answer}", reply_markup=apil_message_button)
+        sender.send_message(chat_id=GROUP_ID, text=answer, reply_markup=apil_message_button)
 
         # Отправляем личное сообщение пользователю
-        try:
-            await bot.send_message(chat_id=user_id, text=f"Вы забанены {ban_type}{time_text}{reason_text}{moderator_text}.")
-        except Exception as e:
-            print(f"Не удалось отправить личное сообщение пользователю {user_id}: {e}")
+        sender.send_message(chat_id=user_id, text=f"Вы забанены {ban_type}{time_text}{reason_text}{moderator_text}.")
 
         return f"Пользователь {identifier} забанен {ban_type}{time_text} и добавлен в черный список." + (f"\nПричина: {reason}" if reason else "")
     except Exception as e:
-        print(f"Ошибка при бане: {e}")
+        logger.error("Ошибка при бане: %s", e)
         return f"Ошибка: {str(e)}. Проверьте права бота или ID группы."
 
 async def unban_user_by_id_or_username(identifier: str, moderator: str | None) -> str:
@@ -635,103 +1084,55 @@ async def unban_user_by_id_or_username(identifier: str, moderator: str | None) -
     Возвращает сообщение об успехе или ошибке.
     """
     try:
-        # Проверяем тип чата
-        chat = await bot.get_chat(GROUP_ID)
+        # Проверяем тип чата (из кэша, без запроса к Telegram)
+        chat = await chat_cache.get(GROUP_ID)
         if chat.type not in ["supergroup", "channel"]:
             return f"Ошибка: Разбан доступен только в супергруппах и каналах. Тип чата: {chat.type}."
 
-        username_for_blacklist = None
-        if identifier.isdigit():  # Если это ID (число)
-            user_id = int(identifier)
-            print(f"Разбаниваем по ID: {user_id}")
-            # Для черного списка попробуем найти username по ID
-            users = await load_users()
-            for uname, data in users.items():
-                if data.get("id") == user_id:
-                    username_for_blacklist = uname
-                    break
-        elif identifier.startswith('@'):  # Если @username
-            username = identifier[1:]  # Убираем '@'
-            print(f"Получаем ID по username: {username}")
-            user_id = await get_user_id_by_username_in_group(username)  # Из базы данных
-            username_for_blacklist = username
-            if not user_id:
-                return f"Пользователь @{username} не найден в базе данных. Возможно, он не писал сообщения или не добавлен. Попробуйте ввести его ID (число)."
-        else:
-            return "Неверный формат. Введите ID (число) или @username."
+        user_id, username, error = await resolve_target(identifier)
+        if error:
+            return error
+        logger.info("Разбаниваем %s (ID: %s)", identifier, user_id)
+
+        # Удаляем из черного списка и удаляем последний кейс бана — одной транзакцией
+        async with db.write() as conn:
+            previous = await _get_blacklist_row(conn, username) if username else None
+            removed = previous is not None and await _blacklist_delete(conn, username)
+            case = await _pop_last_case(conn, user_id, "бан")
+        if removed:
+            blacklist_pages.invalidate()
+            logger.info("Пользователь @%s удален из черного списка.", username)
+        logger.info("Удалён последний кейс бана для пользователя %s (ID: %s)", identifier, user_id)
 
         # Разбаниваем пользователя
-        await bot.unban_chat_member(chat_id=GROUP_ID, user_id=user_id)
-        
-        # Удаляем из черного списка
-        if username_for_blacklist:
-            blacklist = await load_blacklist()
-            if username_for_blacklist in blacklist:
-                del blacklist[username_for_blacklist]
-                await save_blacklist(blacklist)
-                print(f"Пользователь @{username_for_blacklist} удален из черного списка.")
-        
-        # Удаляем последний кейс бана для этого пользователя
-        async with aiosqlite.connect(DB_NAME) as conn:
-            await conn.execute(
-                "DELETE FROM badcases WHERE id = (SELECT id FROM badcases WHERE user_id = ? AND type = 'бан' ORDER BY case_id DESC LIMIT 1)",
-                (user_id,)
-            )
-            await conn.commit()
-            print(f"Удалён последний кейс бана для пользователя {identifier} (ID: {user_id})")
-        
+        try:
+            await bot.unban_chat_member(chat_id=GROUP_ID, user_id=user_id)
+        except Exception:
+            async def undo(conn):
+                if previous:
+                    await _restore_blacklist_row(conn, username, previous)
+                await _restore_case(conn, case)
+            await _compensate("разбан", undo)
+            blacklist_pages.invalidate()
+            raise
+
         answer = f"🔓 Снятие бана\nПользователь: {identifier}\nМодератор: {f"@{moderator}" or "Неизвестен"}"
         
         # Отправляем сообщение в группу логов
-        await bot.send_message(chat_id=LOGGING_GROUP_ID, text=answer)
+        sender.send_message(chat_id=LOGGING_GROUP_ID, text=answer)
 
         # Отправляем сообщение в чат
-        await bot.send_message(chat_id=GROUP_ID, text=answer)
+        sender.send_message(chat_id=GROUP_ID, text=answer)
 
         # Отправляем личное сообщение пользователю
-        try:
-            await bot.send_message(chat_id=user_id, text="Вы разбанены.")
-        except Exception as e:
-            print(f"Не удалось отправить личное сообщение пользователю {user_id}: {e}")
+        sender.send_message(chat_id=user_id, text="Вы разбанены.")
 
         return f"Пользователь {identifier} разбанен и удален из черного списка."
     except Exception as e:
-        print(f"Ошибка при разбане: {e}")
+        logger.error("Ошибка при разбане: %s", e)
         return f"Ошибка: {str(e)}. Проверьте права бота или ID группы."
     
 
-async def check_expired_mutes():
-    while True:
-        try:
-            await asyncio.sleep(60)  # Проверяем каждые 60 секунд
-            users = await load_users()
-            current_time = int(time.time())
-            to_unmute = []
-            for uname, data in users.items():
-                if data.get("muted_until", 0) > 0 and data["muted_until"] < current_time:
-                    to_unmute.append(uname)
-                    user_id = data["id"]
-                    # Отправляем сообщение в чат
-                    try:
-                        await bot.send_message(chat_id=GROUP_ID, text=f"Пользователь @{uname} больше не заглушен (мут истек).")
-                    except Exception as e:
-                        print(f"Ошибка отправки в чат для @{uname}: {e}")
-                    # Отправляем личное сообщение пользователю
-                    try:
-                        await bot.send_message(chat_id=user_id, text="Ваш мут истек, вы больше не заглушены.")
-                    except Exception as e:
-                        print(f"Не удалось отправить личное сообщение пользователю {user_id}: {e}")
-            if to_unmute:
-                for uname in to_unmute:
-                    users[uname]["muted_until"] = 0
-                    users[uname]["muted_reason"] = ""
-                await save_users(users)
-                print(f"Удалены истекшие муты: {to_unmute}")
-        except Exception as e:
-            print(f"Ошибка в check_expired_mutes: {e}")
-            await asyncio.sleep(60)  # Ждем перед следующей попыткой
-    
-
 # Функция для мута по ID или username с временем и причиной
 async def mute_user_by_id_or_username(identifier: str, moderator: str | None, until_date: int = 0, reason: str = "") -> str:
     """
@@ -739,69 +1140,60 @@ async def mute_user_by_id_or_username(identifier: str, moderator: str | None, un
     Возвращает сообщение об успехе или ошибке.
     """
     try:
-        # Проверяем тип чата
-        chat = await bot.get_chat(GROUP_ID)
+        # Проверяем тип чата (из кэша, без запроса к Telegram)
+        chat = await chat_cache.get(GROUP_ID)
         if chat.type not in ["supergroup", "channel"]:
             return f"Ошибка: Мут доступен только в супергруппах и каналах. Тип чата: {chat.type}."
 
-        username_for_muted = None
-        if identifier.isdigit():  # Если это ID (число)
-            user_id = int(identifier)
-            print(f"Мутим по ID: {user_id}")
-            # Для списка мутов попробуем найти username по ID (если есть в базе данных)
-            users = await load_users()
-            for uname, data in users.items():
-                if isinstance(data, dict) and data.get("id") == user_id:
-                    username_for_muted = uname
-                    break
-        elif identifier.startswith('@'):  # Если @username
-            username = identifier[1:]  # Убираем '@'
-            print(f"Получаем ID по username: {username}")
-            user_id = await get_user_id_by_username_in_group(username)  # Из базы данных
-            username_for_muted = username
-            if not user_id:
-                return f"Пользователь @{username} не найден в базе данных. Возможно, он не писал сообщения или не добавлен. Попробуйте ввести его ID (число)."
-        else:
-            return "Неверный формат. Введите ID (число) или @username."
+        user_id, username, error = await resolve_target(identifier)
+        if error:
+            return error
+        logger.info("Мутим %s (ID: %s)", identifier, user_id)
 
         # Вычисляем until_date
         mute_until = int(time.time()) + until_date if until_date > 0 else 0
+        moder_username = f"@{moderator}"
+
+        # Данные о муте и кейс — одной транзакцией
+        async with db.write() as conn:
+            if username:
+                previous = await _get_mute(conn, username)
+                await _set_mute(conn, username, user_id, mute_until, reason if reason else "Не указана")
+            case_id = await _insert_badcase(conn, username, user_id, moder_username, "заглушен")
 
         permissions = ChatPermissions(can_send_messages=False, can_send_media_messages=False, can_send_other_messages=False)
 
         # Мутим пользователя
-        await bot.restrict_chat_member(chat_id=GROUP_ID, user_id=user_id, permissions=permissions, until_date=mute_until if mute_until > 0 else None)
-
-        # Обновляем базу данных (добавляем/обновляем данные о муте)
-        users = await load_users()
-        if username_for_muted not in users:
-            users[username_for_muted] = {"id": user_id}
-        users[username_for_muted]["muted_until"] = mute_until
-        users[username_for_muted]["muted_reason"] = reason if reason else "Не указана"
-        await save_users(users)
-
-        moder_username = f"@{moderator}"
-
-        # Добавляем кейс в badcases и отправляем в логи
-        answer = await add_badcase(username_for_muted, user_id, moder_username, "заглушен", until_date, reason)
-
+        try:
+            await bot.restrict_chat_member(chat_id=GROUP_ID, user_id=user_id, permissions=permissions, until_date=mute_until if mute_until > 0 else None)
+        except Exception:
+            async def undo(conn):
+                if username:
+                    await _set_mute(conn, username, user_id, *previous)
+                await _revert_badcase(conn, case_id)
+            await _compensate("мут", undo)
+            raise
+        if username:
+            scheduler.schedule(mute_until, "mute", username)
+
+        answer = format_case_message(case_id, username, user_id, moder_username, "заглушен", until_date, reason)
         mute_type = "временно" if until_date > 0 else "постоянно"
         time_text = f" на {format_time(until_date)}" if until_date > 0 else ""
         reason_text = f" по причине: {reason}" if reason else ""
         moderator_text = f"\nМодератор: {moder_username}"
 
+        # Отправляем сообщение в группу логов
+        sender.send_message(chat_id=LOGGING_GROUP_ID, text=answer)
+
         # Отправляем сообщение в чат
-        await bot.send_message(chat_id=GROUP_ID, text=f"{answer}", reply_markup=apil_message_button)
+        sender.send_message(chat_id=GROUP_ID, text=answer, reply_markup=apil_message_button)
 
         # Отправляем личное сообщение пользователю
-        try:
-            await bot.send_message(chat_id=user_id, text=f"Вы заглушены {mute_type}{time_text}{reason_text}{moderator_text}.")
-        except Exception as e:
-            print(f"Не удалось отправить личное сообщение пользователю {user_id}: {e}")
+        sender.send_message(chat_id=user_id, text=f"Вы заглушены {mute_type}{time_text}{reason_text}{moderator_text}.")
 
         return f"Пользователь {identifier} заглушён {mute_type}{time_text}" + (f"\nПричина: {reason}" if reason else "")
     except Exception as e:
-        print(f"Ошибка при муте: {e}")
+        logger.error("Ошибка при муте: %s", e)
         return f"Ошибка: {str(e)}. Проверьте права бота или ID группы."
 
 
@@ -812,203 +1204,129 @@ async def unmute_user_by_id_or_username(identifier: str, moderator: str | None)
     Возвращает сообщение об успехе или ошибке.
     """
     try:
-        # Проверяем тип чата
-        chat = await bot.get_chat(GROUP_ID)
+        # Проверяем тип чата (из кэша, без запроса к Telegram)
+        chat = await chat_cache.get(GROUP_ID)
         if chat.type not in ["supergroup", "channel"]:
             return f"Ошибка: Размут доступен только в супергруппах и каналах. Тип чата: {chat.type}."
 
-        username_for_muted = None
-        if identifier.isdigit():  # Если это ID (число)
-            user_id = int(identifier)
-            print(f"Размутиваем по ID: {user_id}")
-            # Для списка мутов попробуем найти username по ID (если есть в базе данных)
-            users = await load_users()
-            for uname, data in users.items():
-                if isinstance(data, dict) and data.get("id") == user_id:
-                    username_for_muted = uname
-                    break
-        elif identifier.startswith('@'):  # Если @username
-            username = identifier[1:]  # Убираем '@'
-            print(f"Получаем ID по username: {username}")
-            user_id = await get_user_id_by_username_in_group(username)  # Из базы данных
-            username_for_muted = username
-            if not user_id:
-                return f"Пользователь @{username} не найден в базе данных. Возможно, он не писал сообщения или не добавлен. Попробуйте ввести его ID (число)."
-        else:
-            return "Неверный формат. Введите ID (число) или @username."
+        user_id, username, error = await resolve_target(identifier)
+        if error:
+            return error
+        logger.info("Размутиваем %s (ID: %s)", identifier, user_id)
+
+        # Очищаем данные о муте и удаляем последний кейс мута — одной транзакцией
+        async with db.write() as conn:
+            if username:
+                previous = await _get_mute(conn, username)
+                await _set_mute(conn, username, user_id, 0, "")
+            case = await _pop_last_case(conn, user_id, "заглушен")
+        logger.info("Удалён последний кейс мута для пользователя %s (ID: %s)", identifier, user_id)
 
         permissions = ChatPermissions(can_send_messages=True, can_send_media_messages=True, can_send_other_messages=True, can_add_web_page_previews=True, can_change_info=True, can_invite_users=True, can_pin_messages=True)
 
         # Размутиваем пользователя
-        await bot.restrict_chat_member(chat_id=GROUP_ID, user_id=user_id, permissions=permissions)
-
-        # Обновляем базу данных (очищаем данные о муте)
-        users = await load_users()
-        if username_for_muted in users:
-            users[username_for_muted]["muted_until"] = 0
-            users[username_for_muted]["muted_reason"] = ""
-            await save_users(users)
-        
-        # Удаляем последний кейс мута для этого пользователя
-        async with aiosqlite.connect(DB_NAME) as conn:
-            await conn.execute(
-                "DELETE FROM badcases WHERE id = (SELECT id FROM badcases WHERE user_id = ? AND type = 'заглушен' ORDER BY case_id DESC LIMIT 1)",
-                (user_id,)
-            )
-            await conn.commit()
-            print(f"Удалён последний кейс мута для пользователя {identifier} (ID: {user_id})")
-        
+        try:
+            await bot.restrict_chat_member(chat_id=GROUP_ID, user_id=user_id, permissions=permissions)
+        except Exception:
+            async def undo(conn):
+                if username:
+                    await _set_mute(conn, username, user_id, *previous)
+                await _restore_case(conn, case)
+            await _compensate("размут", undo)
+            raise
+
         answer = f"🔊 Снятие мута\nПользователь: {identifier}\nМодератор: {f"@{moderator}" or "Неизвестен"}"
         
         # Отправляем сообщение в группу логов
-        await bot.send_message(chat_id=LOGGING_GROUP_ID, text=answer)
+        sender.send_message(chat_id=LOGGING_GROUP_ID, text=answer)
 
         # Отправляем сообщение в чат
-        await bot.send_message(chat_id=GROUP_ID, text=answer)
+        sender.send_message(chat_id=GROUP_ID, text=answer)
 
         # Отправляем личное сообщение пользователю
-        try:
-            await bot.send_message(chat_id=user_id, text="Вы больше не заглушены.")
-        except Exception as e:
-            print(f"Не удалось отправить личное сообщение пользователю {user_id}: {e}")
+        sender.send_message(chat_id=user_id, text="Вы больше не заглушены.")
 
         return f"Пользователь {identifier} размучен."
     except Exception as e:
-        print(f"Ошибка при размуте: {e}")
+        logger.error("Ошибка при размуте: %s", e)
         return f"Ошибка: {str(e)}. Проверьте права бота или ID группы."
     
-async def check_expired_warnings():
-    while True:
-        try:
-            await asyncio.sleep(60)  # Проверяем каждые 60 секунд
-            async with aiosqlite.connect(DB_NAME) as conn:
-                cursor = await conn.execute("SELECT id, username, user_id, warnings, warning_1_data, warning_2_data, warning_3_data FROM users")
-                rows = await cursor.fetchall()
-                current_time = int(time.time())
-                for row in rows:
-                    db_id, username, user_id, warnings, w1, w2, w3 = row
-                    expired_columns = []
-                    if w1 > 0 and w1 < current_time:
-                        expired_columns.append("warning_1_data")
-                    if w2 > 0 and w2 < current_time:
-                        expired_columns.append("warning_2_data")
-                    if w3 > 0 and w3 < current_time:
-                        expired_columns.append("warning_3_data")
-                    
-                    if expired_columns:
-                        # Уменьшаем warnings на количество истекших
-                        decrement_count = len(expired_columns)
-                        new_warnings = max(0, warnings - decrement_count)
-                        
-                        await conn.execute(
-                            "UPDATE users SET warnings = ?, warning_1_data = CASE WHEN warning_1_data < ? THEN 0 ELSE warning_1_data END, warning_2_data = CASE WHEN warning_2_data < ? THEN 0 ELSE warning_2_data END, warning_3_data = CASE WHEN warning_3_data < ? THEN 0 ELSE warning_3_data END WHERE id = ?",
-                            (new_warnings, current_time, current_time, current_time, db_id)
-                        )
-                        # Отправляем сообщение в чат
-                        try:
-                            await bot.send_message(chat_id=GROUP_ID, text=f"У пользователя @{username} истекло {decrement_count} предупреждение(й). Осталось предупреждений: {new_warnings}.")
-                        except Exception as e:
-                            print(f"Ошибка отправки в чат для @{username}: {e}")
-                        # Отправляем личное сообщение пользователю
-                        try:
-                            await bot.send_message(chat_id=user_id, text=f"У вас истекло {decrement_count} предупреждение(й). Осталось предупреждений: {new_warnings}.")
-                        except Exception as e:
-                            print(f"Не удалось отправить личное сообщение пользователю {user_id}: {e}")
-                await conn.commit()
-        except Exception as e:
-            print(f"Ошибка в check_expired_warnings: {e}")
-            await asyncio.sleep(60)  # Ждем перед следующей попыткой
-    
-
 async def warn_user_by_id_or_username(identifier: str, moderator: str | None, until_date: int = 0, reason: str = "") -> str:
     """
     Выдать предупреждение пользователю по ID (число) или @username с указанным временем и причиной.
+    При достижении WARN_LIMIT активных предупреждений пользователь банится навсегда.
     Возвращает сообщение об успехе или ошибке.
     """
     try:
-        # Проверяем тип чата
-        chat = await bot.get_chat(GROUP_ID)
+        # Проверяем тип чата (из кэша, без запроса к Telegram)
+        chat = await chat_cache.get(GROUP_ID)
         if chat.type not in ["supergroup", "channel"]:
             return f"Ошибка: Бан доступен только в супергруппах и каналах. Тип чата: {chat.type}."
 
-        username_for_blacklist = None
-        if identifier.isdigit():  # Если это ID (число)
-            user_id = int(identifier)
-            print(f"Выдаём придупреждение по ID: {user_id}")
-            # Выдаём предупреждение пользователю
-            await increment_warnings(user_id=user_id)
-            warning_count = await load_warnings_count(user_id=user_id)
-            # Для черного списка попробуем найти username по ID (если есть в базе данных)
-            users = await load_users()
-            for uname, data in users.items():
-                if data.get("id") == user_id:
-                    username_for_blacklist = uname
-                    break
-        elif identifier.startswith('@'):  # Если @usernameЫЫЫ
-            username = identifier[1:]  # Убираем '@'
-            print(f"Получаем ID по username: {username}")
-            user_id = await get_user_id_by_username_in_group(username)  # Из базы данных
-            username_for_blacklist = username
-            # Выдаём предупреждение пользователю
-            await increment_warnings(username=username)
-            warning_count = await load_warnings_count(username=username)
-            if not user_id:
-                return f"Пользователь @{username} не найден в базе данных. Возможно, он не писал сообщения или не добавлен. Попробуйте ввести его ID (число)."
-        else:
-            return "Неверный формат. Введите ID (число) или @username."
-        
-        if warning_count >= 3:
-            await bot.ban_chat_member(chat_id=GROUP_ID, user_id=user_id, until_date=0)
-
-            # Добавляем в черный список
-            if username_for_blacklist:
-                blacklist = await load_blacklist()
-                blacklist[username_for_blacklist] = {
-                    "id": user_id,
-                    "until": 0,
-                    "reason": reason if reason else "Не указана"
-                }
-                await save_blacklist(blacklist)
-                print(f"Пользователь @{username_for_blacklist} добавлен в черный список.")
-        
+        user_id, username, error = await resolve_target(identifier)
+        if error:
+            return error
+        logger.info("Выдаём предупреждение %s (ID: %s)", identifier, user_id)
+
+        expires_at = int(time.time()) + until_date if until_date > 0 else 0
+        moder_username = f"@{moderator}"
+
+        # Предупреждение, подсчёт и бан/кейс — одной транзакцией
+        async with db.write() as conn:
+            warning_id = await _add_warning(conn, user_id, expires_at)
+            warning_count = await _count_warnings(conn, user_id)
+            if warning_count >= WARN_LIMIT:
+                if username:
+                    previous = await _get_blacklist_row(conn, username)
+                    await _blacklist_upsert(conn, username, user_id, 0, reason)
+            else:
+                case_id = await _insert_badcase(conn, username, user_id, moder_username, "предупреждение")
+        if warning_count >= WARN_LIMIT and username:
+            blacklist_pages.invalidate()
+        logger.info("Warnings для %s: %s", identifier, warning_count)
+
+        if warning_count >= WARN_LIMIT:
+            try:
+                await bot.ban_chat_member(chat_id=GROUP_ID, user_id=user_id, until_date=0)
+            except Exception:
+                async def undo(conn):
+                    await conn.execute("DELETE FROM warnings WHERE id = ?", (warning_id,))
+                    if username:
+                        await _restore_blacklist_row(conn, username, previous)
+                await _compensate("бан за предупреждения", undo)
+                blacklist_pages.invalidate()
+                raise
+            if username:
+                logger.info("Пользователь @%s добавлен в черный список.", username)
 
             # Отправляем сообщение в чат
-            await bot.send_message(chat_id=GROUP_ID, text=f"Пользователь {identifier} забанен постоенно по причине: Правила были нарушены 3 раза.")
+            sender.send_message(chat_id=GROUP_ID, text=f"Пользователь {identifier} забанен постоенно по причине: Правила были нарушены {WARN_LIMIT} раза.")
 
             # Отправляем личное сообщение пользователю
-            try:
-                await bot.send_message(chat_id=user_id, text=f"Вы забанены постоенно по причине: Правила были нарушены 3 раза.")
-            except Exception as e:
-                print(f"Не удалось отправить личное сообщение пользователю {user_id}: {e}")
+            sender.send_message(chat_id=user_id, text=f"Вы забанены постоенно по причине: Правила были нарушены {WARN_LIMIT} раза.")
 
-            return f"Пользователь {identifier} забанен постоенно и добавлен в черный список." + (f"\nПричина: Правила были нарушены 3 раза.")
+            return f"Пользователь {identifier} забанен постоенно и добавлен в черный список." + (f"\nПричина: Правила были нарушены {WARN_LIMIT} раза.")
 
-        else:
-            # Устанавливаем expiry для предупреждения
-            await set_warning_expiry(username=username_for_blacklist, user_id=user_id, expiry_time=until_date)
-            
-            # Добавляем кейс в badcases и отправляем в логи
-            moder_username = f"@{moderator}"
-            answer = await add_badcase(username_for_blacklist, user_id, moder_username, "предупреждение", until_date, reason)
-
-            warn_type = "временное" if until_date > 0 else "постоянное"
-            time_text = f" на {format_time(until_date)}" if until_date > 0 else ""
-            reason_text = f" по причине: {reason}" if reason else ""
-            moderator_text = f"\nМодератор: {moder_username}"
-            
+        scheduler.schedule(expires_at, "warn", warning_id)
 
-            # Отправляем сообщение в чат
-            await bot.send_message(chat_id=GROUP_ID, text=answer, reply_markup=apil_message_button)
+        answer = format_case_message(case_id, username, user_id, moder_username, "предупреждение", until_date, reason)
+        warn_type = "временное" if until_date > 0 else "постоянное"
+        time_text = f" на {format_time(until_date)}" if until_date > 0 else ""
+        reason_text = f" по причине: {reason}" if reason else ""
+        moderator_text = f"\nМодератор: {moder_username}"
 
-            # Отправляем личное сообщение пользователю
-            try:
-                await bot.send_message(chat_id=user_id, text=f"Вам выдано {warn_type} предупреждение{time_text}{reason_text}.\nПредупреждений осталось: {3-warning_count}{moderator_text}.")
-            except Exception as e:
-                print(f"Не удалось отправить личное сообщение пользователю {user_id}: {e}")
+        # Отправляем сообщение в группу логов
+        sender.send_message(chat_id=LOGGING_GROUP_ID, text=answer)
 
-            return f"Пользователю {identifier} выдано {warn_type} предупреждение {time_text}" + (f"\nПричина: {reason}" if reason else "") + f" Предупреждений осталось: {3-warning_count}."
+        # Отправляем сообщение в чат
+        sender.send_message(chat_id=GROUP_ID, text=answer, reply_markup=apil_message_button)
+
+        # Отправляем личное сообщение пользователю
+        sender.send_message(chat_id=user_id, text=f"Вам выдано {warn_type} предупреждение{time_text}{reason_text}.\nПредупреждений осталось: {WARN_LIMIT-warning_count}{moderator_text}.")
+
+        return f"Пользователю {identifier} выдано {warn_type} предупреждение {time_text}" + (f"\nПричина: {reason}" if reason else "") + f" Предупреждений осталось: {WARN_LIMIT-warning_count}."
     except Exception as e:
-        print(f"Ошибка при выдаче предупреждения: {e}, warning_count = {warning_count}, {identifier}")
+        logger.error("Ошибка при выдаче предупреждения для %s: %s", identifier, e)
         return f"Ошибка: {str(e)}. Проверьте права бота или ID группы."
     
 # Новая функция для разбана по ID или username
@@ -1018,61 +1336,262 @@ async def unwarn_user_by_id_or_username(identifier: str, moderator: str | None)
     Возвращает сообщение об успехе или ошибке.
     """
     try:
-        # Проверяем тип чата
-        chat = await bot.get_chat(GROUP_ID)
+        # Проверяем тип чата (из кэша, без запроса к Telegram)
+        chat = await chat_cache.get(GROUP_ID)
         if chat.type not in ["supergroup", "channel"]:
             return f"Ошибка: Разбан доступен только в супергруппах и каналах. Тип чата: {chat.type}."
 
-        username_for_blacklist = None
-        if identifier.isdigit():  # Если это ID (число)
-            user_id = int(identifier)
-            print(f"Разбаниваем по ID: {user_id}")
-            await decrement_warnings(user_id=user_id)
-            warning_count = await load_warnings_count(user_id=user_id)
-            # Для черного списка попробуем найти username по ID ПОКА ОСТАВЛЮ
-            users = await load_users()
-            for uname, data in users.items():
-                if data.get("id") == user_id:
-                    username_for_blacklist = uname
-                    break
-        elif identifier.startswith('@'):  # Если @username
-            username = identifier[1:]  # Убираем '@'
-            print(f"Получаем ID по username: {username}")
-            user_id = await get_user_id_by_username_in_group(username)  # Из базы данных
-            username_for_blacklist = username
-            await decrement_warnings(username=username)
-            warning_count = await load_warnings_count(username=username)
-            if not user_id:
-                return f"Пользователь @{username} не найден в базе данных. Возможно, он не писал сообщения или не добавлен. Попробуйте ввести его ID (число)."
-        else:
-            return "Неверный формат. Введите ID (число) или @username."
-        
-        # Удаляем последний кейс предупреждения для этого пользователя
-        async with aiosqlite.connect(DB_NAME) as conn:
-            await conn.execute(
-                "DELETE FROM badcases WHERE id = (SELECT id FROM badcases WHERE user_id = ? AND type = 'предупреждение' ORDER BY case_id DESC LIMIT 1)",
-                (user_id,)
-            )
-            await conn.commit()
-            print(f"Удалён последний кейс предупреждения для пользователя {identifier} (ID: {user_id})")
+        user_id, username, error = await resolve_target(identifier)
+        if error:
+            return error
+        logger.info("Снимаем предупреждение %s (ID: %s)", identifier, user_id)
+
+        # Снимаем последнее предупреждение и удаляем именно его кейс — одной транзакцией
+        async with db.write() as conn:
+            removed, case_id = await _delete_last_warning(conn, user_id)
+            if case_id:
+                await _delete_case(conn, case_id)
+        if not removed:
+            logger.info("У пользователя %s нет предупреждений.", identifier)
+        elif case_id:
+            logger.info("Удалён кейс %s предупреждения для пользователя %s (ID: %s)", case_id, identifier, user_id)
         
         answer = f"✅ Снятие предупреждения\nПользователь: {identifier}\nМодератор: {f"@{moderator}" or "Неизвестен"}"
         
         # Отправляем сообщение в группу логов
-        await bot.send_message(chat_id=LOGGING_GROUP_ID, text=answer)
+        sender.send_message(chat_id=LOGGING_GROUP_ID, text=answer)
 
         # Отправляем сообщение в чат
-        await bot.send_message(chat_id=GROUP_ID, text=answer)
+        sender.send_message(chat_id=GROUP_ID, text=answer)
 
         # Отправляем личное сообщение пользователю
-        try:
-            await bot.send_message(chat_id=user_id, text="Вам сняли одно предупреждение.")
-        except Exception as e:
-            print(f"Не удалось отправить личное сообщение пользователю {user_id}: {e}")
+        sender.send_message(chat_id=user_id, text="Вам сняли одно предупреждение.")
 
         return f"Пользователю {identifier} сняли предупрждение."
     except Exception as e:
-        print(f"Ошибка при разбане: {e}")
+        logger.error("Ошибка при разбане: %s", e)
+        return f"Ошибка: {str(e)}. Проверьте права бота или ID группы."
+
+# Массовые действия модераторов (рейд из сотен аккаунтов): цели определяются несколькими
+# запросами IN (...), все изменения в БД — одной транзакцией, вызовы Telegram API идут
+# параллельно, но не больше BULK_CONCURRENCY одновременно. Вместо трёх сообщений на каждого
+# пользователя — одна сводка в группу и список кейсов в группу логов.
+
+# действие: (тип кейса или None, эмодзи и заголовок сводки, причастие для ответа модератору)
+BULK_ACTIONS = {
+    "ban": ("бан", "🔨 Массовый бан", "забанены"),
+    "mute": ("заглушен", "🔇 Массовый мут", "заглушены"),
+    "unban": (None, "🔓 Массовое снятие бана", "разбанены"),
+    "unmute": (None, "🔊 Массовое снятие мута", "размучены"),
+}
+# Параметров в одном запросе IN (...): старые сборки SQLite не принимают больше 999
+_SQL_BATCH = 500
+_IDENTIFIER = re.compile(r"@\w+|\d+")
+
+def parse_identifiers(text: str) -> tuple[list[str], list[str]]:
+    """
+    Делит текст (аргументы команды или содержимое файла) на ID (число) и @username.
+    Разделители — пробелы, переводы строк, запятые и точки с запятой; повторы убираются.
+    Возвращает (идентификаторы, нераспознанные слова).
+    """
+    identifiers, invalid = [], []
+    seen = set()
+    for token in re.split(r"[\s,;]+", text):
+        if not token:
+            continue
+        if not _IDENTIFIER.fullmatch(token):
+            invalid.append(token)
+        elif token not in seen:
+            seen.add(token)
+            identifiers.append(token)
+    return identifiers, invalid
+
+async def resolve_targets(identifiers: list[str]) -> tuple[list[tuple[int, str | None]], list[str]]:
+    """
+    Определяет цели массового действия. Возвращает ([(user_id, username), ...], ненайденные @username).
+    Сначала смотрит кэш identities (при WORKERS == 1), остальных ищет одним запросом на пачку из _SQL_BATCH.
+    """
+    ids = {int(identifier) for identifier in identifiers if identifier.isdigit()}
+    usernames = {identifier[1:] for identifier in identifiers if identifier.startswith("@")}
+    name_by_id = {user_id: identities.get_username(user_id) if _TRUST_IDENTITIES else None for user_id in ids}
+    id_by_name = {username: identities.get_id(username) if _TRUST_IDENTITIES else None for username in usernames}
+
+    missing_names = [username for username, user_id in id_by_name.items() if user_id is None]
+    for start in range(0, len(missing_names), _SQL_BATCH):
+        batch = missing_names[start:start + _SQL_BATCH]
+        rows = await db.fetchall(f"SELECT username, user_id FROM users WHERE username IN ({','.join('?' * len(batch))})", tuple(batch))
+        for username, user_id in rows:
+            id_by_name[username] = user_id
+            identities.put(username, user_id)
+    missing_ids = [user_id for user_id, username in name_by_id.items() if username is None]
+    for start in range(0, len(missing_ids), _SQL_BATCH):
+        batch = missing_ids[start:start + _SQL_BATCH]
+        # Как в get_username_by_user_id: при нескольких строках берётся последняя
+        rows = await db.fetchall(f"SELECT user_id, username FROM users WHERE user_id IN ({','.join('?' * len(batch))}) ORDER BY id", tuple(batch))
+        for user_id, username in rows:
+            name_by_id[user_id] = username
+        for user_id in {row[0] for row in rows}:
+            identities.put(name_by_id[user_id], user_id)
+
+    targets, not_found = [], []
+    seen = set()
+    for identifier in identifiers:
+        if identifier.isdigit():
+            user_id = int(identifier)
+            username = name_by_id.get(user_id)
+        else:
+            username = identifier[1:]
+            user_id = id_by_name.get(username)
+            if user_id is None:
+                not_found.append(identifier)
+                continue
+        if user_id not in seen:
+            seen.add(user_id)
+            targets.append((user_id, username))
+    return targets, not_found
+
+# Вставка кейсов для всех целей сразу: номера дня выделяются одним запросом
+async def _insert_badcases(conn, targets: list[tuple[int, str | None]], moderator: str | None, case_type: str) -> list[str]:
+    current_date = time.strftime("%Y%m%d")
+    count = len(targets)
+    async with conn.execute(
+        "INSERT INTO case_sequence (day, last_num) VALUES (?, ?) ON CONFLICT(day) DO UPDATE SET last_num = last_num + ? RETURNING last_num",
+        (current_date, count, count)
+    ) as cursor:
+        last_num = (await cursor.fetchone())[0]
+    case_ids = [f"TKS-{current_date}-{num:04d}" for num in range(last_num - count + 1, last_num + 1)]
+    await conn.executemany(
+        "INSERT INTO badcases (case_id, username, user_id, type, moderator) VALUES (?, ?, ?, ?, ?)",
+        [(case_id, username or "", user_id, case_type, moderator) for case_id, (user_id, username) in zip(case_ids, targets)]
+    )
+    logger.info("Добавлено кейсов: %s (%s)", count, case_type)
+    return case_ids
+
+async def call_with_retries(call, attempts: int = SEND_MAX_ATTEMPTS):
+    """Вызов Bot API (call — функция без аргументов, возвращающая корутину) с ожиданием при flood limit и повтором при ошибках сети, как в sender.py."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return await call()
+        except TelegramRetryAfter as e:
+            if attempt == attempts:
+                raise
+            logger.warning("Flood limit: ждём %s сек", e.retry_after)
+            await asyncio.sleep(e.retry_after)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if attempt == attempts:
+                raise
+            logger.warning("Ошибка сети при вызове Bot API: %s", e)
+            await asyncio.sleep(2 ** (attempt - 1))
+
+def _split_text(lines: list[str], limit: int = 4000) -> list[str]:
+    """Склеивает строки в сообщения не длиннее limit символов (лимит Telegram — 4096)."""
+    chunks, current = [], ""
+    for line in lines:
+        if current and len(current) + len(line) + 1 > limit:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
+
+async def bulk_moderate(action: str, identifiers: list[str], moderator: str | None, until_date: int = 0, reason: str = "", progress=None) -> str:
+    """
+    Массовый ban, mute, unban или unmute по списку ID и @username.
+    progress — необязательная корутина progress(готово, всего), вызывается после каждого вызова API.
+    Возвращает итог для модератора.
+    """
+    case_type, title, done_text = BULK_ACTIONS[action]
+    try:
+        # Проверяем тип чата (из кэша, без запроса к Telegram)
+        chat = await chat_cache.get(GROUP_ID)
+        if chat.type not in ["supergroup", "channel"]:
+            return f"Ошибка: массовые действия доступны только в супергруппах и каналах. Тип чата: {chat.type}."
+
+        targets, not_found = await resolve_targets(identifiers)
+        not_found_text = f"\nНе найдены в базе данных ({len(not_found)}): {' '.join(not_found[:50])}" if not_found else ""
+        if not targets:
+            return "Ни один пользователь не найден." + not_found_text
+        logger.info("Массовое действие %s: %s пользователей", action, len(targets))
+
+        until = int(time.time()) + until_date if until_date > 0 else 0
+        moder_username = f"@{moderator}"
+
+        if action == "ban":
+            call = lambda user_id: bot.ban_chat_member(chat_id=GROUP_ID, user_id=user_id, until_date=until or None)
+        elif action == "mute":
+            permissions = ChatPermissions(can_send_messages=False, can_send_media_messages=False, can_send_other_messages=False)
+            call = lambda user_id: bot.restrict_chat_member(chat_id=GROUP_ID, user_id=user_id, permissions=permissions, until_date=until or None)
+        elif action == "unban":
+            call = lambda user_id: bot.unban_chat_member(chat_id=GROUP_ID, user_id=user_id)
+        else:
+            permissions = ChatPermissions(can_send_messages=True, can_send_media_messages=True, can_send_other_messages=True, can_add_web_page_previews=True, can_change_info=True, can_invite_users=True, can_pin_messages=True)
+            call = lambda user_id: bot.restrict_chat_member(chat_id=GROUP_ID, user_id=user_id, permissions=permissions)
+
+        # Сначала вызовы Telegram API — параллельно, не больше BULK_CONCURRENCY одновременно.
+        # База меняется только для тех, к кому действие действительно применилось
+        semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+        failed = []
+        done = 0
+
+        async def apply(user_id: int, username: str | None) -> bool:
+            nonlocal done
+            async with semaphore:
+                try:
+                    await call_with_retries(lambda: call(user_id))
+                    ok = True
+                except Exception as e:
+                    failed.append(f"{f'@{username}' if username else user_id}: {e}")
+                    ok = False
+            done += 1
+            if progress:
+                await progress(done, len(targets))
+            return ok
+
+        results = await asyncio.gather(*(apply(user_id, username) for user_id, username in targets))
+        applied = [target for target, ok in zip(targets, results) if ok]
+        named = [(user_id, username) for user_id, username in applied if username]
+
+        # Черный список или муты и кейсы успешных целей — одной транзакцией
+        case_ids = []
+        if applied:
+            async with db.write() as conn:
+                if action == "ban":
+                    await conn.executemany(_BLACKLIST_UPSERT_SQL, [(username, user_id, until, reason or "Не указана") for user_id, username in named])
+                elif action == "mute":
+                    await conn.executemany(_SET_MUTE_SQL, [(username, user_id, until, reason or "Не указана") for user_id, username in named])
+                elif action == "unban":
+                    await conn.executemany("DELETE FROM blacklist WHERE username = ?", [(username,) for _, username in named])
+                    await conn.executemany(_DELETE_LAST_CASE_SQL, [(user_id, "бан") for user_id, _ in applied])
+                else:
+                    await conn.executemany(_SET_MUTE_SQL, [(username, user_id, 0, "") for user_id, username in named])
+                    await conn.executemany(_DELETE_LAST_CASE_SQL, [(user_id, "заглушен") for user_id, _ in applied])
+                if case_type:
+                    case_ids = await _insert_badcases(conn, applied, moder_username, case_type)
+        if action in ("ban", "unban") and named:
+            blacklist_pages.invalidate()
+        if action in ("ban", "mute"):
+            for user_id, username in named:
+                scheduler.schedule(until, action, username)
+
+        # Сводка в группу и список кейсов в группу логов — только о применённых действиях
+        if applied:
+            duration_text = format_time(until_date) if until_date > 0 else "Постоянно"
+            header = f"{title}: {len(applied)} пользователей"
+            if case_type:
+                header += f"\nДлительность: {duration_text}\nПричина: {reason or 'Не указана'}"
+            header += f"\nМодератор: {moder_username}"
+            sender.send_message(chat_id=GROUP_ID, text=header)
+            lines = [f"{case_id} — {f'@{username}' if username else user_id}" for case_id, (user_id, username) in zip(case_ids, applied)]
+            if not case_type:
+                lines = [f"@{username}" if username else str(user_id) for user_id, username in applied]
+            for chunk in _split_text([header, *lines]):
+                sender.send_message(chat_id=LOGGING_GROUP_ID, text=chunk)
+
+        failed_text = f"\nОшибки Telegram ({len(failed)}):\n" + "\n".join(failed[:20]) if failed else ""
+        return f"{done_text.capitalize()}: {len(applied)} из {len(targets)}." + not_found_text + failed_text
+    except Exception as e:
+        logger.error("Ошибка массового действия %s: %s", action, e)
         return f"Ошибка: {str(e)}. Проверьте права бота или ID группы."
 
 # Остальные функции без изменений
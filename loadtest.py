@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+import config
+
+
+# Нагрузочный тест: бот из bot.py работает против fake_telegram.py, а генератор подаёт
+# синтетический трафик группы (обычные сообщения, сообщения с запрещёнными словами)
+# и команды модератора в личке с заданной частотой.
+#
+#   python loadtest.py --rate 200 --duration 30 --latency 20 --error-rate 0.01
+#
+# --mode polling: обновления идут через getUpdates заглушки (как в работе бота);
+# --mode direct: обновления подаются прямо в dp.feed_raw_update, без сети.
+# Отчёт: задержка обработчиков (handler) и от постановки обновления до конца обработки (e2e),
+# p50/p99 и пропускная способность. База данных — отдельный файл (--db), рабочая не трогается.
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота против заглушки Bot API")
+    parser.add_argument("--mode", choices=["polling", "direct"], default="polling")
+    parser.add_argument("--rate", type=float, default=100, help="обновлений в секунду")
+    parser.add_argument("--duration", type=float, default=10, help="длительность подачи нагрузки, сек")
+    parser.add_argument("--users", type=int, default=1000, help="количество разных участников группы")
+    parser.add_argument("--admin-share", type=float, default=0.02, help="доля команд модератора")
+    parser.add_argument("--bad-share", type=float, default=0.01, help="доля сообщений с запрещёнными словами")
+    parser.add_argument("--latency", type=float, default=0, help="задержка ответа заглушки, мс")
+    parser.add_argument("--jitter", type=float, default=0, help="разброс задержки заглушки, мс")
+    parser.add_argument("--error-rate", type=float, default=0, help="доля ответов 429 от заглушки")
+    parser.add_argument("--port", type=int, default=8081, help="порт заглушки")
+    parser.add_argument("--db", default="loadtest.sqlite", help="файл базы данных для теста (пересоздаётся)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="сохранить отчёт в JSON-файл")
+    return parser.parse_args()
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summary(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(values, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(max(values, default=0) * 1000, 3),
+    }
+
+
+class TrafficGenerator:
+    """Синтетические обновления: сообщения участников группы и команды модератора."""
+
+    COMMANDS = ["/warn @{} 1h флуд", "/unwarn @{}", "/mute @{} 10m спам", "/unmute @{}", "/ban @{} 1h реклама", "/unban @{}"]
+
+    def __init__(self, users: int, admin_share: float, bad_share: float, bad_word: str, rng: random.Random):
+        self.users = users
+        self.admin_share = admin_share
+        self.bad_share = bad_share
+        self.bad_word = bad_word
+        self.rng = rng
+        self.active: list[int] = []  # участники, уже писавшие в группу (известны боту)
+        self.known: set[int] = set()
+        self.message_id = 0
+
+    def _message(self, chat: dict, user_id: int, username: str, text: str) -> dict:
+        self.message_id += 1
+        return {"message": {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": chat,
+            "from": {"id": user_id, "is_bot": False, "first_name": username, "username": username},
+            "text": text,
+        }}
+
+    def next(self) -> tuple[str, dict]:
+        """Возвращает (вид, обновление без update_id)."""
+        roll = self.rng.random()
+        if roll < self.admin_share and self.active:
+            admin_id = config.ADMIN_ID[0]
+            target = f"u{self.rng.choice(self.active)}"
+            text = self.rng.choice(self.COMMANDS).format(target)
+            chat = {"id": admin_id, "type": "private"}
+            return "admin", self._message(chat, admin_id, "moderator", text)
+        index = self.rng.randrange(self.users)
+        if index not in self.known:
+            self.known.add(index)
+            self.active.append(index)
+        chat = {"id": config.GROUP_ID, "type": "supergroup", "title": "Load test"}
+        if roll < self.admin_share + self.bad_share:
+            return "bad", self._message(chat, 10_000 + index, f"u{index}", f"привет {self.bad_word} всем")
+        return "group", self._message(chat, 10_000 + index, f"u{index}", f"обычное сообщение номер {self.message_id}")
+
+
+async def run(args) -> dict:
+    # Тест не должен трогать рабочую базу и настоящий Telegram
+    for path in (args.db, args.db + "-wal", args.db + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    config.DB_NAME = args.db
+    config.TELEGRAM_API_URL = f"http://127.0.0.1:{args.port}"
+    config.TOKEN = "1000000:loadtest-fake-token"
+    config.WORKERS = 1
+
+    from fake_telegram import FakeTelegram
+    from logs import setup_logging
+    import bot as app
+
+    # Журнал как в работе бота (config.LOG_LEVEL), чтобы его стоимость входила в замер
+    setup_logging()
+
+    fake = FakeTelegram(args.latency / 1000, args.jitter / 1000, args.error_rate)
+    await fake.start("127.0.0.1", args.port)
+
+    with open("forbidden_words.txt", encoding="utf-8") as file:
+        bad_word = next((line.strip().lower() for line in file if line.strip()), "запрещено")
+    generator = TrafficGenerator(args.users, args.admin_share, args.bad_share, bad_word, random.Random(args.seed))
+
+    sent_at: dict[int, tuple[float, str]] = {}
+    handler_times: dict[str, list[float]] = {"group": [], "bad": [], "admin": []}
+    e2e_times: list[float] = []
+    finished = asyncio.Event()
+    state = {"generated": 0, "done": 0, "errors": 0, "last_done": 0.0}
+
+    async def measure(handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            state["errors"] += 1
+            raise
+        finally:
+            now = time.perf_counter()
+            queued, kind = sent_at.pop(event.update_id, (None, "group"))
+            handler_times[kind].append(now - started)
+            if queued is not None:
+                e2e_times.append(now - queued)
+            state["done"] += 1
+            state["last_done"] = now
+            if not sent_at and state["generated"] == -1:
+                finished.set()
+
+    app.dp.update.outer_middleware(measure)
+
+    feed_tasks: set[asyncio.Task] = set()
+    if args.mode == "polling":
+        polling = asyncio.create_task(app.dp.start_polling(app.bot, handle_signals=False, close_bot_session=False))
+    else:
+        await app.dp.emit_startup(bot=app.bot)
+    # Даём боту выполнить on_startup (миграции, кэши) до начала отсчёта
+    while not app.background_tasks:
+        await asyncio.sleep(0.05)
+
+    total = int(args.rate * args.duration)
+    started = time.perf_counter()
+    for number in range(total):
+        delay = started + number / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind, payload = generator.next()
+        if args.mode == "polling":
+            update_id = fake.add_update(payload)
+            sent_at[update_id] = (time.perf_counter(), kind)
+        else:
+            update_id = number + 1
+            sent_at[update_id] = (time.perf_counter(), kind)
+            task = asyncio.create_task(app.dp.feed_raw_update(app.bot, {"update_id": update_id, **payload}))
+            feed_tasks.add(task)
+            task.add_done_callback(feed_tasks.discard)
+        state["generated"] += 1
+    generated = state["generated"]
+    generation_time = time.perf_counter() - started
+    state["generated"] = -1
+    if sent_at:
+        try:
+            await asyncio.wait_for(finished.wait(), 60)
+        except asyncio.TimeoutError:
+            print(f"Не дождались обработки {len(sent_at)} обновлений")
+
+    if args.mode == "polling":
+        await app.dp.stop_polling()
+        await polling
+    else:
+        await asyncio.gather(*feed_tasks, return_exceptions=True)
+        await app.dp.emit_shutdown(bot=app.bot)
+    sender_stats = app.sender.stats()
+    await app.bot.session.close()
+    await fake.stop()
+
+    elapsed = (state["last_done"] or time.perf_counter()) - started
+    all_handlers = [value for values in handler_times.values() for value in values]
+    return {
+        "mode": args.mode,
+        "target_rate": args.rate,
+        "generated": generated,
+        "generation_seconds": round(generation_time, 3),
+        "processed": state["done"],
+        "handler_errors": state["errors"],
+        "throughput_per_sec": round(state["done"] / elapsed, 1) if elapsed > 0 else 0,
+        "handler": summary(all_handlers),
+        "handler_by_kind": {kind: summary(values) for kind, values in handler_times.items()},
+        "end_to_end": summary(e2e_times),
+        "fake_api": fake.stats(),
+        "sender": sender_stats,
+    }
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
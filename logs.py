@@ -0,0 +1,113 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+
+from config import LOG_LEVEL, LOG_JSON, LOG_DEBUG_SAMPLE_RATE
+
+
+# Журнал бота: записи из обработчиков только кладутся в очередь (QueueHandler),
+# а форматирование и запись в stdout идут в отдельном потоке (QueueListener),
+# поэтому медленный stdout не останавливает цикл событий.
+
+# Стандартные атрибуты LogRecord; всё остальное (extra=...) попадает в JSON отдельными полями
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, логгер, сообщение, pid и поля из extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """
+    Пропускает только долю rate записей уровня DEBUG (их пишут на каждое сообщение группы
+    и каждый поиск пользователя); записи INFO и выше проходят всегда.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    В вызывающем потоке только подставляет аргументы в сообщение и превращает исключение
+    в текст (объекты трассировки не передаются в другой поток); остальное — в потоке записи.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Копию записи не делаем: обработчик у корневого логгера единственный
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        record.stack_info = None
+        return record
+
+
+_traceback_formatter = logging.Formatter()
+_listener: logging.handlers.QueueListener | None = None
+
+
+def setup_logging(level: str = LOG_LEVEL, json_output: bool = LOG_JSON, debug_sample_rate: float = LOG_DEBUG_SAMPLE_RATE):
+    """Настраивает корневой логгер процесса. Повторный вызов заменяет прежнюю настройку."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(sys.stdout)
+    if json_output:
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    records = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    handler.addFilter(DebugSampler(debug_sample_rate))
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    # aiogram пишет INFO о каждом обработанном обновлении — это тот же горячий путь
+    if root.getEffectiveLevel() > logging.DEBUG:
+        logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    # aiosqlite пишет DEBUG о каждом запросе; время запросов есть в метриках
+    logging.getLogger("aiosqlite").setLevel(max(root.getEffectiveLevel(), logging.INFO))
+
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи (вызывается и автоматически при выходе)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,185 @@
+import logging
+import math
+import re
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import lru_cache
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+# Метрики в формате Prometheus (text exposition 0.0.4) без сторонних библиотек.
+# Гистограммы заполняются middleware обработчиков, обёрткой соединений БД (database.py)
+# и middleware сессии Bot API; отдаются по HTTP на /metrics (METRICS_HOST:METRICS_PORT).
+
+# Корзины в секундах: от быстрых запросов SQLite до медленных вызовов Telegram
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: list = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Гистограмма: количество наблюдений по корзинам и их сумма для каждого набора меток."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам (не накопительные)..., счётчик +Inf, сумма]
+        self._series: dict[tuple, list] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def timer(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                total += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                bucket_labels = _labels(self.labelnames, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {total}")
+        return lines
+
+
+class Gauge:
+    """Мгновенное значение, которое считывается функцией в момент запроса /metrics."""
+
+    def __init__(self, name: str, documentation: str, read):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        REGISTRY.append(self)
+
+    def render(self) -> list[str]:
+        try:
+            value = self.read()
+        except Exception as e:
+            logger.error("Ошибка чтения метрики %s: %s", self.name, e)
+            return []
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+UPDATE_SECONDS = Histogram("bot_update_seconds", "Полное время обработки обновления (фильтры, FSM, обработчик)", ("event",))
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время обработчиков bot.py", ("handler", "event", "outcome"))
+DB_QUERY_SECONDS = Histogram("bot_db_query_seconds", "Время запросов к SQLite по виду запроса и таблице", ("statement",))
+DB_WRITE_WAIT_SECONDS = Histogram("bot_db_write_wait_seconds", "Ожидание единственного соединения-писателя")
+API_CALL_SECONDS = Histogram("bot_telegram_api_seconds", "Время вызовов Telegram Bot API", ("method", "outcome"))
+
+
+# Метка запроса: первое слово и таблица, например "SELECT users" или "INSERT badcases"
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+(?:NOT\s+)?EXISTS)?)\s+(\w+)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def statement_label(sql: str) -> str:
+    verb = sql.split(None, 1)[0].upper() if sql.strip() else "?"
+    match = _TABLE.search(sql)
+    return f"{verb} {match.group(1)}" if match else verb
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """Внешний middleware dp.update: время всего обновления, включая фильтры и загрузку состояния FSM."""
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            UPDATE_SECONDS.observe(time.perf_counter() - started, event.event_type)
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Внутренний middleware события: время конкретного обработчика (по имени функции)."""
+
+    def __init__(self, event_name: str):
+        self.event_name = event_name
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await handler(event, data)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            handler_object = data.get("handler")
+            name = handler_object.callback.__name__ if handler_object else "unknown"
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name, self.event_name, outcome)
+
+
+class ApiTimingMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время каждого вызова Bot API и его исход (ok или класс ошибки)."""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            API_CALL_SECONDS.observe(time.perf_counter() - started, method.__api_method__, outcome)
+
+
+def setup_metrics(dp: Dispatcher):
+    """Подключает замеры ко всем событиям диспетчера."""
+    dp.update.outer_middleware(UpdateTimingMiddleware())
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(HandlerTimingMiddleware(name))
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
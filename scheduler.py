@@ -0,0 +1,113 @@
+import asyncio
+import heapq
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryScheduler:
+    """
+    Планировщик истечения банов, мутов и предупреждений.
+    Хранит мин-кучу сроков (timestamp, вид, ключ) и спит ровно до ближайшего из них.
+    Записи не удаляются из кучи при ручном снятии наказания: обработчик сам сверяет
+    срок с базой данных и игнорирует устаревшие записи.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[int, str, str]] = []
+        self._handlers = {}
+        self._wakeup: asyncio.Event | None = None
+        self._publisher = None
+        self._publishing: set[asyncio.Task] = set()
+
+    def register(self, kind: str, handler):
+        """handler(key, deadline) — корутина, вызываемая при наступлении срока."""
+        self._handlers[kind] = handler
+
+    def set_publisher(self, publisher):
+        """
+        publisher(deadline, kind, key) — корутина, передающая срок лидеру (WORKERS > 1).
+        Вызывается из schedule() в процессе, где цикл не запущен.
+        """
+        self._publisher = publisher
+
+    def schedule(self, deadline: int, kind: str, key: str):
+        """
+        Добавляет срок. Если он раньше ближайшего, будит цикл, чтобы тот пересчитал сон.
+        В процессе, где цикл не запущен (не лидер), передаёт срок через publisher,
+        а без него ничего не делает: срок уже в БД и попадёт в кучу при следующем запуске цикла.
+        """
+        if deadline <= 0:
+            return
+        if self._wakeup is None:
+            if self._publisher is not None:
+                task = asyncio.get_running_loop().create_task(self._publisher(deadline, kind, key))
+                self._publishing.add(task)
+                task.add_done_callback(self._publishing.discard)
+            return
+        self.push([(deadline, kind, key)])
+
+    def push(self, entries):
+        """Добавляет сроки (deadline, kind, key) к куче, не перечитывая остальные."""
+        earliest = self._heap[0][0] if self._heap else None
+        for entry in entries:
+            heapq.heappush(self._heap, entry)
+        if self._wakeup is not None and self._heap and (earliest is None or self._heap[0][0] < earliest):
+            self._wakeup.set()
+
+    def reload(self, entries):
+        """
+        Добавляет к куче сроки (deadline, kind, key), загруженные из БД. Куча не заменяется:
+        сроки, поставленные через schedule() во время загрузки, остаются. Повторы безвредны —
+        обработчик сверяет срок с базой данных.
+        """
+        self._heap.extend(entries)
+        heapq.heapify(self._heap)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    @property
+    def running(self) -> bool:
+        return self._wakeup is not None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    async def run(self, loader):
+        """
+        loader() возвращает список (deadline, kind, key) из БД — им куча заполняется при старте.
+        Затем цикл бесконечно ждёт ближайший срок и вызывает обработчики.
+        """
+        # Куча от прошлого запуска не нужна: loader вернёт все сроки заново
+        self._heap = []
+        self._wakeup = asyncio.Event()
+        try:
+            await self._loop(loader)
+        finally:
+            self._wakeup = None
+
+    async def _loop(self, loader):
+        self.reload(await loader())
+        logger.info("Планировщик истечений запущен, сроков в очереди: %s", len(self._heap))
+        while True:
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            deadline, kind, key = heapq.heappop(self._heap)
+            handler = self._handlers.get(kind)
+            if handler is None:
+                logger.warning("Нет обработчика для срока вида %s", kind)
+                continue
+            try:
+                await handler(key, deadline)
+            except Exception as e:
+                logger.error("Ошибка обработки истечения %s для %s: %s", kind, key, e)
+
+
+scheduler = ExpiryScheduler()
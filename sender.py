@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+
+from config import SEND_GLOBAL_RATE, SEND_PRIVATE_RATE, SEND_GROUP_RATE, SEND_MAX_ATTEMPTS, WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity накопленных."""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """
+        Запрещает отправку на seconds секунд (после RetryAfter от Telegram).
+        Паузы не складываются: несколько RetryAfter подряд продлевают паузу до самой поздней.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate, -seconds * self.rate)
+        self.updated = now
+
+
+class MessageSender:
+    """
+    Очередь исходящих сообщений бота.
+    send_message() только ставит сообщение в очередь и сразу возвращает управление.
+    У каждого чата своя очередь и свой обработчик, поэтому порядок сообщений в чате
+    сохраняется, а медленный чат не задерживает остальные. Отправка ограничена общим
+    ведром токенов и ведром на каждый чат (лимиты Telegram: ~30 сообщений/с всего,
+    1/с в личку, 20/мин в группу).
+    """
+
+    def __init__(self, bot: Bot, global_rate: float = 30, private_rate: float = 1, group_rate: float = 20 / 60, max_attempts: int = 5):
+        self.bot = bot
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.max_attempts = max_attempts
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets: dict[int, TokenBucket] = {}
+        self.queues: dict[int, deque] = {}
+        self.workers: dict[int, asyncio.Task] = {}
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательные ID — группы и каналы, положительные — личные чаты
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, 3)
+            else:
+                bucket = TokenBucket(self.private_rate, 1)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def send_message(self, chat_id: int, text: str, **kwargs):
+        """Ставит сообщение в очередь чата chat_id."""
+        queue = self.queues.setdefault(chat_id, deque())
+        queue.append((text, kwargs))
+        if chat_id not in self.workers:
+            self.workers[chat_id] = asyncio.create_task(self._worker(chat_id))
+
+    async def _worker(self, chat_id: int):
+        queue = self.queues[chat_id]
+        bucket = self._bucket(chat_id)
+        try:
+            while queue:
+                text, kwargs = queue[0]
+                await self._deliver(chat_id, bucket, text, kwargs)
+                queue.popleft()
+        finally:
+            del self.workers[chat_id]
+            if not queue:
+                del self.queues[chat_id]
+                # Ведро личного чата полное и не нужно — не держим его в памяти
+                if chat_id > 0:
+                    self.chat_buckets.pop(chat_id, None)
+
+    async def _deliver(self, chat_id: int, bucket: TokenBucket, text: str, kwargs: dict):
+        for attempt in range(1, self.max_attempts + 1):
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                self.sent += 1
+                return
+            except TelegramRetryAfter as e:
+                self.retries += 1
+                logger.warning("Flood limit для чата %s: ждём %s сек", chat_id, e.retry_after)
+                # 429 — ограничение всего бота: останавливаем и остальные чаты этого процесса
+                bucket.pause(e.retry_after)
+                self.global_bucket.pause(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                self.retries += 1
+                delay = 2 ** (attempt - 1)
+                logger.warning("Ошибка сети при отправке в чат %s: %s. Повтор через %s сек", chat_id, e, delay)
+                await asyncio.sleep(delay)
+            except Exception as e:
+                # Например, пользователь не запускал бота — личное сообщение не доставить
+                self.failed += 1
+                logger.error("Не удалось отправить сообщение в чат %s: %s", chat_id, e)
+                return
+        self.failed += 1
+        logger.error("Сообщение в чат %s не отправлено после %s попыток", chat_id, self.max_attempts)
+
+    def stats(self) -> dict:
+        """Глубина очередей и счётчики отправки."""
+        depths = {chat_id: len(queue) for chat_id, queue in self.queues.items()}
+        return {
+            "queued": sum(depths.values()),
+            "chats": len(depths),
+            "max_chat_depth": max(depths.values(), default=0),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+        }
+
+    async def close(self, timeout: float = 10):
+        """Ждёт отправки оставшихся сообщений (не дольше timeout секунд) при остановке бота."""
+        if not self.workers:
+            return
+        logger.info("Досылаем исходящие сообщения: %s", self.stats()['queued'])
+        done, pending = await asyncio.wait(list(self.workers.values()), timeout=timeout)
+        for task in pending:
+            task.cancel()
+
+
+def create_sender(bot: Bot) -> MessageSender:
+    # Каждый из WORKERS процессов отправляет сам, поэтому общий и групповой лимиты делятся между ними
+    workers = max(1, WORKERS)
+    return MessageSender(bot, SEND_GLOBAL_RATE / workers, SEND_PRIVATE_RATE, SEND_GROUP_RATE / workers, SEND_MAX_ATTEMPTS)
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from config import FSM_STATE_TTL, FSM_CACHE_SIZE
+from database import Database, db
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище диалогов в таблице fsm_states базы бота.
+    Незаконченные диалоги переживают перезапуск, а брошенные удаляются через ttl секунд.
+
+    Состояние и данные читаются одним запросом и кэшируются в памяти (LRU на cache_size
+    ключей, включая ключи без состояния — их aiogram запрашивает на каждое сообщение).
+    Запись идёт сквозь кэш. Кэш верен и при нескольких процессах: обновления одного
+    пользователя всегда попадают в один процесс (см. workers.route).
+    """
+
+    def __init__(self, database: Database = db, ttl: int = FSM_STATE_TTL, cache_size: int = FSM_CACHE_SIZE, key_builder: KeyBuilder | None = None):
+        self.db = database
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        # key -> (state, data, updated_at)
+        self._cache: OrderedDict[str, tuple[str | None, dict, int]] = OrderedDict()
+
+    def _remember(self, key: str, state: str | None, data: dict, updated_at: int):
+        self._cache[key] = (state, data, updated_at)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: str) -> tuple[str | None, dict]:
+        entry = self._cache.get(key)
+        if entry is None:
+            row = await self.db.fetchone("SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,))
+            if row:
+                entry = (row[0], json.loads(row[1]) if row[1] else {}, row[2])
+            else:
+                entry = (None, {}, 0)
+            self._remember(key, *entry)
+        else:
+            self._cache.move_to_end(key)
+        state, data, updated_at = entry
+        # Брошенный диалог считается завершённым, даже если сборщик ещё не удалил его
+        if (state is not None or data) and updated_at < time.time() - self.ttl:
+            return None, {}
+        return state, data
+
+    async def _save(self, key: str, state: str | None, data: dict):
+        now = int(time.time())
+        async with self.db.write() as conn:
+            if state is None and not data:
+                # Пустые записи (после state.clear()) не храним
+                await conn.execute("DELETE FROM fsm_states WHERE key = ?", (key,))
+            else:
+                await conn.execute(
+                    "INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at",
+                    (key, state, json.dumps(data, ensure_ascii=False) if data else None, now)
+                )
+        self._remember(key, state, data, now)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        built = self.key_builder.build(key)
+        _, data = await self._load(built)
+        await self._save(built, state, data)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        built = self.key_builder.build(key)
+        state, _ = await self._load(built)
+        await self._save(built, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._load(self.key_builder.build(key))
+        return data.copy()
+
+    async def collect_garbage(self) -> int:
+        """Удаляет диалоги, не менявшиеся дольше ttl. Возвращает количество удалённых."""
+        deadline = int(time.time()) - self.ttl
+        removed = await self.db.execute("DELETE FROM fsm_states WHERE updated_at < ?", (deadline,))
+        for key, (state, data, updated_at) in list(self._cache.items()):
+            if (state is not None or data) and updated_at < deadline:
+                del self._cache[key]
+        return removed
+
+    async def run_gc(self, interval: int):
+        """Фоновая задача: периодическая сборка брошенных диалогов."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = await self.collect_garbage()
+                if removed:
+                    logger.info("Удалено брошенных FSM-диалогов: %s", removed)
+            except Exception as e:
+                logger.error("Ошибка очистки FSM-хранилища: %s", e)
+
+    async def close(self) -> None:
+        # Соединения принадлежат общему db и закрываются в close_db()
+        self._cache.clear()
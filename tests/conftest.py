@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+# functions.py создаёт Bot при импорте: токен должен быть в правильном формате, в Telegram тесты не ходят
+config.TOKEN = "123456:TEST-TOKEN"
+config.METRICS_PORT = 0
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Путь к пустой базе во временном каталоге; init_db/close_db вызывает сам тест внутри своего цикла событий."""
+    import database
+    import functions
+
+    path = str(tmp_path / "bot.sqlite")
+    monkeypatch.setattr(database.db, "path", path)
+    monkeypatch.setattr(functions, "DB_NAME", path)
+    functions.identities.clear()
+    return path
@@ -0,0 +1,37 @@
+import asyncio
+import re
+
+import functions
+from database import db
+
+
+async def _add_concurrently(count: int):
+    await functions.init_db()
+    try:
+        results = await asyncio.gather(
+            *(functions.add_badcase(f"user{i}", 1000 + i, "moder", "бан") for i in range(count)),
+            return_exceptions=True,
+        )
+        case_ids = [row[0] for row in await db.fetchall("SELECT case_id FROM badcases")]
+        sequence = await db.fetchall("SELECT day, last_num FROM case_sequence")
+        return results, case_ids, sequence
+    finally:
+        await functions.close_db()
+
+
+def test_concurrent_add_badcase_has_no_collisions(temp_db, monkeypatch):
+    sent = []
+    monkeypatch.setattr(functions.sender, "send_message", lambda chat_id, text, **kwargs: sent.append(text))
+
+    results, case_ids, sequence = asyncio.run(_add_concurrently(300))
+
+    # add_badcase при ошибке пишет в лог и возвращает None
+    assert all(isinstance(result, str) for result in results), [r for r in results if not isinstance(r, str)][:5]
+    assert len(case_ids) == 300
+    assert len(set(case_ids)) == 300
+    assert all(re.fullmatch(r"TKS-\d{8}-\d{4}", case_id) for case_id in case_ids)
+    # Номера выдаются подряд без пропусков (тест может пересечь полночь — тогда дней два)
+    assert sum(last_num for _, last_num in sequence) == 300
+    if len(sequence) == 1:
+        assert sequence[0][1] == 300
+    assert len(sent) == 300
@@ -0,0 +1,44 @@
+import queue
+
+import bot
+from duplicates import DuplicateDetector
+from workers import WorkerPool
+
+TEXT = "Заработок от 5000 в день без вложений, пишите в личные сообщения"
+
+
+def _message(user_id: int, **fields) -> dict:
+    message = {"message_id": user_id, "date": 0, "chat": {"id": bot.GROUP_ID, "type": "supergroup"},
+               "from": {"id": user_id, "is_bot": False, "first_name": "spam"}, "text": TEXT}
+    message.update(fields)
+    return {"update_id": user_id, "message": message}
+
+
+def _drain(pool: WorkerPool) -> list[list[dict]]:
+    items = []
+    for worker_queue in pool.queues:
+        items.append([])
+        while True:
+            try:
+                items[-1].append(worker_queue.get(timeout=0.2))
+            except queue.Empty:
+                break
+    return items
+
+
+def test_dispatcher_sees_a_wave_split_across_workers(monkeypatch):
+    monkeypatch.setattr(bot, "duplicate_detector", DuplicateDetector(accounts=3, window=60, min_length=10))
+    pool = WorkerPool(target=None, count=3, inspect=bot.find_duplicate_wave)
+    # Пост канала и сообщение бота с тем же текстом в волну не входят
+    pool.put(_message(10, sender_chat={"id": -100, "type": "channel"}))
+    pool.put(_message(11, **{"from": {"id": 11, "is_bot": True, "first_name": "bot"}}))
+    for user_id in (101, 102, 103):
+        pool.put(_message(user_id))
+
+    queues = _drain(pool)
+
+    # Авторы попали в разные рабочие процессы, но задание с волной пришло вслед за третьим сообщением
+    assert {user_id % 3 for user_id in (101, 102, 103)} == {0, 1, 2}
+    jobs = [(index, item) for index, items in enumerate(queues) for item in items if "duplicate_wave" in item]
+    assert jobs == [(103 % 3, {"duplicate_wave": [101, 102, 103]})]
+    assert queues[103 % 3][-2]["update_id"] == 103
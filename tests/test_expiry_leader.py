@@ -0,0 +1,68 @@
+import asyncio
+
+import functions
+import workers
+from database import db
+from scheduler import scheduler
+
+
+async def _queue_round_trip():
+    await functions.init_db()
+    try:
+        queue = workers.DeadlineQueue()
+        await queue.publish(100, "ban", "old")
+        # Новый лидер загружает все сроки из БД сам, старая очередь ему не нужна
+        await queue.skip_to_end()
+        await queue.publish(200, "ban", "spammer")
+        await queue.publish(300, "warn", 7)
+        first = await queue.fetch()
+        second = await queue.fetch()
+        left = (await db.fetchone("SELECT COUNT(*) FROM pending_deadlines"))[0]
+        return first, second, left
+    finally:
+        await functions.close_db()
+
+
+def test_deadline_queue_returns_only_new_entries(temp_db):
+    first, second, left = asyncio.run(_queue_round_trip())
+
+    assert first == [(200, "ban", "spammer"), (300, "warn", 7)]
+    assert second == []
+    assert left == 0
+
+
+async def _lead(runs: int):
+    await functions.init_db()
+    started = []
+    statements = []
+
+    async def run_scheduler():
+        started.append(True)
+        if len(started) == 1:
+            raise RuntimeError("планировщик упал")
+        await functions.run_expiry_scheduler()
+
+    await db._writer.set_trace_callback(statements.append)
+    for conn in db._reader_conns:
+        await conn.set_trace_callback(statements.append)
+    leader = asyncio.create_task(workers.run_expiry_leader(run_scheduler))
+    try:
+        await asyncio.sleep(workers.LEASE_TTL / 3 * runs)
+    finally:
+        leader.cancel()
+        await asyncio.gather(leader, return_exceptions=True)
+        scheduler.set_publisher(None)
+        await functions.close_db()
+    return started, statements
+
+
+def test_leader_restarts_dead_scheduler_without_rereading_deadlines(temp_db, monkeypatch):
+    monkeypatch.setattr(workers, "LEASE_TTL", 0.3)
+
+    started, statements = asyncio.run(_lead(runs=6))
+
+    # Первый запуск упал — на следующем продлении аренды планировщик запущен снова
+    assert len(started) == 2
+    # Сроки из БД загружаются один раз при запуске, продления аренды их не перечитывают
+    assert len([sql for sql in statements if "muted_until > 0" in sql]) == 1
+    assert any("FROM pending_deadlines WHERE id >" in sql for sql in statements)
@@ -0,0 +1,226 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import functions
+from database import db
+
+
+@pytest.fixture
+def offline(temp_db, monkeypatch):
+    """Действия модераторов без Telegram: тип группы известен, сообщения собираются в список."""
+    sent = []
+
+    async def get_chat(chat_id):
+        return SimpleNamespace(id=chat_id, type="supergroup")
+
+    monkeypatch.setattr(functions.chat_cache, "get", get_chat)
+    monkeypatch.setattr(functions.sender, "send_message", lambda chat_id, text, **kwargs: sent.append((chat_id, text)))
+    return sent
+
+
+async def _unwarn_after_limit():
+    await functions.init_db()
+    try:
+        async with db.write() as conn:
+            await conn.execute("INSERT INTO users (username, user_id) VALUES ('spammer', 42)")
+            # Два предупреждения с кейсами, третье привело к бану и кейса не получило
+            for _ in range(2):
+                await functions._add_warning(conn, 42)
+                await functions._insert_badcase(conn, "spammer", 42, "@moder", "предупреждение")
+            await functions._add_warning(conn, 42)
+        cases_before = [row[0] for row in await db.fetchall("SELECT case_id FROM badcases ORDER BY case_id")]
+
+        await functions.unwarn_user_by_id_or_username("42", "moder")
+        after_first = [row[0] for row in await db.fetchall("SELECT case_id FROM badcases ORDER BY case_id")]
+        await functions.unwarn_user_by_id_or_username("42", "moder")
+        after_second = [row[0] for row in await db.fetchall("SELECT case_id FROM badcases ORDER BY case_id")]
+        warnings_left = (await db.fetchone("SELECT COUNT(*) FROM warnings WHERE user_id = 42"))[0]
+        return cases_before, after_first, after_second, warnings_left
+    finally:
+        await functions.close_db()
+
+
+def test_unwarn_deletes_the_case_of_the_removed_warning(offline):
+    cases_before, after_first, after_second, warnings_left = asyncio.run(_unwarn_after_limit())
+
+    assert len(cases_before) == 2
+    # Снято предупреждение без кейса — кейсы остаются
+    assert after_first == cases_before
+    # Снято второе предупреждение — удаляется именно его кейс
+    assert after_second == cases_before[:1]
+    assert warnings_left == 1
+
+
+async def _fail(*args, **kwargs):
+    raise RuntimeError("Bad Request: can't restrict self or chat administrator")
+
+
+async def _ok(*args, **kwargs):
+    return True
+
+
+async def _snapshot():
+    return {
+        "blacklist": await db.fetchall("SELECT username, user_id, until, reason FROM blacklist ORDER BY username"),
+        "cases": await db.fetchall("SELECT case_id, username, user_id, type, moderator FROM badcases ORDER BY case_id"),
+        "sequence": await db.fetchall("SELECT day, last_num FROM case_sequence"),
+        "mutes": await db.fetchall("SELECT username, muted_until, muted_reason FROM users ORDER BY username"),
+        "warnings": await db.fetchall("SELECT id, user_id, case_id FROM warnings ORDER BY id"),
+    }
+
+
+async def _action_with_failing_api(action, *args):
+    await functions.init_db()
+    try:
+        async with db.write() as conn:
+            await conn.execute("INSERT INTO users (username, user_id, muted_until, muted_reason) VALUES ('target', 42, 4000000000, 'старый мут')")
+            await conn.execute("INSERT INTO blacklist (username, user_id, until, reason) VALUES ('target', 42, 4000000000, 'старый бан')")
+            await functions._insert_badcase(conn, "target", 42, "@moder", "бан")
+            await functions._insert_badcase(conn, "target", 42, "@moder", "заглушен")
+            for _ in range(functions.WARN_LIMIT - 1):
+                await functions._add_warning(conn, 42)
+        before = await _snapshot()
+        result = await action("@target", "moder", *args)
+        return before, await _snapshot(), result
+    finally:
+        await functions.close_db()
+
+
+@pytest.mark.parametrize("action, method, args", [
+    (functions.ban_user_by_id_or_username, "ban_chat_member", (3600, "спам")),
+    (functions.unban_user_by_id_or_username, "unban_chat_member", ()),
+    (functions.mute_user_by_id_or_username, "restrict_chat_member", (600, "флуд")),
+    (functions.unmute_user_by_id_or_username, "restrict_chat_member", ()),
+    (functions.warn_user_by_id_or_username, "ban_chat_member", (0, "последнее")),
+])
+def test_failed_api_call_restores_database(offline, monkeypatch, action, method, args):
+    monkeypatch.setattr(functions.bot, method, _fail)
+
+    before, after, result = asyncio.run(_action_with_failing_api(action, *args))
+
+    assert result.startswith("Ошибка")
+    assert after == before
+    assert not [text for _, text in offline if "target" in text]
+
+
+def test_successful_ban_keeps_database_changes(offline, monkeypatch):
+    monkeypatch.setattr(functions.bot, "ban_chat_member", _ok)
+
+    before, after, result = asyncio.run(_action_with_failing_api(functions.ban_user_by_id_or_username, 3600, "спам"))
+
+    assert "забанен" in result
+    assert after["blacklist"][0][3] == "спам"
+    assert len(after["cases"]) == len(before["cases"]) + 1
+
+
+async def _bulk_with_failing_target(action, *args):
+    await functions.init_db()
+    try:
+        async with db.write() as conn:
+            for user_id, username in ((1, "first"), (2, "admin"), (3, "third")):
+                await conn.execute("INSERT INTO users (username, user_id, muted_until, muted_reason) VALUES (?, ?, 4000000000, 'старый мут')", (username, user_id))
+                await conn.execute("INSERT INTO blacklist (username, user_id, until, reason) VALUES (?, ?, 4000000000, 'старый бан')", (username, user_id))
+                await functions._insert_badcase(conn, username, user_id, "@moder", "бан")
+                await functions._insert_badcase(conn, username, user_id, "@moder", "заглушен")
+        before = await _snapshot()
+        result = await functions.bulk_moderate(action, ["@first", "@admin", "@third"], "moder", *args)
+        return before, await _snapshot(), result
+    finally:
+        await functions.close_db()
+
+
+def _rows_of(snapshot, username):
+    return {
+        "blacklist": [row for row in snapshot["blacklist"] if row[0] == username],
+        "cases": [row for row in snapshot["cases"] if row[1] == username],
+        "mutes": [row for row in snapshot["mutes"] if row[0] == username],
+    }
+
+
+@pytest.mark.parametrize("action, method, args", [
+    ("ban", "ban_chat_member", (3600, "спам")),
+    ("mute", "restrict_chat_member", (600, "флуд")),
+    ("unban", "unban_chat_member", ()),
+    ("unmute", "restrict_chat_member", ()),
+])
+def test_bulk_action_changes_database_only_for_applied_targets(offline, monkeypatch, action, method, args):
+    async def call(chat_id, user_id, **kwargs):
+        if user_id == 2:
+            await _fail()
+        return True
+
+    scheduled = []
+    monkeypatch.setattr(functions.bot, method, call)
+    monkeypatch.setattr(functions.scheduler, "schedule", lambda deadline, kind, key: scheduled.append(key))
+
+    before, after, result = asyncio.run(_bulk_with_failing_target(action, *args))
+
+    assert "2 из 3" in result
+    assert _rows_of(after, "admin") == _rows_of(before, "admin")
+    for username in ("first", "third"):
+        assert _rows_of(after, username) != _rows_of(before, username)
+    assert "admin" not in scheduled
+    assert not [text for _, text in offline if "@admin" in text]
+
+
+
+async def _remute_during_expiry():
+    await functions.init_db()
+    try:
+        await db.execute("INSERT INTO users (username, user_id, muted_until, muted_reason) VALUES ('target', 42, 1000, 'старый мут')")
+        remuted = []
+        fetchone = db.fetchone
+
+        async def fetchone_then_remute(*args, **kwargs):
+            # Модератор снова заглушил пользователя сразу после чтения срока
+            row = await fetchone(*args, **kwargs)
+            await db.execute("UPDATE users SET muted_until = 4000000000, muted_reason = 'новый мут' WHERE username = 'target'")
+            remuted.append(True)
+            return row
+
+        db.fetchone = fetchone_then_remute
+        try:
+            await functions.expire_mute("target", 1000)
+        finally:
+            del db.fetchone
+        return bool(remuted), await db.fetchone("SELECT muted_until, muted_reason FROM users WHERE username = 'target'")
+    finally:
+        await functions.close_db()
+
+
+def test_expire_mute_never_wipes_a_newer_mute(offline):
+    remuted, row = asyncio.run(_remute_during_expiry())
+
+    if remuted:
+        assert row == (4000000000, "новый мут")
+        assert not [text for _, text in offline if "мут истек" in text]
+    else:
+        assert row == (0, "")
+
+
+async def _lookups_after_rename_in_other_worker():
+    await functions.init_db()
+    try:
+        # Пользователь 1 сменил @alice на @bob, @alice занял пользователь 2 — это видел другой процесс
+        async with db.write() as conn:
+            await conn.execute("INSERT INTO users (username, user_id) VALUES ('bob', 1), ('alice', 2)")
+        functions.identities.put("alice", 1)
+        return (
+            await functions.get_user_id_by_username_in_group("alice"),
+            await functions.get_username_by_user_id(1),
+            (await functions.resolve_targets(["@alice", "1"]))[0],
+        )
+    finally:
+        await functions.close_db()
+
+
+def test_moderation_lookups_ignore_cache_with_several_workers(temp_db, monkeypatch):
+    monkeypatch.setattr(functions, "_TRUST_IDENTITIES", False)
+
+    user_id, username, targets = asyncio.run(_lookups_after_rename_in_other_worker())
+
+    assert user_id == 2
+    assert username == "bob"
+    assert targets == [(2, "alice"), (1, "bob")]
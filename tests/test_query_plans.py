@@ -0,0 +1,71 @@
+import asyncio
+import re
+import time
+
+import functions
+from database import db
+
+# Горячие запросы не должны обходить таблицу целиком (SCAN): каждый запрос, который отправляют
+# функции ниже, проверяется через EXPLAIN QUERY PLAN на базе, созданной init_db.
+
+_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW)")
+
+
+async def _fill():
+    now = int(time.time())
+    async with db.write() as conn:
+        await conn.executemany("INSERT INTO users (username, user_id, muted_until) VALUES (?, ?, ?)", [(f"user{i}", 1000 + i, now + 3600 if i % 2 else 0) for i in range(10)])
+        await conn.execute("INSERT INTO blacklist (username, user_id, until, reason) VALUES ('user1', 1001, ?, '')", (now + 3600,))
+        await conn.execute("INSERT INTO warnings (user_id, expires_at) VALUES (1002, ?)", (now + 3600,))
+        await functions._insert_badcase(conn, "user3", 1003, "@moder", "бан")
+
+
+async def _hot_queries():
+    """Все запросы, которые отправляют горячие функции (с подставленными параметрами)."""
+    statements = []
+    connections = [db._writer, *db._reader_conns]
+    for conn in connections:
+        await conn.set_trace_callback(statements.append)
+    try:
+        # Поиск кейсов по username и по user_id
+        await functions.sort_users_cases_by_username_or_id(username="user3")
+        await functions.sort_users_cases_by_username_or_id(user_id=1003)
+        await functions.sort_users_cases_by_username_or_id(username="user3", user_id=1003)
+        # Поиск пользователя (кэш пуст, поэтому идёт в БД)
+        await functions.get_user_id_by_username_in_group("user4")
+        await functions.get_username_by_user_id(1005)
+        await functions.get_blacklist_entry("user1")
+        # Загрузка сроков для планировщика
+        await functions.load_deadlines()
+        await functions.load_warnings_count(user_id=1002)
+        # Изменения внутри транзакций действий
+        async with db.write() as conn:
+            await functions._count_warnings(conn, 1002)
+            await functions._delete_last_warning(conn, 1002)
+            await functions._pop_last_case(conn, 1003, "бан")
+            await functions._delete_case(conn, "TKS-00000000-0001")
+            await functions._blacklist_delete(conn, "user1")
+    finally:
+        for conn in connections:
+            await conn.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH"))]
+
+
+async def _plans() -> dict[str, list[str]]:
+    await functions.init_db()
+    try:
+        await _fill()
+        plans = {}
+        for sql in await _hot_queries():
+            rows = await db.fetchall(f"EXPLAIN QUERY PLAN {sql}")
+            plans[sql] = [row[3] for row in rows]
+        return plans
+    finally:
+        await functions.close_db()
+
+
+def test_hot_queries_use_indexes(temp_db):
+    plans = asyncio.run(_plans())
+    assert len(plans) >= 10
+    scans = {sql: plan for sql, plan in plans.items() if any(_SCAN.match(step) for step in plan)}
+    assert not scans, "\n".join(f"{sql}\n    {plan}" for sql, plan in scans.items())
@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+from scheduler import ExpiryScheduler
+
+
+async def _schedule_during_load():
+    scheduler = ExpiryScheduler()
+    fired = []
+
+    async def handler(key, deadline):
+        fired.append(key)
+
+    async def loader():
+        # Модератор выдал мут, пока лидер читал сроки из БД
+        scheduler.schedule(int(time.time()) - 1, "mute", "new")
+        await asyncio.sleep(0)
+        return [(int(time.time()) - 1, "mute", "from_db")]
+
+    scheduler.register("mute", handler)
+    task = asyncio.create_task(scheduler.run(loader))
+    try:
+        for _ in range(50):
+            if len(fired) == 2:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    return fired
+
+
+def test_deadline_scheduled_while_loading_is_kept():
+    assert sorted(asyncio.run(_schedule_during_load())) == ["from_db", "new"]
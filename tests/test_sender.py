@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from sender import MessageSender, TokenBucket
+
+
+class FloodedBot:
+    """Первое сообщение получает 429 с retry_after, остальные доставляются."""
+
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        self.delivered = []
+        self.started = time.monotonic()
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        if self.retry_after:
+            retry_after, self.retry_after = self.retry_after, 0
+            raise TelegramRetryAfter(method=SendMessage(chat_id=chat_id, text=text), message="Too Many Requests", retry_after=retry_after)
+        self.delivered.append((chat_id, time.monotonic() - self.started))
+
+
+async def _send_after_flood_limit():
+    bot = FloodedBot(retry_after=1)
+    sender = MessageSender(bot, global_rate=100, private_rate=100, group_rate=100)
+    sender.send_message(1, "первое")
+    await asyncio.sleep(0.05)
+    # Другой чат: его ведро свободно, но бот целиком под ограничением
+    sender.send_message(2, "второе")
+    await sender.close(timeout=5)
+    return bot.delivered
+
+
+def test_retry_after_pauses_every_chat():
+    delivered = dict(asyncio.run(_send_after_flood_limit()))
+
+    assert set(delivered) == {1, 2}
+    assert delivered[2] >= 1
+
+
+def test_pauses_do_not_add_up():
+    bucket = TokenBucket(rate=10, capacity=10)
+    bucket.pause(5)
+    bucket.pause(5)
+    bucket.pause(2)
+
+    assert bucket.tokens == pytest.approx(-50, abs=0.5)
@@ -0,0 +1,57 @@
+import pytest
+
+from word_filter import ForbiddenWords, normalize_text
+
+
+@pytest.fixture
+def forbidden(tmp_path):
+    path = tmp_path / "forbidden_words.txt"
+    path.write_text("слово\nспам\nслово0\n", encoding="utf-8")
+    return ForbiddenWords(str(path)).get()
+
+
+@pytest.mark.parametrize("text", [
+    "ну ты и слово",
+    "С Л О В О",
+    "с.л.о.в.о",
+    "с-л-о-в-о!",
+    "cлoвo",
+    "слоооово",
+    "сл0во",
+    "сл​ово",
+    "сп@м",
+])
+def test_obfuscated_words_are_found(forbidden, text):
+    assert forbidden.search(normalize_text(text))
+
+
+@pytest.mark.parametrize("text", [
+    "я и ты",
+    "а.б",
+    "с лово",
+    "с.п ам",
+    "100500 спасибо",
+    "код 2024, 0346",
+])
+def test_ordinary_text_is_not_glued_into_words(forbidden, text):
+    assert not forbidden.search(normalize_text(text))
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("я и ты", "я и ты"),
+    ("a.b", "а в"),
+    ("с л о в о", "слово"),
+    ("2024 год", "2024 год"),
+    ("вася1", "вася1"),
+    ("сл0во", "слово"),
+])
+def test_normalize_text(text, expected):
+    assert normalize_text(text) == expected
+
+
+def test_digit_at_word_edge_does_not_ban_plain_word(tmp_path):
+    path = tmp_path / "forbidden_words.txt"
+    path.write_text("слово0\n", encoding="utf-8")
+    matcher = ForbiddenWords(str(path)).get()
+    assert not matcher.search(normalize_text("просто слово"))
+    assert matcher.search(normalize_text("слово0"))
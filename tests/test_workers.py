@@ -0,0 +1,55 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from aiohttp import web
+
+import workers
+
+
+async def _poll_and_stop():
+    requests = []
+    delivered = asyncio.Event()
+    release = asyncio.Event()
+
+    async def get_updates(request: web.Request) -> web.Response:
+        params = await request.json()
+        requests.append(params)
+        if len(requests) == 1:
+            result = [{"update_id": 7, "message": {}}, {"update_id": 8, "message": {}}]
+        elif params.get("timeout"):
+            # Long polling без новых обновлений: держим запрос, пока клиент его не отменит
+            delivered.set()
+            await release.wait()
+            result = []
+        else:
+            result = []
+        return web.Response(text=json.dumps({"ok": True, "result": result}), content_type="application/json")
+
+    app = web.Application()
+    app.router.add_post("/getUpdates", get_updates)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    bot = SimpleNamespace(token="123456:TEST-TOKEN", session=SimpleNamespace(api=SimpleNamespace(api_url=lambda token, method: f"http://127.0.0.1:{port}/{method}")))
+    pool = SimpleNamespace(updates=[])
+    pool.put = pool.updates.append
+    try:
+        # Диспетчер останавливает приём обновлений отменой задачи, как в run_dispatcher
+        receiver = asyncio.create_task(workers.poll_updates(bot, pool, ["message"], asyncio.Event()))
+        await asyncio.wait_for(delivered.wait(), 5)
+        receiver.cancel()
+        await asyncio.gather(receiver, return_exceptions=True)
+    finally:
+        release.set()
+        await runner.cleanup()
+    return pool.updates, requests
+
+
+def test_poll_updates_confirms_offset_on_shutdown():
+    updates, requests = asyncio.run(_poll_and_stop())
+
+    assert [update["update_id"] for update in updates] == [7, 8]
+    assert requests[-1] == {"offset": 9, "limit": 1, "timeout": 0}
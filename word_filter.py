@@ -0,0 +1,199 @@
+import logging
+import os
+import re
+import unicodedata
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+# Нормализация текста перед поиском запрещённых слов. Одинаково применяется к сообщению
+# и к словам из файла, поэтому обход фильтра заменой букв, точками между буквами
+# или невидимыми символами не помогает. Растянутые буквы ("слоооово") схлопывает WordMatcher.
+# Нормализация не должна склеивать обычные слова: фильтр банит автоматически.
+
+# Похожие на кириллицу буквы других алфавитов -> кириллица ("скелет" слова).
+# Заглавные латинские B, H, M, T, K после casefold превращаются в строчные, поэтому они тоже здесь
+_SKELETON = {
+    "a": "а", "b": "в", "c": "с", "e": "е", "h": "н", "k": "к", "m": "м", "o": "о", "p": "р", "t": "т", "x": "х", "y": "у",
+    "α": "а", "β": "в", "ε": "е", "κ": "к", "ο": "о", "ρ": "р", "τ": "т", "χ": "х",
+    "ё": "е",
+}
+# Цифры и @ заменяются буквами только внутри слова, между буквами ("сл0во"): числа ("2000")
+# и цифры на краю слова ("слово0", "вася1") остаются цифрами
+_DIGIT_SKELETON = {ord("0"): "о", ord("3"): "з", ord("4"): "ч", ord("6"): "б", ord("@"): "а"}
+_BETWEEN_LETTERS = re.compile(r"(?<=[^\W\d_])[\d@]+(?=[^\W\d_])")
+# Таблица для str.translate по коду символа (вся базовая плоскость Unicode): скелет для букв,
+# сам символ для букв, цифр и @, None (удалить) для невидимых и комбинируемых символов,
+# пробел для пробельных символов, знаков препинания и прочих символов — они разделяют слова.
+# Список, а не словарь: translate не ловит KeyError на каждом символе
+_TABLE_SIZE = 0x10000
+_INVISIBLE = {"Cc", "Cf", "Mn", "Me"}
+
+
+def _build_table() -> list:
+    table = []
+    for code in range(_TABLE_SIZE):
+        ch = chr(code)
+        if ch in _SKELETON:
+            table.append(_SKELETON[ch])
+        elif ch.isalnum() or ch == "@":
+            table.append(code)
+        elif ch.isspace():
+            table.append(" ")
+        elif unicodedata.category(ch) in _INVISIBLE:
+            table.append(None)
+        else:
+            table.append(" ")
+    return table
+
+
+_TABLE = _build_table()
+# Та же таблица, но цифры и @ -> буквы: для слов, уже прошедших _TABLE
+_DIGIT_TABLE = [_DIGIT_SKELETON.get(code, target) for code, target in enumerate(_TABLE)]
+_HAS_DIGIT = re.compile(r"\d")
+# Символы за пределами таблицы translate оставляет как есть (эмодзи и т.п.) — их заменяет регулярное выражение
+_OUTSIDE_TABLE = re.compile(r"[^\x00-\uffff]")
+# Слово, набранное по одной букве через пробелы или знаки ("с л о в о", "с.л.о.в.о"), склеивается,
+# только если таких букв подряд не меньше трёх: "я и ты" остаётся как есть
+_MIN_SPELLED_LETTERS = 3
+
+
+def _unmask(match: re.Match) -> str:
+    return match.group().translate(_DIGIT_TABLE)
+
+
+def normalize_text(text: str) -> str:
+    """
+    NFKC и нижний регистр, замена похожих символов, знаки и символы — разделители слов,
+    невидимые символы удаляются; склейка слов, набранных по одной букве ("с л о в о").
+    """
+    text = unicodedata.normalize("NFKC", text).casefold().translate(_TABLE)
+    if _OUTSIDE_TABLE.search(text):
+        text = _OUTSIDE_TABLE.sub(" ", text)
+    if "@" in text:
+        # @ вне слова ("@username") — разделитель
+        text = _BETWEEN_LETTERS.sub(_unmask, text).replace("@", " ")
+    has_digits = _HAS_DIGIT.search(text) is not None
+    words = []
+    letters = []
+    for word in text.split():
+        if len(word) == 1 and word.isalpha():
+            letters.append(word)
+            continue
+        if letters:
+            if len(letters) >= _MIN_SPELLED_LETTERS:
+                words.append("".join(letters))
+            else:
+                words.extend(letters)
+            letters = []
+        # В слове остались только буквы и цифры: если оно начинается и кончается буквой,
+        # все цифры стоят между буквами. Регулярное выражение — только для цифр на краю ("вася1")
+        if has_digits and not word.isalpha() and not word.isdigit():
+            if word[0].isalpha() and word[-1].isalpha():
+                word = word.translate(_DIGIT_TABLE)
+            else:
+                word = _BETWEEN_LETTERS.sub(_unmask, word)
+        words.append(word)
+    if len(letters) >= _MIN_SPELLED_LETTERS:
+        words.append("".join(letters))
+    else:
+        words.extend(letters)
+    return " ".join(words)
+
+
+class WordMatcher:
+    """
+    Автомат Ахо-Корасик по списку запрещённых слов.
+    Поиск проходит по тексту один раз, независимо от количества слов.
+    """
+
+    def __init__(self, words):
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.output: list[bool] = [False]
+        for word in words:
+            self._add(word)
+        self._build()
+
+    def _add(self, word: str):
+        state = 0
+        previous = None
+        for ch in word:
+            # Повторы букв схлопываются так же, как при поиске
+            if ch == previous:
+                continue
+            previous = ch
+            next_state = self.goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][ch] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(False)
+            state = next_state
+        self.output[state] = True
+
+    def _build(self):
+        # Обход в ширину: ссылка неудачи ведёт в самый длинный собственный суффикс, который есть в боре
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(ch, 0)
+                if self.output[self.fail[next_state]]:
+                    self.output[next_state] = True
+
+    def __bool__(self) -> bool:
+        return len(self.goto) > 1
+
+    def search(self, text: str) -> bool:
+        """
+        Возвращает True, если в тексте встречается хотя бы одно слово.
+        Подряд идущие одинаковые символы считаются одним: "слоооово" находит "слово".
+        """
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        previous = None
+        for ch in text:
+            if ch == previous:
+                continue
+            previous = ch
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                return True
+        return False
+
+
+class ForbiddenWords:
+    """
+    Список запрещённых слов из файла, скомпилированный в WordMatcher.
+    Файл перечитывается только при изменении его mtime.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.mtime: float | None = None
+        self.matcher = WordMatcher([])
+
+    def get(self) -> WordMatcher:
+        try:
+            mtime = os.stat(self.file_path).st_mtime
+        except FileNotFoundError:
+            self.mtime = None
+            self.matcher = WordMatcher([])
+            return self.matcher
+        if mtime != self.mtime:
+            # Читаем файл и нормализуем слова так же, как текст сообщений (пустые строки пропускаем)
+            with open(self.file_path, "r", encoding="utf-8") as file:
+                words = [word for word in (normalize_text(line).strip() for line in file) if word]
+            self.matcher = WordMatcher(words)
+            self.mtime = mtime
+            logger.info("Список запрещённых слов загружен: %s слов.", len(words))
+        return self.matcher
@@ -0,0 +1,348 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from config import WORKERS, LEASE_TTL, BOT_MODE, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET
+from database import db
+from scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+
+# Многопроцессный режим (WORKERS > 1).
+# Процесс-диспетчер получает обновления (getUpdates или webhook) и, не разбирая их,
+# раскладывает по очередям рабочих процессов: обновления одного пользователя всегда
+# попадают в один и тот же процесс, поэтому порядок его сообщений и шагов диалога сохраняется.
+# Рабочие процессы обрабатывают обновления обычным dp.feed_raw_update.
+# Проверки, которым нужны сообщения всех пользователей сразу (волны одинаковых сообщений),
+# диспетчер делает сам (WorkerPool.inspect) и передаёт рабочему процессу задание {имя: данные}.
+
+
+def route(update: dict, workers: int) -> int:
+    """Номер рабочего процесса для обновления: по отправителю, а если его нет — по чату."""
+    for payload in update.values():
+        if not isinstance(payload, dict):
+            continue
+        sender = payload.get("from") or payload.get("user")
+        if sender:
+            return sender["id"] % workers
+        chat = payload.get("chat") or payload.get("message", {}).get("chat")
+        if chat:
+            return chat["id"] % workers
+    return update.get("update_id", 0) % workers
+
+
+class LeaderLease:
+    """
+    Аренда лидерства в таблице leases: владелец продлевает её раньше, чем истечёт ttl,
+    а другой процесс может забрать её только после истечения.
+    """
+
+    def __init__(self, name: str, ttl: float = 30):
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def acquire(self) -> bool:
+        """Берёт или продлевает аренду. Возвращает True, если этот процесс — лидер."""
+        now = time.time()
+        async with db.write() as conn:
+            await conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                (self.name, self.owner, now + self.ttl, now)
+            )
+            async with conn.execute("SELECT owner FROM leases WHERE name = ?", (self.name,)) as cursor:
+                row = await cursor.fetchone()
+        return row is not None and row[0] == self.owner
+
+    async def release(self):
+        async with db.write() as conn:
+            await conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (self.name, self.owner))
+
+
+class DeadlineQueue:
+    """
+    Сроки банов, мутов и предупреждений, выданных в процессах-нелидерах, передаются лидеру
+    через таблицу pending_deadlines. Лидер читает только новые строки (id > последнего
+    прочитанного) по первичному ключу — без новых сроков это пустой запрос, а не перечитывание всех сроков.
+    """
+
+    def __init__(self):
+        self.last_id = 0
+
+    async def publish(self, deadline: int, kind: str, key):
+        try:
+            async with db.write() as conn:
+                await conn.execute("INSERT INTO pending_deadlines (deadline, kind, key) VALUES (?, ?, ?)", (deadline, kind, key))
+        except Exception as e:
+            logger.error("Ошибка передачи срока %s для %s лидеру: %s", kind, key, e)
+
+    async def skip_to_end(self):
+        """Перед полной загрузкой сроков из БД: всё, что уже в очереди, загрузка и так увидит."""
+        async with db.write() as conn:
+            async with conn.execute("SELECT COALESCE(MAX(id), 0) FROM pending_deadlines") as cursor:
+                self.last_id = (await cursor.fetchone())[0]
+            await conn.execute("DELETE FROM pending_deadlines WHERE id <= ?", (self.last_id,))
+
+    async def fetch(self) -> list[tuple[int, str, str | int]]:
+        """Новые сроки из очереди; прочитанные строки удаляются."""
+        rows = await db.fetchall("SELECT id, deadline, kind, key FROM pending_deadlines WHERE id > ? ORDER BY id", (self.last_id,))
+        if not rows:
+            return []
+        self.last_id = rows[-1][0]
+        async with db.write() as conn:
+            await conn.execute("DELETE FROM pending_deadlines WHERE id <= ?", (self.last_id,))
+        return [(deadline, kind, key) for _, deadline, kind, key in rows]
+
+
+async def run_expiry_leader(run_scheduler):
+    """
+    Запускает планировщик истечений только в процессе, владеющем арендой "expiry".
+    Все сроки из БД загружаются один раз — когда процесс становится лидером (или перезапускает
+    упавший планировщик); о сроках, выданных потом в других процессах, лидер узнаёт из DeadlineQueue.
+    """
+    lease = LeaderLease("expiry", LEASE_TTL)
+    queue = DeadlineQueue()
+    scheduler.set_publisher(queue.publish)
+    task = None
+    try:
+        while True:
+            try:
+                leader = await lease.acquire()
+            except Exception as e:
+                logger.error("Ошибка продления аренды лидера: %s", e)
+                leader = False
+            if task is not None and task.done():
+                error = None if task.cancelled() else task.exception()
+                logger.error("Планировщик истечений остановился: %s", error)
+                task = None
+            if leader and task is None:
+                logger.info("Процесс %s стал лидером и запускает планировщик истечений", lease.owner)
+                try:
+                    await queue.skip_to_end()
+                    task = asyncio.create_task(run_scheduler())
+                except Exception as e:
+                    logger.error("Ошибка запуска планировщика истечений: %s", e)
+            elif leader:
+                try:
+                    scheduler.push(await queue.fetch())
+                except Exception as e:
+                    logger.error("Ошибка чтения новых сроков: %s", e)
+            elif not leader and task is not None:
+                logger.warning("Процесс %s потерял лидерство", lease.owner)
+                task.cancel()
+                task = None
+            await asyncio.sleep(lease.ttl / 3)
+    finally:
+        if task is not None:
+            task.cancel()
+            try:
+                await lease.release()
+            except Exception as e:
+                logger.error("Ошибка освобождения аренды лидера: %s", e)
+
+
+async def serve_updates(dp: Dispatcher, bot: Bot, updates: multiprocessing.Queue, index: int, jobs: dict | None = None):
+    """
+    Цикл рабочего процесса: берёт обновления из своей очереди, пока не придёт None.
+    jobs — {имя: корутина(данные)} для заданий диспетчера; остальное — обновления Telegram.
+    """
+    loop = asyncio.get_running_loop()
+    tasks: set[asyncio.Task] = set()
+    await dp.emit_startup(bot=bot)
+    logger.info("Рабочий процесс %s запущен (pid %s)", index, os.getpid())
+    try:
+        while True:
+            update = await loop.run_in_executor(None, updates.get)
+            if update is None:
+                break
+            job = next((name for name in jobs if name in update), None) if jobs else None
+            if job is not None:
+                task = asyncio.create_task(jobs[job](update[job]))
+            else:
+                task = asyncio.create_task(dp.feed_raw_update(bot, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        try:
+            await dp.emit_shutdown(bot=bot)
+        finally:
+            await bot.session.close()
+        logger.info("Рабочий процесс %s остановлен", index)
+
+
+def ignore_stop_signals():
+    """Рабочие процессы останавливает диспетчер (через None в очереди), а не Ctrl+C/SIGTERM."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+class WorkerPool:
+    """
+    Рабочие процессы и их очереди; упавший процесс перезапускается с той же очередью.
+    inspect(update) — необязательная проверка в диспетчере: возвращает задание {имя: данные}
+    или None; задание уходит в тот же процесс сразу после обновления.
+    """
+
+    def __init__(self, target, count: int, inspect=None):
+        self.target = target
+        self.count = count
+        self.inspect = inspect
+        self.context = multiprocessing.get_context("spawn")
+        self.queues = [self.context.Queue() for _ in range(count)]
+        self.processes: list[multiprocessing.Process | None] = [None] * count
+
+    def _start(self, index: int):
+        process = self.context.Process(target=self.target, args=(index, self.queues[index]), name=f"bot-worker-{index}")
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.count):
+            self._start(index)
+
+    def put(self, update: dict):
+        queue = self.queues[route(update, self.count)]
+        queue.put(update)
+        if self.inspect is None:
+            return
+        try:
+            job = self.inspect(update)
+        except Exception as e:
+            logger.error("Ошибка проверки обновления в диспетчере: %s", e)
+            return
+        if job:
+            queue.put(job)
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(5)
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logger.warning("Рабочий процесс %s завершился с кодом %s, перезапускаем", index, process.exitcode)
+                    self._start(index)
+
+    async def stop(self, timeout: float = 15):
+        for queue in self.queues:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                # SIGTERM рабочие игнорируют, поэтому зависший процесс убиваем
+                logger.warning("Рабочий процесс %s не остановился за %s сек, завершаем принудительно", process.name, timeout)
+                process.kill()
+                process.join()
+
+
+async def poll_updates(bot: Bot, pool: WorkerPool, allowed_updates: list[str], stop: asyncio.Event):
+    """getUpdates в процессе-диспетчере: JSON обновлений передаётся рабочим без разбора в объекты aiogram."""
+    url = bot.session.api.api_url(token=bot.token, method="getUpdates")
+    offset = None
+    async with aiohttp.ClientSession() as http:
+        try:
+            while not stop.is_set():
+                params = {"timeout": 30, "allowed_updates": allowed_updates}
+                if offset is not None:
+                    params["offset"] = offset
+                try:
+                    async with http.post(url, json=params, timeout=aiohttp.ClientTimeout(total=60)) as response:
+                        payload = await response.json()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.error("Ошибка getUpdates: %s", e)
+                    await asyncio.sleep(5)
+                    continue
+                if not payload.get("ok"):
+                    retry_after = payload.get("parameters", {}).get("retry_after", 5)
+                    logger.error("getUpdates вернул ошибку: %s", payload.get('description'))
+                    await asyncio.sleep(retry_after)
+                    continue
+                for update in payload["result"]:
+                    pool.put(update)
+                    offset = update["update_id"] + 1
+        finally:
+            # Telegram считает обновления полученными только после запроса со следующим offset:
+            # без него последняя пачка придёт снова после перезапуска и действия выполнятся дважды
+            if offset is not None:
+                await confirm_offset(http, url, offset)
+
+
+async def confirm_offset(http: aiohttp.ClientSession, url: str, offset: int):
+    try:
+        async with http.post(url, json={"offset": offset, "limit": 1, "timeout": 0}, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            await response.read()
+        logger.info("Подтверждены обновления до %s", offset - 1)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error("Не удалось подтвердить обновления до %s: %s", offset - 1, e)
+
+
+async def serve_webhook(bot: Bot, pool: WorkerPool, allowed_updates: list[str], stop: asyncio.Event):
+    """Webhook в процессе-диспетчере: проверяет секрет и сразу отвечает 200, обработка — в рабочих."""
+    async def handle(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        pool.put(json.loads(await request.read()))
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info("Webhook-сервер запущен на http://%s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None, allowed_updates=allowed_updates)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_dispatcher(bot: Bot, dp: Dispatcher, target, inspect=None):
+    """Процесс-диспетчер: запускает WORKERS рабочих процессов и раздаёт им обновления (inspect — см. WorkerPool)."""
+    pool = WorkerPool(target, WORKERS, inspect)
+    pool.start()
+    logger.info("Запущено рабочих процессов: %s", WORKERS)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    allowed_updates = dp.resolve_used_update_types()
+    watcher = asyncio.create_task(pool.watch())
+    try:
+        if BOT_MODE == "webhook":
+            receiver = asyncio.create_task(serve_webhook(bot, pool, allowed_updates, stop))
+        else:
+            await bot.delete_webhook()
+            receiver = asyncio.create_task(poll_updates(bot, pool, allowed_updates, stop))
+        # Останавливаемся по сигналу или если приём обновлений упал
+        stopper = asyncio.create_task(stop.wait())
+        await asyncio.wait([receiver, stopper], return_when=asyncio.FIRST_COMPLETED)
+        for task in (receiver, stopper):
+            task.cancel()
+        if receiver.done() and not receiver.cancelled() and receiver.exception():
+            logger.error("Приём обновлений остановлен из-за ошибки: %s", receiver.exception())
+        await asyncio.gather(receiver, stopper, return_exceptions=True)
+    finally:
+        logger.info("Останавливаем рабочие процессы...")
+        watcher.cancel()
+        await pool.stop()
+        await bot.session.close()